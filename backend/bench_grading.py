@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+bench_grading.py  —  Offline benchmark of the grading pipeline.
+Run from the backend directory:
+  python3 bench_grading.py                          # 200 candidates, stub provider
+  python3 bench_grading.py --candidates 1000 --duplicate-rate 0.3 --low-effort-rate 0.1
+  STUB_LATENCY_MEDIAN_MS=1500 STUB_ERROR_RATE=0.05 python3 bench_grading.py
+
+Generates one paper per candidate from the question banks, fills in synthetic
+answers and grades every paper concurrently through grade_paper — the same
+path grading_queue takes — then prints throughput, per-paper latency
+percentiles and the AI layer's counters. Uses AI_PROVIDER=stub
+(services/grading_providers.py) unless --provider says otherwise, and runs
+with the response cache off unless --cache is given. No database needed.
+The client-side rate limit still applies — set CLAUDE_REQUESTS_PER_MINUTE=0
+to measure the pipeline alone.
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import statistics
+import time
+
+from config import settings
+from services import ai_engine
+from services.ai_resilience import AIUnavailableError, metrics as ai_metrics
+from services.banks import bank_registry
+from services.copy_detection import warm as warm_copy_detection
+from services.generator import QuestionBankService
+from services.grading import cascade_stats, pregrade_stats
+from services.sections import grade_paper
+from services.similarity import warm as warm_similarity
+
+TEMPLATE = [
+    {"type": "video", "count": 2, "marks": 15},
+    {"type": "image", "count": 2, "marks": 15},
+    {"type": "reading", "count": 1, "marks": 15},
+    {"type": "mcq-grammar", "count": 5, "marks": 2},
+    {"type": "jumble", "count": 2, "marks": 2},
+    {"type": "typing", "count": 1, "marks": 10},
+]
+
+WORDS = "the a robot arm picks up red blue cup table box moves slowly towards places near window door".split()
+
+
+def _answer(q, rng: random.Random, duplicate_rate: float, low_effort_rate: float) -> str:
+    qtype = q["type"]
+    if qtype.startswith("typing"):
+        passage = (q.get("content") or {}).get("passage") or ""
+        return json.dumps({"typed_text": passage[:120], "time_seconds": 40})
+    if qtype.startswith("mcq"):
+        return rng.choice("ABCD")
+    if qtype == "jumble":
+        return "A B C D"
+    if rng.random() < low_effort_rate:
+        return rng.choice(["idk", "asdf qwer zxcv", "nothing"])   # caught by the pre-grader
+    if rng.random() < duplicate_rate:
+        return "the robot picks up the red cup"   # a common answer — exercises deduplication
+    return " ".join(rng.choice(WORDS) for _ in range(rng.randint(6, 18)))
+
+
+def _percentile(values, pct: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+async def main(args):
+    settings.AI_PROVIDER = args.provider
+    settings.AI_CACHE_ENABLED = args.cache
+    loaded = bank_registry.load_all()
+    print(f"✅ Loaded {loaded} question banks into memory")
+    warm_similarity()
+    warm_copy_detection()
+    ai_engine.init_grading_provider()
+
+    rng = random.Random(args.seed)
+    papers = []
+    for _ in range(args.candidates):
+        questions = QuestionBankService.generate_paper(TEMPLATE)
+        answers = {str(q["temp_id"]): _answer(q, rng, args.duplicate_rate, args.low_effort_rate) for q in questions}
+        papers.append((questions, answers))
+
+    latencies, deferred = [], 0
+
+    async def grade_one(questions, answers):
+        nonlocal deferred
+        started = time.perf_counter()
+        try:
+            await grade_paper(questions, answers, None)
+        except AIUnavailableError:
+            deferred += 1   # grading_queue would re-queue this paper
+            return
+        latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(grade_one(q, a) for q, a in papers))
+    elapsed = time.perf_counter() - started
+    await ai_engine.close_grading_provider()
+
+    print(f"\nProvider {args.provider} · {args.candidates} papers in {elapsed:.2f}s "
+          f"({len(latencies) / elapsed:.1f} papers/s) · {deferred} deferred")
+    if latencies:
+        print("Per-paper latency (s): "
+              f"mean {statistics.mean(latencies):.2f} · p50 {_percentile(latencies, 50):.2f} · "
+              f"p95 {_percentile(latencies, 95):.2f} · p99 {_percentile(latencies, 99):.2f} · "
+              f"max {max(latencies):.2f}")
+    print(f"AI calls: {json.dumps(ai_metrics())}")
+    print(f"Deduplicated gradings: {ai_engine.dedupe_stats['coalesced']} · "
+          f"pre-graded Bad without AI: {pregrade_stats['short_circuited']}/{pregrade_stats['checked']} · "
+          f"cascade ranked locally: {cascade_stats['local_bad'] + cascade_stats['local_good']}/{cascade_stats['checked']}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark grade_paper offline")
+    parser.add_argument("--candidates", type=int, default=200)
+    parser.add_argument("--provider", default="stub", choices=["stub", "anthropic"])
+    parser.add_argument("--duplicate-rate", type=float, default=0.0,
+                        help="share of free-text answers given identically by many candidates")
+    parser.add_argument("--low-effort-rate", type=float, default=0.0,
+                        help="share of free-text answers that are blank-ish or gibberish")
+    parser.add_argument("--cache", action="store_true", help="keep the persistent response cache on")
+    parser.add_argument("--seed", type=int, default=0)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+"""
+calibrate_cascade.py  —  Fit the visual grading cascade against past Claude grades.
+Run from the backend directory:
+  python3 calibrate_cascade.py                   # every graded test → CASCADE_CALIBRATION_PATH
+  python3 calibrate_cascade.py --test-id 12 --test-id 14
+  python3 calibrate_cascade.py --evaluate        # score the current calibration file, write nothing
+
+Replays every Claude-graded video / image answer in the stored results
+through the local scorer (services/local_scorer.py) and compares with the
+rank Claude gave. Per question type it fits the Bad and Good thresholds on
+most results, reports agreement and the share of Claude calls the cascade
+would have saved on the held-out rest (--holdout), then refits on all of
+them and writes the calibration file. Answers ranked by the pre-grader or
+the cascade itself, failed evaluations and admin overrides are left out.
+Turn the cascade on with AI_CASCADE_ENABLED=true once the numbers look right.
+"""
+
+import argparse
+import asyncio
+import json
+import random
+from collections import defaultdict
+from datetime import datetime, timezone
+from typing import Dict, List, Tuple
+
+from sqlalchemy import distinct
+from sqlalchemy.future import select
+
+from config import settings
+from database import AsyncSessionLocal
+from models import TestResult
+from services import bank_versions, local_scorer
+from services.banks import bank_registry
+from services.reevaluation import _load_chunk
+from services.results import unwrap_breakdown
+from services.sections import VISUAL_TYPES
+from services.session_store import expand_paper
+
+RANKS = ("Good", "Medium", "Bad")
+FAILED_FEEDBACK = ("Evaluation Error", "AI schema error")
+
+Samples = Dict[str, List[Tuple[int, local_scorer.Sample]]]   # question type -> [(result id, sample)]
+
+
+def _samples_of(result, session, samples: Samples) -> int:
+    questions, _, _ = unwrap_breakdown(result.ai_breakdown)
+    question_map = {q["temp_id"]: q for q in expand_paper(session.generated_questions) if "temp_id" in q}
+    answers = session.answers or {}
+    added = 0
+    for item in questions:
+        q_type = item.get("type", "")
+        feedback = item.get("ai_feedback") or {}
+        if q_type not in VISUAL_TYPES or "override_score" in item:
+            continue
+        if feedback.get("rank") not in RANKS or feedback.get("pre_graded") or feedback.get("local_graded"):
+            continue
+        if str(feedback.get("feedback", "")).startswith(FAILED_FEEDBACK):
+            continue
+        q_id = item.get("question_id")
+        student_text = str(answers.get(str(q_id), answers.get(q_id, ""))).strip()
+        grading_config = question_map.get(q_id, {}).get("grading_config") or {}
+        if not student_text or not grading_config.get("reference"):
+            continue
+        local_score = local_scorer.score(
+            student_text,
+            grading_config["reference"],
+            grading_config.get("alternative_answers", []),
+            grading_config.get("acceptable_synonyms", {}),
+        )
+        samples[q_type].append((result.id, (local_score, feedback["rank"])))
+        added += 1
+    return added
+
+
+async def _collect(test_ids: List[int]) -> Samples:
+    async with AsyncSessionLocal() as db:
+        if not test_ids:
+            test_ids = (await db.execute(
+                select(distinct(TestResult.test_id))
+                .where(TestResult.status.in_(("graded", "re-evaluated")))
+                .order_by(TestResult.test_id)
+            )).scalars().all()
+    samples: Samples = defaultdict(list)
+    for test_id in test_ids:
+        after_id, answers = 0, 0
+        while True:
+            chunk = await _load_chunk(test_id, after_id, settings.REEVAL_CHUNK_SIZE)
+            if not chunk:
+                break
+            after_id = chunk[-1][0].id
+            await bank_versions.load(*(session.generated_questions for _, session in chunk if session))
+            for result, session in chunk:
+                if session is not None:
+                    answers += _samples_of(result, session, samples)
+        print(f"[CASCADE] Test {test_id}: {answers} Claude-graded visual answers")
+    return samples
+
+
+def _report(q_type: str, label: str, thresholds: dict, report: dict):
+    agreement = "—" if report["agreement"] is None else f"{report['agreement']:.1%}"
+    bands = " · ".join(
+        f"{rank} {band['decided']} ({'—' if band['agreement'] is None else format(band['agreement'], '.1%')})"
+        for rank, band in report["bands"].items()
+    )
+    print(f"  {q_type:<12} {label:<9} n={report['samples']:<5} bad_below={thresholds.get('bad_below')} "
+          f"good_from={thresholds.get('good_from')} · calls saved {report['calls_saved']:.1%} · "
+          f"agreement {agreement} · {bands}")
+
+
+async def main(args):
+    loaded = bank_registry.load_all()
+    print(f"✅ Loaded {loaded} question banks into memory")
+    samples = await _collect(args.test_id)
+    if not samples:
+        print("No Claude-graded visual answers found — nothing to calibrate.")
+        return
+
+    if args.evaluate:
+        calibration = local_scorer.load_calibration()
+        print(f"\nCurrent calibration ({settings.CASCADE_CALIBRATION_PATH}) on all stored answers:")
+        for q_type, entries in sorted(samples.items()):
+            thresholds = calibration.get(q_type) or {}
+            _report(q_type, "all", thresholds, local_scorer.evaluate([s for _, s in entries], thresholds))
+        return
+
+    print(f"\nTarget agreement {args.target:.0%} per band, at least {args.min_samples} answers per band:")
+    rng = random.Random(args.seed)
+    held_out = {}
+    calibration = {}
+    for q_type, entries in sorted(samples.items()):
+        # Split by result, so one candidate's answers never sit on both sides
+        for result_id, _ in entries:
+            if result_id not in held_out:
+                held_out[result_id] = rng.random() < args.holdout
+        train = [s for rid, s in entries if not held_out[rid]]
+        test = [s for rid, s in entries if held_out[rid]]
+        if test:
+            fitted = local_scorer.fit_thresholds(train, args.target, args.min_samples)
+            _report(q_type, "held-out", fitted, local_scorer.evaluate(test, fitted))
+
+        everything = [s for _, s in entries]
+        thresholds = local_scorer.fit_thresholds(everything, args.target, args.min_samples)
+        _report(q_type, "all", thresholds, local_scorer.evaluate(everything, thresholds))
+        calibration[q_type] = {**thresholds, "samples": len(everything)}
+
+    if args.dry_run:
+        return
+    with open(settings.CASCADE_CALIBRATION_PATH, "w") as f:
+        json.dump({
+            "calibrated_at": datetime.now(timezone.utc).isoformat(),
+            "target_agreement": args.target,
+            "min_samples": args.min_samples,
+            "types": calibration,
+        }, f, indent=2)
+    print(f"\n✅ Wrote {settings.CASCADE_CALIBRATION_PATH}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Calibrate the local scorer of the visual grading cascade")
+    parser.add_argument("--test-id", type=int, action="append", default=[],
+                        help="only use results of this test (repeatable; default all tests)")
+    parser.add_argument("--evaluate", action="store_true", help="evaluate the existing calibration file instead")
+    parser.add_argument("--target", type=float, default=settings.CASCADE_TARGET_AGREEMENT)
+    parser.add_argument("--min-samples", type=int, default=settings.CASCADE_MIN_SAMPLES)
+    parser.add_argument("--holdout", type=float, default=0.2, help="share of results held out for the report")
+    parser.add_argument("--dry-run", action="store_true", help="report only, do not write the calibration file")
+    parser.add_argument("--seed", type=int, default=0)
+    asyncio.run(main(parser.parse_args()))
@@ -25,10 +25,105 @@ class Settings(BaseSettings):
     OPENAI_API_KEY: str = "sk-placeholder"
     GEMINI_API_KEY: str = "placeholder_key"  # Legacy — kept for reference
     ANTHROPIC_API_KEY: str = "placeholder_key"  # Claude 3.5 Sonnet
+    # Grading backend (services/grading_providers.py): "anthropic" or the offline "stub"
+    AI_PROVIDER: str = "anthropic"
+    AI_MODEL: str = "claude-haiku-4-5-20251001"
+    # Stub provider: log-normal latency, injected API / schema errors, run seed
+    STUB_LATENCY_MEDIAN_MS: float = 800.0
+    STUB_LATENCY_SIGMA: float = 0.5
+    STUB_ERROR_RATE: float = 0.0
+    STUB_ERROR_STATUS: int = 529
+    STUB_SCHEMA_ERROR_RATE: float = 0.0
+    STUB_SEED: int = 0
+
+    # Max AI-graded questions evaluated at once, across all submissions in this process
+    AI_GRADING_CONCURRENCY: int = 32
+
+    # Shared async Claude client: max requests in flight (also the HTTP pool size)
+    CLAUDE_MAX_CONCURRENCY: int = 32
+    # Per-request timeout, and how long idle pooled connections are kept alive
+    CLAUDE_TIMEOUT_SECONDS: float = 60.0
+    CLAUDE_KEEPALIVE_SECONDS: float = 30.0
+    # Client-side rate limit (token bucket) — match the API tier; split it between
+    # processes sharing the key (0 = unlimited)
+    CLAUDE_REQUESTS_PER_MINUTE: int = 1000
+    CLAUDE_BURST: int = 50
+    # Retries of 429 / 5xx / 529 / connection errors (full-jitter exponential backoff)
+    CLAUDE_MAX_RETRIES: int = 4
+    CLAUDE_RETRY_BASE_SECONDS: float = 1.0
+    CLAUDE_RETRY_MAX_SECONDS: float = 30.0
+    # Circuit breaker: opens after this many consecutive failed calls; grading jobs
+    # are deferred (not scored 0) until a probe call succeeds after the cooldown
+    CLAUDE_BREAKER_FAILURES: int = 5
+    CLAUDE_BREAKER_COOLDOWN_SECONDS: float = 30.0
+
+    # Persistent cache of AI grading responses (local SQLite file, LRU + TTL)
+    AI_CACHE_ENABLED: bool = True
+    AI_CACHE_PATH: str = "ai_cache.sqlite3"
+    AI_CACHE_MAX_ENTRIES: int = 100000
+    AI_CACHE_TTL_SECONDS: int = 30 * 24 * 3600
+    # Concurrent submissions of the same answer (up to whitespace) to the same item
+    # share one in-flight grading
+    AI_DEDUPE_ANSWERS: bool = True
+    # Also treat answers differing only in case/punctuation as the same answer, in
+    # the dedupe and response-cache keys. Off: the rubric grades case and punctuation
+    AI_DEDUPE_FOLD_CASE_PUNCTUATION: bool = False
+    # Grade all of a candidate's video/image answers in one packed Claude request
+    # (per-question calls as fallback) — fewer round-trips when rate-limited
+    AI_PACKED_VISUAL_GRADING: bool = False
+    # Rule-based pre-grader: obviously failing visual answers are ranked Bad
+    # without an AI call (services/grading.py)
+    AI_PREGRADE_ENABLED: bool = True
+    PREGRADE_MIN_WORDS: int = 3
+    PREGRADE_MIN_DICTIONARY_RATIO: float = 0.5
+    PREGRADE_PREFIX_MIN_OVERLAP: float = 0.12
+
+    # Grading cascade: a local similarity scorer ranks visual answers it is
+    # confident about and only the uncertain band goes to Claude
+    # (services/local_scorer.py). Thresholds come from calibrate_cascade.py;
+    # question types without a calibration always go to Claude.
+    AI_CASCADE_ENABLED: bool = False
+    CASCADE_CALIBRATION_PATH: str = "cascade_calibration.json"
+    CASCADE_TARGET_AGREEMENT: float = 0.95   # min agreement with Claude's rank in each confident band
+    CASCADE_MIN_SAMPLES: int = 30            # min historical answers in a band before it is trusted
+
+    # Reading copy detection: word-shingle containment of the summary in the
+    # passage, overall and per sentence (services/copy_detection.py)
+    COPY_SHINGLE_WORDS: int = 4
+    COPY_MAX_CONTAINMENT: float = 0.8         # whole summary: share of shingles found in the passage
+    COPY_SENTENCE_CONTAINMENT: float = 0.7    # a sentence at/above this counts as copied
+    COPY_MAX_COPIED_SENTENCES: float = 0.5    # share of copied sentences that rejects the summary
+    COPY_MIN_COPIED_SENTENCES: int = 2        # ...and at least this many of them
+
+    # Bulk re-evaluation (POST /admin/tests/{id}/re-evaluate)
+    REEVAL_BATCH_PROVIDER: str = "anthropic"   # "anthropic" (Message Batches) or "local"
+    REEVAL_BATCH_SIZE: int = 5000               # requests per submitted batch
+    REEVAL_CHUNK_SIZE: int = 50                 # results regraded + written per transaction
+    REEVAL_POLL_SECONDS: float = 30.0           # batch status polling interval
+    REEVAL_LEASE_SECONDS: int = 600             # a run is resumed elsewhere if not renewed in time
+
+    # Grade finished exams via the grading_jobs table (finish returns immediately)
+    ASYNC_GRADING: bool = True
+    GRADING_WORKERS: int = 4               # worker loops per web process (0 = only grading_worker.py)
+    GRADING_POLL_SECONDS: float = 1.0      # idle workers re-check the table this often
+    GRADING_VISIBILITY_SECONDS: int = 300  # a claimed job is retried if not finished by then
+    GRADING_MAX_ATTEMPTS: int = 3
+    GRADING_BACKOFF_SECONDS: int = 10      # first retry delay, doubled per attempt
 
     # File Storage for Videos
     VIDEO_DIR: str = "public/videos"
 
+    # Paper pool — ready-made papers kept per active template test (0 = disabled)
+    PAPER_POOL_SIZE: int = 20
+    PAPER_POOL_IDLE_SECONDS: int = 3600   # drop a test's pool after 1h without a start
+
+    # Store ExamSession papers as bank references + permutations instead of full content
+    COMPACT_SESSIONS: bool = True
+
+    # Exposure-balanced sampling — serve the least-served bank items first
+    EXPOSURE_BALANCED_SAMPLING: bool = True
+    EXPOSURE_FLUSH_SECONDS: int = 30      # how often in-memory serve counts are written to item_exposure
+
     @field_validator('SECRET_KEY')
     @classmethod
     def validate_secret_key(cls, v: str) -> str:
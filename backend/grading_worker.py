@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+"""
+grading_worker.py  —  Standalone grading worker (no HTTP).
+Run from the backend directory:
+  python3 grading_worker.py              # GRADING_WORKERS worker loops (default 4)
+  python3 grading_worker.py --workers 8
+
+Claims jobs from the grading_jobs table exactly like the in-process workers,
+so any number of these can run next to the web service (or on other nodes)
+to drain a cohort's submissions in parallel. Set GRADING_WORKERS=0 on the
+web service to grade only here.
+"""
+
+import argparse
+import asyncio
+
+from config import settings
+from database import engine, Base
+from services.ai_engine import close_grading_provider, init_grading_provider
+from services import bank_versions
+from services.banks import bank_registry
+from services.response_cache import response_cache
+from services.copy_detection import warm as warm_copy_detection
+from services.similarity import warm as warm_similarity
+from services.grading_queue import GradingQueue, ensure_active_job_index
+
+
+async def main(workers: int):
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    await ensure_active_job_index()
+    loaded = bank_registry.load_all()
+    print(f"✅ Loaded {loaded} question banks into memory")
+    print(f"✅ Recorded {await bank_versions.save()} bank versions in the database")
+    print(f"✅ Precomputed similarity vectors for {warm_similarity()} bank texts "
+          f"and shingles for {warm_copy_detection()} reading passages")
+
+    init_grading_provider()
+    queue = GradingQueue(workers=workers)
+    orphans = await queue.start()
+    print(f"✅ Grading worker started with {workers} loops ({orphans} ungraded results queued)")
+    try:
+        await asyncio.Event().wait()   # run until interrupted
+    finally:
+        await queue.stop()
+        await close_grading_provider()
+        response_cache.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Drain the grading_jobs queue")
+    parser.add_argument("--workers", type=int, default=max(1, settings.GRADING_WORKERS))
+    args = parser.parse_args()
+    try:
+        asyncio.run(main(args.workers))
+    except KeyboardInterrupt:
+        print("Grading worker stopped")
@@ -1,5 +1,6 @@
 # v2026.07.02 - video-robot bank enabled for Annotator PoC test
 import os
+import asyncio
 import traceback
 from fastapi import FastAPI, Request
 from fastapi.responses import JSONResponse
@@ -7,6 +8,16 @@ from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
 from database import engine, Base
 from config import settings
+from services.banks import bank_registry
+from services import bank_versions
+from services.paper_pool import paper_pool
+from services.exposure import exposure_tracker
+from services.grading_queue import ensure_active_job_index, grading_queue
+from services.ai_engine import close_grading_provider, init_grading_provider
+from services.response_cache import response_cache
+from services.copy_detection import warm as warm_copy_detection
+from services.similarity import warm as warm_similarity
+from services.reevaluation import reevaluation_runner
 from contextlib import asynccontextmanager
 
 # Import your routers
@@ -26,7 +37,56 @@ async def lifespan(app: FastAPI):
     except Exception as e:
         print(f"⚠️ Database initialization warning: {e}")
         # Don't crash - tables might already exist
+    try:
+        await ensure_active_job_index()
+    except Exception as e:
+        print(f"⚠️ Could not create the grading job index: {e}")
+
+    # Parse every question bank once so the first cohort doesn't pay for it
+    loaded = bank_registry.load_all()
+    print(f"✅ Loaded {loaded} question banks into memory")
+    try:
+        print(f"✅ Recorded {await bank_versions.save()} bank versions in the database")
+    except Exception as e:
+        print(f"⚠️ Could not store bank versions (retried when a session is created): {e}")
+    print(f"✅ Precomputed similarity vectors for {warm_similarity()} bank texts "
+          f"and shingles for {warm_copy_detection()} reading passages")
+
+    # Serve counts for exposure-balanced sampling
+    try:
+        seeded = await exposure_tracker.load()
+        print(f"✅ Loaded exposure counts for {seeded} bank items")
+    except Exception as e:
+        print(f"⚠️ Could not load exposure counts: {e}")
+    exposure_task = asyncio.create_task(exposure_tracker.run())
+
+    # One shared grading provider (Claude keep-alive pool, or the local stub)
+    init_grading_provider()
+
+    # Keep pre-generated papers topped up off the request path
+    pool_task = asyncio.create_task(paper_pool.run())
+
+    # Background grading workers for finished exams
+    if settings.ASYNC_GRADING:
+        orphans = await grading_queue.start()
+        print(f"✅ Started {grading_queue.workers} grading workers ({orphans} ungraded results queued)")
+
+    # Resume bulk re-evaluations interrupted by a restart
+    try:
+        resumed = await reevaluation_runner.resume()
+        if resumed:
+            print(f"✅ Resumed {resumed} bulk re-evaluation run(s)")
+    except Exception as e:
+        print(f"⚠️ Could not resume re-evaluation runs: {e}")
     yield
+    await reevaluation_runner.stop()
+    await grading_queue.stop()
+    pool_task.cancel()
+    exposure_task.cancel()
+    # Let the flusher write out the last batch of serve counts
+    await asyncio.gather(exposure_task, return_exceptions=True)
+    await close_grading_provider()
+    response_cache.close()
 
 app = FastAPI(title=settings.APP_NAME, lifespan=lifespan)
 
@@ -92,8 +152,10 @@ async def detailed_health_check():
     except Exception as e:
         db_status = f"unhealthy: {str(e)[:50]}"
     
+    from services.ai_resilience import metrics as ai_metrics
     return {
         "status": "running",
         "database": db_status,
-        "video_storage": settings.VIDEO_DIR
+        "video_storage": settings.VIDEO_DIR,
+        "ai": ai_metrics(),
     }
@@ -2,10 +2,11 @@
 """
 migrate_banks.py  —  One-shot migration script.
 Run from:  /Users/chirkut/Desktop/Autonex Ai Evaluator copy/backend/
-  python3 migrate_banks.py
+  python3 migrate_banks.py             # migrate images + rebuild woven banks, then compile
+  python3 migrate_banks.py --compile   # only compile data/banks/*.json → data/banks/compiled/*.bin
 """
 
-import json, os, shutil
+import json, os, shutil, sys
 
 BASE   = os.path.dirname(os.path.abspath(__file__))
 PARENT = os.path.dirname(BASE)
@@ -191,9 +192,27 @@ def build_section3():
     return bank
 
 
+# ── compiled banks ───────────────────────────────────────────────────────────
+
+def compile_banks():
+    """Compile every JSON bank into the memory-mappable binary format used by
+    services/banks.py (offset table + compact records). Safe to re-run."""
+    from services.banks import bank_registry
+    written = bank_registry.compile_all()
+    for name, count in written.items():
+        print(f"  {name:<28} → compiled/{os.path.splitext(name)[0]}.bin ({count} records)")
+    return written
+
+
 # ── main ─────────────────────────────────────────────────────────────────────
 
 if __name__ == "__main__":
+    if "--compile" in sys.argv:
+        print("\n=== Compiling banks ===")
+        compile_banks()
+        print(f"\n✅  Done!")
+        sys.exit(0)
+
     print("\n=== Migrating images ===")
     for n in (1, 2, 3):
         copy_images(n)
@@ -214,6 +233,9 @@ if __name__ == "__main__":
         json.dump(s3, f, indent=2)
     print(f"  Wrote woven2_test.json ({len(s3)} questions)")
 
+    print("\n=== Compiling banks ===")
+    compile_banks()
+
     print(f"\n✅  Done!")
     print(f"   Section1: {len(s1)} image-count  (10 Qs)")
     print(f"   Section2: {len(s2)} mcq-image    (10 Qs)")
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Boolean, ForeignKey, Float, Text, JSON, DateTime
+from sqlalchemy import Column, Integer, String, Boolean, ForeignKey, Float, Text, JSON, DateTime, LargeBinary, Index, text
 from sqlalchemy.sql import func
 from sqlalchemy.orm import relationship
 from sqlalchemy.ext.hybrid import hybrid_property
@@ -176,3 +176,89 @@ class ExamSession(Base):
     # Relationships
     user = relationship("User")
     test = relationship("Test", back_populates="exam_sessions")
+
+
+class ItemExposure(Base):
+    """
+    How many times each bank item has been served, per section type.
+    Written in batches by services/exposure.py and used to favour
+    under-exposed items when papers are generated.
+    """
+    __tablename__ = "item_exposure"
+    
+    section_type = Column(String, primary_key=True)
+    item_key = Column(String, primary_key=True)  # services.banks.item_key() of the bank item
+    serve_count = Column(Integer, default=0, nullable=False)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+
+class BankVersion(Base):
+    """
+    Source of every question bank version the app has loaded, keyed by its
+    sha1. Compact exam sessions reference bank versions by digest, so they
+    are rebuilt from here after the bank file is edited or redeployed
+    (services/bank_versions.py).
+    """
+    __tablename__ = "bank_versions"
+
+    bank_name = Column(String, primary_key=True)  # file name, e.g. "mcq_grammar.json"
+    digest = Column(String, primary_key=True)     # sha1 hex of the source
+    source = Column(LargeBinary, nullable=False)  # the bank file exactly as loaded
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+
+ACTIVE_GRADING_JOB = "status IN ('queued', 'running')"
+
+
+class GradingJob(Base):
+    """
+    Durable grading queue entry (services/grading_queue.py).
+    Workers claim 'queued' jobs whose run_after has passed, or 'running' jobs
+    whose locked_until expired (the worker holding them died). A result has
+    at most one active (queued or running) job.
+    """
+    __tablename__ = "grading_jobs"
+    __table_args__ = (
+        Index("uq_grading_jobs_active_result", "result_id", unique=True,
+              sqlite_where=text(ACTIVE_GRADING_JOB), postgresql_where=text(ACTIVE_GRADING_JOB)),
+    )
+    
+    id = Column(Integer, primary_key=True, index=True)
+    result_id = Column(Integer, ForeignKey("test_results.id", ondelete="CASCADE"), index=True)
+    session_id = Column(Integer, ForeignKey("exam_sessions.id", ondelete="CASCADE"))
+    status = Column(String, default="queued", index=True)  # queued, running, done, failed
+    attempts = Column(Integer, default=0, nullable=False)
+    # Naive UTC timestamps — compared against each other by the claim query
+    run_after = Column(DateTime, nullable=False)      # backoff: not claimable before this
+    locked_until = Column(DateTime, nullable=True)    # visibility timeout while running
+    last_error = Column(Text, nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+
+class ReevaluationRun(Base):
+    """
+    Bulk re-evaluation of every graded result of a test (services/reevaluation.py).
+    Doubles as the run's checkpoint: submitted batch ids, which of them were
+    drained into the response cache, and the last result id written back.
+    """
+    __tablename__ = "reevaluation_runs"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    test_id = Column(Integer, ForeignKey("tests.id", ondelete="CASCADE"), index=True)
+    status = Column(String, default="queued", index=True)  # queued, batching, writing, done, failed
+    provider = Column(String, nullable=False)
+    total_results = Column(Integer, default=0, nullable=False)
+    written_results = Column(Integer, default=0, nullable=False)
+    total_requests = Column(Integer, default=0, nullable=False)     # unique AI calls planned
+    cached_requests = Column(Integer, default=0, nullable=False)    # already in the response cache
+    completed_requests = Column(Integer, default=0, nullable=False) # batch replies cached
+    batch_ids = Column(JSON, default=list)
+    drained_batch_ids = Column(JSON, default=list)
+    last_result_id = Column(Integer, default=0, nullable=False)     # write-back cursor
+    errors = Column(JSON, default=list)
+    # Naive UTC lease — the process running the run renews it at every checkpoint
+    locked_until = Column(DateTime, nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+    finished_at = Column(DateTime(timezone=True), nullable=True)
@@ -1,6 +1,7 @@
 
 import os
 import shutil
+import asyncio
 from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
@@ -8,11 +9,17 @@ from sqlalchemy import delete
 from sqlalchemy.orm import selectinload
 from typing import List, Optional
 from database import get_db
-from models import User, Test, Question, TestResult, Organization
+from models import User, Test, Question, TestResult, Organization, GradingJob
 from schemas import TestCreate, QuestionBase, TestResponse, QuestionCreate, TestTemplateConfig, TestUpdate
 from dependencies import require_admin
 from config import settings
 from services.generator import QuestionBankService
+from services.banks import bank_registry
+from services import bank_versions
+from services.session_store import encode_paper, expand_paper
+from services.results import unwrap_breakdown, recompute_section_summary
+from services.reevaluation import regrade_result
+from services.sections import SECTION_TYPES
 
 router = APIRouter(prefix="/admin", tags=["Admin Dashboard"])
 
@@ -44,72 +51,17 @@ class OrgUpdate(PydanticModel):
     slug: str = None
     is_active: bool = None
 
+class CohortProvision(PydanticModel):
+    """Candidates to pre-provision exam sessions for (ids and/or emails)"""
+    user_ids: List[int] = []
+    emails: List[str] = []
+
 class ScoreOverride(PydanticModel):
     """Request model for overriding a question's score"""
     new_score: float
     reason: str = None  # Optional reason for the override
 
 
-# ─── Breakdown format helpers ────────────────────────────────────────────────
-def _unwrap_breakdown(raw):
-    """Returns (questions_list, section_summary, is_v2_format)."""
-    if isinstance(raw, dict) and raw.get("version") == 2:
-        return raw.get("questions", []), raw.get("section_summary", {}), True
-    return (raw if isinstance(raw, list) else []), {}, False
-
-
-def _recompute_section_summary(questions):
-    """Recomputes section_summary + MCQ% total from the questions list."""
-    VISUAL  = {'video', 'video-robot', 'image'}
-    TYPING  = {'typing', 'typing-easy', 'typing-advanced'}
-
-    mcq_qs    = [b for b in questions if b.get('type') not in VISUAL and b.get('type') not in TYPING]
-    typing_qs = [b for b in questions if b.get('type') in TYPING]
-    visual_qs = [b for b in questions if b.get('type') in VISUAL]
-
-    mcq_correct = sum(b.get('override_score', b.get('student_score', 0)) for b in mcq_qs)
-    mcq_max     = sum(b.get('max_marks', 0) for b in mcq_qs)
-    mcq_pct     = round((mcq_correct / mcq_max) * 100, 1) if mcq_max > 0 else 0.0
-
-    typing_tasks = []
-    for b in typing_qs:
-        fb  = b.get('ai_feedback', {})
-        acc = fb.get('accuracy', 0)
-        typing_tasks.append({'question_id': b.get('question_id'), 'type': b.get('type'),
-                             'wpm': fb.get('net_wpm', 0), 'accuracy': acc, 'passed': acc >= 80})
-    avg_wpm      = round(sum(t['wpm']      for t in typing_tasks) / len(typing_tasks), 1) if typing_tasks else 0
-    avg_accuracy = round(sum(t['accuracy'] for t in typing_tasks) / len(typing_tasks), 1) if typing_tasks else 100
-    typing_passed = all(t['passed'] for t in typing_tasks) if typing_tasks else True
-
-    visual_ranks = []
-    for b in visual_qs:
-        fb   = b.get('ai_feedback', {})
-        rank = fb.get('rank', 'Bad')
-        visual_ranks.append({'question_id': b.get('question_id'), 'type': b.get('type'),
-                             'rank': rank, 'feedback': fb.get('feedback', ''),
-                             'passed': rank in ('Good', 'Medium')})
-    visual_passed_count = sum(1 for q in visual_ranks if q['passed'])
-    visual_total        = len(visual_ranks)
-    visual_pass_pct     = round((visual_passed_count / visual_total) * 100) if visual_total > 0 else 100
-    visual_passed = all(q['passed'] for q in visual_ranks) if visual_ranks else True
-
-    summary = {
-        'mcq_jumble': {'score_pct': mcq_pct, 'correct_marks': mcq_correct,
-                       'max_marks': mcq_max, 'question_count': len(mcq_qs)},
-        'typing':  {'tasks': typing_tasks, 'avg_wpm': avg_wpm, 'avg_accuracy': avg_accuracy,
-                    'benchmark_wpm': 30, 'passed': typing_passed,
-                    'fail_reasons': [f"Task {i+1} accuracy {t['accuracy']}% below 80%"
-                                     for i, t in enumerate(typing_tasks) if not t['passed']],
-                    'question_count': len(typing_qs)},
-        'visual':  {'questions': visual_ranks, 'passed': visual_passed,
-                    'pass_pct': visual_pass_pct, 'passed_count': visual_passed_count,
-                    'question_count': visual_total},
-        'overall_passed': typing_passed and visual_passed
-    }
-    return summary, mcq_correct   # raw correct marks, NOT a percentage
-# ─────────────────────────────────────────────────────────────────────────────
-
-
 async def create_organization(
     org_data: OrgCreate,
     db: AsyncSession = Depends(get_db),
@@ -329,6 +281,7 @@ async def reset_candidate_attempt(
     session_ids = [s.id for s in sessions]
 
     if result_ids:
+        await db.execute(delete(GradingJob).where(GradingJob.result_id.in_(result_ids)))
         await db.execute(delete(TestResult).where(TestResult.id.in_(result_ids)))
     if session_ids:
         await db.execute(delete(ExamSession).where(ExamSession.id.in_(session_ids)))
@@ -363,48 +316,59 @@ async def create_test(test: TestCreate, db: AsyncSession = Depends(get_db), _: d
 # --- BANK SIZES (dynamic — reads actual files) ---
 @router.get("/bank-sizes")
 async def get_bank_sizes(_: dict = Depends(require_admin)):
-    """Returns the number of available questions per section type by reading the bank files."""
-    import json as _json
-
-    # Same map as generator.py — single source of truth via this endpoint
-    bank_map = {
-        "video"              : "video.json",
-        "video-robot"        : "video_robot.json",
-        "image"              : "image.json",
-        "image-count"        : "woven_test.json",
-        "mcq-image"          : "woven_test.json",
-        "mcq-annotation"     : "woven2_test.json",
-        "jumble"             : "jumble.json",
-        "mcq-grammar"        : "mcq_grammar.json",
-        "mcq-context"        : "mcq_context.json",
-        "mcq-reading"        : "mcq_reading.json",
-        "mcq-number-series"  : "mcq_number_series.json",
-        "mcq-blood-relations": "mcq_blood_relations.json",
-        "mcq-odd-one-out"    : "mcq_odd_one_out.json",
-        "typing-easy"        : "typing_easy.json",
-        "typing-advanced"    : "typing_advanced.json",
+    """Returns the number of available questions per section type from the in-memory bank registry."""
+    return {
+        section_type: bank_registry.count(spec.bank_file, spec.type_filter)
+        for section_type, spec in SECTION_TYPES.items()
     }
 
-    # Filter types that share a file (image-count and mcq-image share woven_test.json)
-    filter_type = {
-        "image-count": "image-count",
-        "mcq-image"  : "mcq-image",
-    }
 
-    banks_dir = os.path.join(os.path.dirname(os.path.dirname(__file__)), "data", "banks")
-    sizes = {}
+@router.get("/bank-strata")
+async def get_bank_strata(_: dict = Depends(require_admin)):
+    """Item counts per difficulty level and per tag for every section type."""
+    response = {}
+    for section_type, spec in SECTION_TYPES.items():
+        snapshot = bank_registry.get(spec.bank_file)
+        strata = snapshot.strata_for(spec.type_filter) if snapshot else None
+        response[section_type] = {
+            "difficulty": {level: len(p) for level, p in sorted(strata.difficulty.items())} if strata else {},
+            "tags": {tag: len(p) for tag, p in sorted(strata.tags.items())} if strata else {},
+        }
+    return response
 
-    for section_type, filename in bank_map.items():
-        path = os.path.join(banks_dir, filename)
-        try:
-            items = _json.load(open(path))
-            if section_type in filter_type:
-                items = [q for q in items if q.get("type") == filter_type[section_type]]
-            sizes[section_type] = len(items)
-        except Exception:
-            sizes[section_type] = 0
 
-    return sizes
+def _validate_strata(section: dict) -> dict:
+    """Checks a section's difficulty/tag strata against its bank; returns the keys to store."""
+    difficulty = section.get("difficulty") or {}
+    tags = section.get("tags") or []
+    if not difficulty and not tags:
+        return {}
+
+    q_type = section.get("type")
+    spec = SECTION_TYPES.get(q_type)
+    snapshot = bank_registry.get(spec.bank_file) if spec else None
+    if not snapshot:
+        raise HTTPException(status_code=400, detail=f"Unknown section type: {q_type}")
+    strata = snapshot.strata_for(spec.type_filter)
+
+    if sum(difficulty.values()) > section.get("count", 0):
+        raise HTTPException(status_code=400, detail=f"{q_type}: difficulty counts exceed the section count")
+    for level, n in difficulty.items():
+        available = len(strata.difficulty.get(level, ()))
+        if n > available:
+            raise HTTPException(status_code=400, detail=f"{q_type}: only {available} '{level}' items in the bank")
+    if len(tags) > section.get("count", 0):
+        raise HTTPException(status_code=400, detail=f"{q_type}: more tags than questions in the section")
+    missing = [tag for tag in tags if tag not in strata.tags]
+    if missing:
+        raise HTTPException(status_code=400, detail=f"{q_type}: no bank items tagged {', '.join(missing)}")
+
+    stored = {}
+    if difficulty:
+        stored["difficulty"] = difficulty
+    if tags:
+        stored["tags"] = tags
+    return stored
 
 
 @router.post("/generate-test", response_model=TestResponse)
@@ -429,11 +393,14 @@ async def generate_test_from_template(
         count = section.get("count", 0)
         marks = section.get("marks", 0)
         total_marks += count * marks
-        template_sections.append({
+        template_section = {
             "type": q_type,
             "count": count,
             "marks": marks
-        })
+        }
+        # Optional strata: {"difficulty": {"easy": 3, "hard": 2}, "tags": ["counting"]}
+        template_section.update(_validate_strata(section))
+        template_sections.append(template_section)
     
     # Create Test with template_config (no fixed questions stored)
     new_test = Test(
@@ -450,6 +417,88 @@ async def generate_test_from_template(
     
     return new_test
 
+@router.post("/tests/{test_id}/provision")
+async def provision_cohort(
+    test_id: int,
+    cohort: CohortProvision,
+    db: AsyncSession = Depends(get_db),
+    admin: User = Depends(require_admin)
+):
+    """
+    Pre-generates papers for a known list of candidates and creates all their
+    ExamSessions in one bulk insert, so starting the test is just a read.
+
+    Provisioned sessions have no expires_at yet — the exam timer starts when
+    the candidate first opens the test. Candidates who already have a result
+    or an open session for this test are skipped. Papers are dealt for the
+    whole cohort, least-served items first with exposure balancing on;
+    sections with difficulty / tag strata are still drawn per candidate.
+    """
+    from sqlalchemy import insert, or_
+    from models import ExamSession
+
+    test = (await db.execute(select(Test).where(Test.id == test_id))).scalars().first()
+    if not test:
+        raise HTTPException(status_code=404, detail="Test not found")
+    if not test.template_config:
+        raise HTTPException(status_code=400, detail="Only template tests can be pre-provisioned")
+
+    emails = {e.strip().lower() for e in cohort.emails if e.strip()}
+    user_ids = set(cohort.user_ids)
+    if not emails and not user_ids:
+        raise HTTPException(status_code=400, detail="Provide user_ids or emails")
+
+    users = (await db.execute(
+        select(User).where(or_(User.id.in_(user_ids), User.email.in_(emails)))
+    )).scalars().all()
+    found_ids = {u.id for u in users}
+    found_emails = {u.email.lower() for u in users}
+    not_found = sorted(str(i) for i in user_ids - found_ids) + sorted(emails - found_emails)
+
+    # Same access rule as GET /exam/tests/{id}
+    not_eligible = [u.email for u in users if test.organization_id and u.organization_id != test.organization_id]
+    candidates = [u for u in users if u.email not in not_eligible]
+
+    # Skip anyone who already has an attempt or an open session
+    candidate_ids = [u.id for u in candidates]
+    taken = set((await db.execute(
+        select(TestResult.user_id).where(TestResult.test_id == test_id, TestResult.user_id.in_(candidate_ids))
+    )).scalars().all())
+    taken |= set((await db.execute(
+        select(ExamSession.user_id).where(
+            ExamSession.test_id == test_id,
+            ExamSession.is_completed == False,
+            ExamSession.user_id.in_(candidate_ids)
+        )
+    )).scalars().all())
+    candidates = [u for u in candidates if u.id not in taken]
+
+    if candidates:
+        # Sampling/transforming thousands of papers is CPU work — keep it off the event loop
+        papers = await asyncio.to_thread(QuestionBankService.generate_papers, test.template_config, len(candidates))
+        await db.execute(insert(ExamSession), [
+            {
+                "user_id": u.id,
+                "test_id": test_id,
+                "generated_questions": encode_paper(paper) if settings.COMPACT_SESSIONS else paper,
+                "answers": {},
+                "expires_at": None,
+                "is_completed": False,
+            }
+            for u, paper in zip(candidates, papers)
+        ])
+        await bank_versions.save()
+        await db.commit()
+
+    print(f"[PROVISION] Test {test_id}: {len(candidates)} sessions created, {len(taken)} skipped")
+    return {
+        "test_id": test_id,
+        "provisioned": len(candidates),
+        "skipped_existing": len(taken),
+        "not_eligible": not_eligible,
+        "not_found": not_found,
+    }
+
 # 2. Upload Video (Self-Hosted Logic)
 @router.post("/upload-video")
 async def upload_video(file: UploadFile = File(...), _: dict = Depends(require_admin)):
@@ -612,7 +661,8 @@ async def get_detailed_result(
         if session and session.generated_questions:
             # Create a map of question_id -> question content
             question_map = {}
-            for q in session.generated_questions:
+            await bank_versions.load(session.generated_questions)
+            for q in expand_paper(session.generated_questions):
                 q_id = q.get("temp_id")
                 if q_id:
                     question_map[q_id] = q
@@ -620,7 +670,7 @@ async def get_detailed_result(
             # Enrich breakdown with missing options/jumble
             for item in breakdown:
                 q_id = item.get("question_id")
-                if q_id and q_id in question_map:
+                if q_id and q_id in question_map and not question_map[q_id].get("missing_item"):
                     q_data = question_map[q_id]
                     content = q_data.get("content", {})
                     
@@ -708,7 +758,7 @@ async def override_question_score(
         raise HTTPException(status_code=404, detail="Result not found")
     
     raw = exam_result.ai_breakdown or []
-    questions, section_summary, is_v2 = _unwrap_breakdown(raw)
+    questions, section_summary, is_v2 = unwrap_breakdown(raw)
 
     # Find the question in breakdown
     question_found = False
@@ -734,7 +784,7 @@ async def override_question_score(
     from sqlalchemy.orm.attributes import flag_modified
 
     if is_v2:
-        section_summary, new_total = _recompute_section_summary(questions)
+        section_summary, new_total = recompute_section_summary(questions)
         exam_result.ai_breakdown = {"version": 2, "section_summary": section_summary, "questions": questions}
     else:
         new_total = sum(item.get("override_score", item.get("student_score", 0)) for item in questions)
@@ -768,13 +818,7 @@ async def re_evaluate_result(
     MCQ, Jumble, and Typing are skipped (rule-based, no AI needed).
     """
     from models import ExamSession
-    from services.grading import (
-        grade_video_question,
-        grade_image_question,
-        grade_reading_question,
-    )
     from sqlalchemy.orm.attributes import flag_modified
-    import json as json_lib
 
     # Load result (no selectinload — test/user use backref, not proper relationship)
     result_q = await db.execute(
@@ -803,74 +847,28 @@ async def re_evaluate_result(
     if not session:
         raise HTTPException(status_code=404, detail="Exam session not found — cannot re-evaluate")
 
-    answers = session.answers or {}
-    generated_questions = session.generated_questions or []
-
-    # Build question map: temp_id -> full question object
-    question_map = {q["temp_id"]: q for q in generated_questions if "temp_id" in q}
-
-    raw = exam_result.ai_breakdown or []
-    questions, section_summary, is_v2 = _unwrap_breakdown(raw)
-    re_evaluated = 0
-    errors = []
-
-    for item in questions:
-        q_type = item.get("type", "")
-        q_id   = item.get("question_id")
-
-        # Only re-evaluate AI-graded types
-        if q_type not in ("video", "video-robot", "image", "reading"):
-            continue
-
-        student_text = str(answers.get(str(q_id), answers.get(q_id, ""))).strip()
-        if not student_text:
-            item["student_score"] = 0
-            item.pop("override_score", None)
-            continue
-
-        q_data         = question_map.get(q_id, {})
-        grading_config = q_data.get("grading_config", {})
-        content        = q_data.get("content", {})
-
-        try:
-            if q_type in ("video", "video-robot"):
-                grade_data = await grade_video_question(
-                    student_text,
-                    grading_config.get("reference", ""),
-                    grading_config.get("key_ideas", []),
-                    content.get("title", "Video description task")
-                )
-            elif q_type == "image":
-                grade_data = await grade_image_question(
-                    student_text,
-                    grading_config.get("reference", ""),
-                    grading_config.get("key_ideas", []),
-                    content.get("title", "Image description task")
-                )
-            elif q_type == "reading":
-                grade_data = await grade_reading_question(
-                    student_text,
-                    content.get("passage", ""),
-                    grading_config.get("reference", ""),
-                    grading_config.get("key_ideas", [])
-                )
-
-            item["student_score"] = round(grade_data.get("score", 0), 1)
-            item["ai_feedback"]   = grade_data.get("breakdown", {})
-            item.pop("override_score", None)
-            re_evaluated += 1
+    # Never graded (grading failed or still queued) — run the full grading now
+    questions, _, _ = unwrap_breakdown(exam_result.ai_breakdown or [])
+    if not questions and exam_result.status in ("submitted", "grading_failed"):
+        from services.grading_queue import grade_submission
+        exam_result.status = "submitted"
+        await db.commit()
+        await grade_submission(exam_result.id, session.id)
+        await db.refresh(exam_result)
+        return {
+            "message": "Result was not graded yet — full grading completed.",
+            "re_evaluated": len(expand_paper(session.generated_questions)),
+            "errors": [],
+            "new_total": round(exam_result.total_score or 0, 1),
+            "max_marks": test_obj.total_marks if test_obj else 100
+        }
 
-        except Exception as e:
-            errors.append(f"Q{q_id} ({q_type}): {str(e)}")
-
-    # Recompute section_summary and total
-    if is_v2:
-        section_summary, new_total = _recompute_section_summary(questions)
-        exam_result.ai_breakdown = {"version": 2, "section_summary": section_summary, "questions": questions}
-    else:
-        new_total = sum(item.get("override_score", item.get("student_score", 0)) for item in questions)
-        exam_result.ai_breakdown = questions
+    outcome = await regrade_result(exam_result.ai_breakdown or [], session)
+    re_evaluated = outcome["re_evaluated"]
+    errors = outcome["errors"]
+    new_total = outcome["total_score"]
 
+    exam_result.ai_breakdown = outcome["ai_breakdown"]
     flag_modified(exam_result, "ai_breakdown")
     exam_result.total_score = new_total
     exam_result.status = "re-evaluated"
@@ -885,3 +883,57 @@ async def re_evaluate_result(
         "max_marks": test_obj.total_marks if test_obj else 100
     }
 
+
+@router.post("/tests/{test_id}/re-evaluate")
+async def re_evaluate_test(
+    test_id: int,
+    db: AsyncSession = Depends(get_db),
+    admin: User = Depends(require_admin)
+):
+    """
+    Re-evaluates the AI-graded questions of every graded result of a test in
+    the background (e.g. after a rubric change). Unique requests go through
+    the batch provider (REEVAL_BATCH_PROVIDER); results are written back in
+    chunks. Poll GET /admin/re-evaluations/{run_id} for progress.
+    """
+    from models import ReevaluationRun
+    from services.reevaluation import ACTIVE_STATUSES, reevaluation_runner, run_progress
+
+    test_obj = (await db.execute(select(Test).where(Test.id == test_id))).scalars().first()
+    if not test_obj:
+        raise HTTPException(status_code=404, detail="Test not found")
+    if not settings.AI_CACHE_ENABLED:
+        # Batch replies reach the write-back through the response cache
+        raise HTTPException(status_code=400, detail="Bulk re-evaluation requires AI_CACHE_ENABLED")
+
+    active = (await db.execute(
+        select(ReevaluationRun)
+        .where(ReevaluationRun.test_id == test_id)
+        .where(ReevaluationRun.status.in_(ACTIVE_STATUSES))
+    )).scalars().first()
+    if active:
+        return {"message": "A re-evaluation of this test is already running.", **run_progress(active)}
+
+    run = ReevaluationRun(test_id=test_id, status="queued", provider=settings.REEVAL_BATCH_PROVIDER)
+    db.add(run)
+    await db.commit()
+    await db.refresh(run)
+    reevaluation_runner.launch(run.id)
+    return {"message": "Re-evaluation started.", **run_progress(run)}
+
+
+@router.get("/re-evaluations/{run_id}")
+async def get_re_evaluation(
+    run_id: int,
+    db: AsyncSession = Depends(get_db),
+    admin: User = Depends(require_admin)
+):
+    """Progress of a bulk re-evaluation run."""
+    from models import ReevaluationRun
+    from services.reevaluation import run_progress
+
+    run = (await db.execute(select(ReevaluationRun).where(ReevaluationRun.id == run_id))).scalars().first()
+    if not run:
+        raise HTTPException(status_code=404, detail="Re-evaluation run not found")
+    return run_progress(run)
+
@@ -1,4 +1,3 @@
-import random
 from typing import Optional
 from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.ext.asyncio import AsyncSession
@@ -14,8 +13,16 @@ from services.grading import (
     grade_reading_question, 
     grade_jumble_question, 
     grade_mcq_question,
-    grade_typing_question
+    grade_typing_question,
+    ai_unavailable_grade
 )
+from services.ai_resilience import AIUnavailableError
+from services.grading_queue import enqueue_grading, grading_queue, run_job
+from services.results import build_section_summary
+from services.paper_pool import paper_pool
+from services import bank_versions
+from services.session_store import encode_paper, expand_paper
+from config import settings
 from pydantic import BaseModel
 
 router = APIRouter(prefix="/exam", tags=["Student Exam"])
@@ -170,8 +177,14 @@ async def get_test_paper(test_id: int, db: AsyncSession = Depends(get_db), user:
     
     # If session exists, return the same questions (consistency on refresh)
     if session:
+        # Pre-provisioned by an admin (see /admin/tests/{id}/provision) — start the clock now
+        if session.expires_at is None:
+            session.started_at = datetime.now()
+            session.expires_at = datetime.now() + timedelta(minutes=test.duration_minutes + 5)
+            await db.commit()
+        await bank_versions.load(session.generated_questions)
         safe_questions = []
-        for q in session.generated_questions:
+        for q in expand_paper(session.generated_questions):
             safe_questions.append({
                 "id": q["temp_id"],
                 "type": q["type"],
@@ -186,46 +199,24 @@ async def get_test_paper(test_id: int, db: AsyncSession = Depends(get_db), user:
             "questions": safe_questions
         }
     
-    # TEMPLATE MODE: Generate random questions for this user
+    # TEMPLATE MODE: Take a pre-generated paper from the pool (falls back
+    # to generating inline when the pool for this test is empty)
     if test.template_config:
-        generated_questions = []
-        temp_id = 1
-        
-        for section in test.template_config:
-            section_type = section.get("type")
-            count = section.get("count", 1)
-            marks = section.get("marks", 5)
-            
-            # Generate random questions from bank
-            section_questions = QuestionBankService.generate_questions(
-                section_type=section_type,
-                count=count,
-                marks_per_question=marks
-            )
-            
-            # Shuffle questions within this section (keeps sections in order)
-            random.shuffle(section_questions)
-
-            # Add temp_id for tracking
-            for q in section_questions:
-                q["temp_id"] = temp_id
-                # Preserve generator-set type (e.g. mcq-multi-image); fall back to section_type
-                if "question_type" not in q:
-                    q["type"] = section_type
-                else:
-                    q["type"] = q.get("question_type", section_type)
-                generated_questions.append(q)
-                temp_id += 1
+        generated_questions = paper_pool.take(test.id, test.template_config)
+        if generated_questions is None:
+            generated_questions = QuestionBankService.generate_paper(test.template_config)
 
         # Create exam session with the generated questions
         new_session = ExamSession(
             user_id=user.id,
             test_id=test_id,
-            generated_questions=generated_questions,
+            generated_questions=encode_paper(generated_questions) if settings.COMPACT_SESSIONS else generated_questions,
             answers={},
             expires_at=datetime.now() + timedelta(minutes=test.duration_minutes + 5)
         )
         db.add(new_session)
+        # The bank versions the session references must be stored before it is
+        await bank_versions.save()
         await db.commit()
         await db.refresh(new_session)
         
@@ -268,6 +259,15 @@ async def get_test_paper(test_id: int, db: AsyncSession = Depends(get_db), user:
         "questions": safe_questions
     }
 
+async def _grade_inline(question_type: str, grade_coro):
+    """Await an AI grader on a path with no grading queue to defer to: when
+    Claude is unavailable the question gets the error grade instead of a 500."""
+    try:
+        return await grade_coro
+    except AIUnavailableError as e:
+        print(f"[GRADING] Claude unavailable, {question_type} answer given the error grade: {e}")
+        return ai_unavailable_grade(question_type, e)
+
 # 2. Submit Answer & Auto-Grade
 class AnswerSchema(BaseModel):
     question_id: int
@@ -291,28 +291,28 @@ async def submit_single_answer(
     if question.question_type == "video":
         # Get video context from content field
         video_context = question.content.get("title", "Video description task") if question.content else "Video description task"
-        score_data = await grade_video_question(
+        score_data = await _grade_inline("video", grade_video_question(
             answer.student_text, 
             question.reference_context, 
             question.key_ideas,
             video_context
-        )
+        ))
     elif question.question_type == "image":
         # Get image context from content field
         image_context = question.content.get("title", "Image description task") if question.content else "Image description task"
-        score_data = await grade_image_question(
+        score_data = await _grade_inline("image", grade_image_question(
             answer.student_text, 
             question.reference_context, 
             question.key_ideas,
             image_context
-        )
+        ))
     elif question.question_type == "reading":
-        score_data = await grade_reading_question(
+        score_data = await _grade_inline("reading", grade_reading_question(
             answer.student_text,
             question.content_url_or_text, # Original Passage
             question.reference_context,   # Ideal Summary
             question.key_ideas
-        )
+        ))
     else:
         # Fallback for now
         score_data = {"score": 0, "breakdown": "Manual Grading Required"}
@@ -341,8 +341,10 @@ async def finish_exam(
 ):
     """
     1. Validates test is active and user has access.
-    2. Grades ALL answers (from session or fixed questions).
-    3. Stores complete record with answers for admin review.
+    2. Saves the answers and marks the result "submitted".
+    3. Template (session) tests get a grading_jobs row and are graded by the
+       background workers — poll GET /exam/results/{id}/status. Legacy fixed-question tests are
+       still graded inline.
     """
     from models import ExamSession
     
@@ -372,7 +374,7 @@ async def finish_exam(
     )
     existing = existing_result.scalars().first()
     
-    if existing and existing.status == "graded":
+    if existing and existing.status in ("graded", "re-evaluated"):
         # Already graded, return existing result
         return {"result_id": existing.id}
     
@@ -421,191 +423,37 @@ async def finish_exam(
         if session.is_completed:
             raise HTTPException(status_code=400, detail="This exam has already been submitted")
         
-        # Grade each question from generated_questions
-        for q in session.generated_questions:
-            max_score += q["marks"]
-            temp_id = str(q["temp_id"])
-            student_text = submission.answers.get(temp_id, "")
-            
-            grading_config = q.get("grading_config", {})
-            question_type = q["type"]
-            
-            # --- AI GRADING LOGIC ---
-            grade_data = {}
-            if question_type == 'video':
-                content = q.get("content") or {}
-                video_context = content.get("title", "Video description task")
-                grade_data = await grade_video_question(
-                    student_text, 
-                    grading_config.get("reference", ""),
-                    grading_config.get("key_ideas", []),
-                    video_context
-                )
-            elif question_type == 'image':
-                content = q.get("content") or {}
-                image_context = content.get("title", "Image description task")
-                grade_data = await grade_image_question(
-                    student_text, 
-                    grading_config.get("reference", ""),
-                    grading_config.get("key_ideas", []),
-                    image_context
-                )
-            elif question_type == 'reading':
-                content = q.get("content") or {}
-                passage = content.get("passage", "")
-                grade_data = await grade_reading_question(
-                    student_text, 
-                    passage,
-                    grading_config.get("reference", ""),
-                    grading_config.get("key_ideas", [])
-                )
-            elif question_type == 'jumble':
-                grade_data = await grade_jumble_question(
-                    student_text,
-                    grading_config.get("correct_answer", ""),
-                    q["marks"]
-                )
-            elif question_type == 'mcq-multi-image':
-                # student_text is JSON: {"0": "c", "1": "d", "2": "b"}
-                import json as _json
-                try:
-                    answers = _json.loads(student_text) if student_text else {}
-                except:
-                    answers = {}
-                sub_images   = grading_config.get("sub_images", [])
-                mpi          = grading_config.get("marks_per_image", 4)
-                total_score_mi  = 0
-                mi_breakdown    = {}
-                for i, sub in enumerate(sub_images):
-                    given  = str(answers.get(str(i), "")).strip().lower()
-                    expect = str(sub.get("correct_answer", "")).strip().lower()
-                    if given == expect:
-                        total_score_mi += mpi
-                        mi_breakdown[f"image_{i+1}"] = {"score": mpi, "correct": True}
-                    else:
-                        mi_breakdown[f"image_{i+1}"] = {"score": 0, "correct": False, "expected": expect, "given": given}
-                grade_data = {"score": total_score_mi, "breakdown": mi_breakdown}
-            elif question_type.startswith('mcq') or question_type == 'mcq-annotation':
-                grade_data = await grade_mcq_question(
-                    student_text,
-                    grading_config.get("correct_answer", ""),
-                    q["marks"]
-                )
-            elif question_type in ('typing', 'typing-easy', 'typing-advanced'):
-                import json as json_lib
-                print(f"[TYPING DEBUG] temp_id={temp_id}, raw student_text='{student_text[:200] if student_text else 'EMPTY'}'")
-                try:
-                    answer_data = json_lib.loads(student_text)
-                    typed_text = answer_data.get("typed_text", "")
-                    client_time = answer_data.get("time_seconds", 0)
-                    print(f"[TYPING DEBUG] Parsed OK: typed_text_len={len(typed_text)}, time={client_time}")
-                except:
-                    typed_text = student_text
-                    client_time = 0
-                    print(f"[TYPING DEBUG] JSON parse failed, using raw text")
-
-                # Server-side time validation
-                time_limit = grading_config.get("time_limit", 60)
-                if session and session.started_at:
-                    from datetime import datetime, timezone
-                    elapsed = (datetime.now(timezone.utc) - session.started_at.replace(tzinfo=timezone.utc)).total_seconds()
-                    if client_time > 0 and client_time <= elapsed + 5:
-                        time_taken = client_time
-                    else:
-                        time_taken = min(elapsed, time_limit)
-                else:
-                    time_taken = min(client_time, time_limit) if client_time > 0 else time_limit
-
-                grade_data = await grade_typing_question(
-                    typed_text,
-                    grading_config.get("original_passage", ""),
-                    time_taken,
-                    q["marks"],
-                    grading_mode=grading_config.get("grading_mode", "both")
-                )
-            elif question_type == 'image-count':
-                grade_data = await grade_image_count_question(
-                    student_text,
-                    grading_config.get("correct_answer", 0),
-                    q["marks"],
-                    grading_config.get("tolerance", 0)
-                )
-            else:
-                grade_data = {"score": 0, "breakdown": {"error": "Manual review needed"}}
-
-            question_score = grade_data.get('score', 0)
-            total_score += question_score
-
-            content = q.get("content") or {}
-            question_text = content.get("question", content.get("text", content.get("content", "")))
-            content_url   = content.get("url", "")
-            passage       = content.get("passage", "")
-            options       = content.get("options", {})
-            jumble_parts  = content.get("jumble", {})
-
-            # Build human-readable correct_answer and student_answer for multi-image
-            sub_images_breakdown = None
-            if question_type == 'mcq-multi-image':
-                import json as _json
-                sub_images_gc = grading_config.get("sub_images", [])
-                content_sub_images = content.get("sub_images", [])
-                try:
-                    raw_answers = _json.loads(student_text) if student_text else {}
-                except:
-                    raw_answers = {}
-                correct_answer = " | ".join(
-                    f"Image {i+1}: {sub.get('correct_answer_text', sub.get('correct_answer', '?'))} ({sub.get('correct_answer', '?')})"
-                    for i, sub in enumerate(sub_images_gc)
-                )
-                student_display_parts = []
-                sub_images_breakdown = []
-                mpi = grading_config.get("marks_per_image", 4)
-                for i, sub in enumerate(sub_images_gc):
-                    chosen_key = raw_answers.get(str(i), "")
-                    chosen_text = options.get(chosen_key, "") if chosen_key else "No answer"
-                    correct_key = sub.get("correct_answer", "")
-                    correct_text = sub.get("correct_answer_text", options.get(correct_key, ""))
-                    is_correct = chosen_key.strip().lower() == correct_key.strip().lower() if chosen_key else False
-                    # Get image URL from content sub_images (has the actual URL)
-                    img_url = content_sub_images[i]["url"] if i < len(content_sub_images) else sub.get("url", "")
-                    sub_images_breakdown.append({
-                        "image_url": img_url,
-                        "correct_answer": correct_key,
-                        "correct_answer_text": correct_text,
-                        "student_answer": chosen_key or "—",
-                        "student_answer_text": chosen_text,
-                        "is_correct": is_correct,
-                        "score": mpi if is_correct else 0,
-                        "max_marks": mpi
-                    })
-                    student_display_parts.append(f"Image {i+1}: {chosen_text} ({chosen_key or '—'})")
-                student_display = " | ".join(student_display_parts)
-            else:
-                correct_answer = grading_config.get("reference", grading_config.get("correct_answer", grading_config.get("original_passage", "N/A")))
-                student_display = student_text[:500] if student_text else "No answer provided"
-
-            bd_entry = {
-                "question_id": q["temp_id"],
-                "type": question_type,
-                "content_url": content_url,
-                "passage": passage,
-                "question_text": question_text[:500] if question_text else "",
-                "options": options,
-                "jumble": jumble_parts,
-                "correct_answer": correct_answer[:500] if isinstance(correct_answer, str) else str(correct_answer),
-                "student_answer": student_display,
-                "max_marks": q["marks"],
-                "student_score": question_score,
-                "ai_feedback": grade_data.get('breakdown', {})
-            }
-            if sub_images_breakdown:
-                bd_entry["sub_images_breakdown"] = sub_images_breakdown
-            breakdown.append(bd_entry)
-        
-        # Mark session as completed
+        # Mark session as completed — the stored answers are what the grader reads
         session.is_completed = True
         session.answers = submission.answers
 
+        # Grade in the background; the client polls /exam/results/{id}/status
+        if settings.ASYNC_GRADING:
+            await enqueue_grading(db, saved_result_id, session.id)
+            await db.commit()
+            grading_queue.notify()
+            return {"result_id": saved_result_id, "status": "submitted"}
+
+        # Grade inline under a job claimed by this request, so no worker's
+        # orphan sweep picks the result up meanwhile
+        job = await enqueue_grading(db, saved_result_id, session.id, claim=True)
+        await db.commit()
+        if job is None:
+            return {"result_id": saved_result_id, "status": "submitted"}   # already queued
+
+        try:
+            outcome = await run_job(job)
+        except Exception as e:
+            print(f"[GRADING ERROR] Result {saved_result_id}: {str(e)}")
+            outcome = "failed"
+        if outcome == "deferred":
+            # Claude is down or rate-limited — the grading queue retries after the cooldown
+            grading_queue.notify()
+            return {"result_id": saved_result_id, "status": "submitted"}
+        if outcome != "done":
+            return {"result_id": saved_result_id, "warning": "Grading encountered an issue, please contact admin"}
+        return {"result_id": saved_result_id}
+
     else:
         # LEGACY MODE: Fetch all questions from database
         result = await db.execute(select(Question).where(Question.test_id == test_id))
@@ -630,28 +478,28 @@ async def finish_exam(
             grade_data = {}
             if q.question_type == 'video':
                 video_context = q.content.get("title", "Video description task") if q.content else "Video description task"
-                grade_data = await grade_video_question(
+                grade_data = await _grade_inline("video", grade_video_question(
                     student_text, 
                     grading.get("reference", q.reference_context),
                     grading.get("key_ideas", q.key_ideas or []),
                     video_context
-                )
+                ))
             elif q.question_type == 'image':
                 image_context = q.content.get("title", "Image description task") if q.content else "Image description task"
-                grade_data = await grade_image_question(
+                grade_data = await _grade_inline("image", grade_image_question(
                     student_text, 
                     grading.get("reference", q.reference_context),
                     grading.get("key_ideas", q.key_ideas or []),
                     image_context
-                )
+                ))
             elif q.question_type == 'reading':
                 passage = q.content.get("passage", q.content_url_or_text) if q.content else q.content_url_or_text
-                grade_data = await grade_reading_question(
+                grade_data = await _grade_inline("reading", grade_reading_question(
                     student_text, 
                     passage,
                     grading.get("reference", q.reference_context),
                     grading.get("key_ideas", q.key_ideas or [])
-                )
+                ))
             elif q.question_type == 'jumble':
                 grade_data = await grade_jumble_question(
                     student_text,
@@ -740,84 +588,7 @@ async def finish_exam(
     # =====================================================
     # COMPUTE SECTION SUMMARY (new evaluation format)
     # =====================================================
-    VISUAL_TYPES = {'video', 'video-robot', 'image'}
-    TYPING_TYPES = {'typing', 'typing-easy', 'typing-advanced'}
-
-    mcq_jumble_qs = [b for b in breakdown if b['type'] not in VISUAL_TYPES and b['type'] not in TYPING_TYPES]
-    typing_qs     = [b for b in breakdown if b['type'] in TYPING_TYPES]
-    visual_qs     = [b for b in breakdown if b['type'] in VISUAL_TYPES]
-
-    # --- MCQ + Jumble section ---
-    mcq_correct = sum(b['student_score'] for b in mcq_jumble_qs)
-    mcq_max     = sum(b['max_marks']     for b in mcq_jumble_qs)
-    mcq_pct     = round((mcq_correct / mcq_max) * 100, 1) if mcq_max > 0 else 0.0
-
-    # --- Typing section ---
-    typing_tasks = []
-    for b in typing_qs:
-        fb  = b.get('ai_feedback', {})
-        wpm = fb.get('net_wpm', 0)
-        acc = fb.get('accuracy', 0)
-        typing_tasks.append({
-            'question_id': b['question_id'],
-            'type':        b['type'],
-            'wpm':         wpm,
-            'accuracy':    acc,
-            'passed':      acc >= 80
-        })
-    avg_wpm       = round(sum(t['wpm']      for t in typing_tasks) / len(typing_tasks), 1) if typing_tasks else 0
-    avg_accuracy  = round(sum(t['accuracy'] for t in typing_tasks) / len(typing_tasks), 1) if typing_tasks else 100
-    typing_passed = all(t['passed'] for t in typing_tasks) if typing_tasks else True
-    typing_fail_reasons = [
-        f"Task {i+1} accuracy {t['accuracy']}% is below 80%"
-        for i, t in enumerate(typing_tasks) if not t['passed']
-    ]
-
-    # --- Visual section ---
-    visual_ranks = []
-    for b in visual_qs:
-        fb   = b.get('ai_feedback', {})
-        rank = fb.get('rank', 'Bad')
-        visual_ranks.append({
-            'question_id': b['question_id'],
-            'type':        b['type'],
-            'rank':        rank,
-            'feedback':    fb.get('feedback', ''),
-            'passed':      rank in ('Good', 'Medium')
-        })
-    visual_passed_count = sum(1 for q in visual_ranks if q['passed'])
-    visual_total        = len(visual_ranks)
-    visual_pass_pct     = round((visual_passed_count / visual_total) * 100) if visual_total > 0 else 100
-    visual_passed = all(q['passed'] for q in visual_ranks) if visual_ranks else True
-
-    section_summary = {
-        'mcq_jumble': {
-            'score_pct':      mcq_pct,
-            'correct_marks':  mcq_correct,
-            'max_marks':      mcq_max,
-            'question_count': len(mcq_jumble_qs)
-        },
-        'typing': {
-            'tasks':          typing_tasks,
-            'avg_wpm':        avg_wpm,
-            'avg_accuracy':   avg_accuracy,
-            'benchmark_wpm':  30,
-            'passed':         typing_passed,
-            'fail_reasons':   typing_fail_reasons,
-            'question_count': len(typing_qs)
-        },
-        'visual': {
-            'questions':      visual_ranks,
-            'passed':         visual_passed,
-            'pass_pct':       visual_pass_pct,
-            'passed_count':   visual_passed_count,
-            'question_count': visual_total
-        },
-        'overall_passed': typing_passed and visual_passed
-    }
-
-    # total_score = raw MCQ+Jumble correct marks; capped at actual max to prevent >100%
-    total_score = min(mcq_correct, mcq_max)
+    section_summary, total_score = build_section_summary(breakdown)
 
 
     try:
@@ -847,7 +618,30 @@ async def finish_exam(
 
     return {"result_id": final_result.id}
 
-# 4. Get Result Details
+# 4. Grading status (poll after finish until ready)
+@router.get("/results/{result_id}/status")
+async def get_result_status(
+    result_id: int,
+    db: AsyncSession = Depends(get_db),
+    user: User = Depends(get_current_user)
+):
+    result = await db.execute(
+        select(TestResult.user_id, TestResult.status).where(TestResult.id == result_id)
+    )
+    row = result.first()
+    if not row:
+        raise HTTPException(status_code=404, detail="Result not found")
+    if row.user_id != user.id and user.role != 'admin':
+        raise HTTPException(status_code=403, detail="Access denied")
+
+    return {
+        "result_id": result_id,
+        "status": row.status,
+        "ready": row.status in ("graded", "re-evaluated"),
+        "failed": row.status == "grading_failed"
+    }
+
+# 5. Get Result Details
 @router.get("/results/{result_id}")
 async def get_result_details(
     result_id: int, 
@@ -874,6 +668,7 @@ async def get_result_details(
         section_sum = {}
 
     return {
+        "status":          exam_result.status,
         "total_score":     exam_result.total_score,
         "section_summary": section_sum,
         "breakdown":       questions,
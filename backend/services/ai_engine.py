@@ -1,86 +1,100 @@
 import asyncio
-from concurrent.futures import ThreadPoolExecutor
+import copy
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, List, Optional, Tuple
 import anthropic
+from pydantic import ValidationError
 import json
 import re
 from config import settings
-
-# Dedicated thread pool for AI tasks
-ai_executor = ThreadPoolExecutor(max_workers=3)
+from services.prompts import (
+    GRADE_TOOL, IMAGE_STRICT, READING_STRICT, VIDEO_STRICT, PromptTemplate, packed_system_blocks,
+)
+from services.ai_resilience import AIUnavailableError, guarded_call
+from services.grading_providers import AnthropicGradingProvider, GradingProvider, create_grading_provider
+from services.response_cache import response_cache
 
 print("Loading AI Engine... Claude 3.5 Sonnet (This happens once)")
 
-# Claude client — created fresh per call (lightweight, no network cost at creation)
-_claude = None
-MODEL = "claude-haiku-4-5-20251001"
-
-def _get_claude():
-    """Always create a fresh client reading the current key from settings."""
-    key = settings.ANTHROPIC_API_KEY
-    return anthropic.Anthropic(api_key=key)
-
-# --- Lightweight Similarity Functions (No Heavy ML Dependencies) ---
-
-def _normalize_text(text: str) -> set:
-    """Normalize text to set of words for comparison"""
-    if not text:
-        return set()
-    text = re.sub(r'[^\w\s]', '', text.lower())
-    return set(text.split())
-
-def _sync_get_vector_similarity(text1: str, text2: str) -> float:
-    """Lightweight word overlap similarity (Jaccard similarity)"""
-    if not text1 or not text2:
-        return 0.0
-    words1 = _normalize_text(text1)
-    words2 = _normalize_text(text2)
-    if not words1 or not words2:
-        return 0.0
-    intersection = len(words1 & words2)
-    union = len(words1 | words2)
-    return intersection / union if union > 0 else 0.0
-
-async def get_vector_similarity(text1: str, text2: str) -> float:
-    """Async Wrapper (Non-Blocking)"""
-    loop = asyncio.get_event_loop()
-    return await loop.run_in_executor(ai_executor, _sync_get_vector_similarity, text1, text2)
-
-def _sync_check_key_ideas(student_text: str, key_ideas: list) -> float:
-    """Check if student text contains key ideas using word matching"""
-    if not key_ideas:
-        return 1.0
-    student_words = _normalize_text(student_text)
-    match_count = 0
-    for idea in key_ideas:
-        idea_words = _normalize_text(idea)
-        if idea_words and len(student_words & idea_words) / len(idea_words) > 0.5:
-            match_count += 1
-    return min(match_count / len(key_ideas), 1.0)
-
-async def check_key_ideas(student_text: str, key_ideas: list) -> float:
-    loop = asyncio.get_event_loop()
-    return await loop.run_in_executor(ai_executor, _sync_check_key_ideas, student_text, key_ideas)
-
+# One grading provider per process (AI_PROVIDER) — created in the FastAPI
+# lifespan (or grading_worker.py); for Anthropic it owns the shared keep-alive
+# client, so every call reuses the same connection pool
+_provider: Optional[GradingProvider] = None
+_claude_slots: Optional[asyncio.Semaphore] = None
+
+def init_grading_provider() -> GradingProvider:
+    """Create the configured grading provider and the in-flight request cap."""
+    global _provider, _claude_slots
+    _provider = create_grading_provider()
+    _claude_slots = asyncio.Semaphore(settings.CLAUDE_MAX_CONCURRENCY)
+    print(f"AI grading provider: {_provider.name} ({_provider.model})")
+    return _provider
+
+async def close_grading_provider():
+    """Close the provider's connection pool (lifespan shutdown)."""
+    global _provider
+    if _provider is not None:
+        provider, _provider = _provider, None
+        await provider.close()
+
+def grading_provider() -> GradingProvider:
+    """The shared provider — created lazily when the lifespan hasn't run (scripts)."""
+    return _provider if _provider is not None else init_grading_provider()
+
+def anthropic_client() -> anthropic.AsyncAnthropic:
+    """The raw AsyncAnthropic client, for APIs beyond messages.create (batches)."""
+    provider = grading_provider()
+    if not isinstance(provider, AnthropicGradingProvider):
+        raise RuntimeError(f"AI_PROVIDER is '{provider.name}' — the Anthropic API is not available")
+    return provider.client
 
 # ============================================================
 # CORE CLAUDE CALLER
 # ============================================================
 
-def _call_claude(prompt: str) -> dict:
-    """Thread-safe Claude 3.5 Sonnet call — returns parsed JSON dict"""
+def _parse_claude_json(text: str) -> dict:
+    """Parse a Claude reply that should be a bare JSON object."""
+    text = text.strip()
+    # Strip any markdown code fences
+    text = re.sub(r'^```json\s*', '', text, flags=re.MULTILINE)
+    text = re.sub(r'^```\s*', '', text, flags=re.MULTILINE)
+    return json.loads(text.strip())
+
+def claude_request_params(prompt: str, system: Optional[list] = None, max_tokens: int = 1024) -> dict:
+    """Messages API parameters for one grading prompt (also used for batches).
+    `system` is a template's pre-rendered, cacheable system block (services/prompts.py)."""
+    params = {
+        "model": grading_provider().model,
+        "max_tokens": max_tokens,
+        "messages": [{"role": "user", "content": prompt}],
+    }
+    if system:
+        params["system"] = system
+    return params
+
+async def _create_message(params: dict):
+    """One Messages API request on the grading provider, behind the rate limiter,
+    retries and circuit breaker. At most CLAUDE_MAX_CONCURRENCY requests are in
+    flight per process."""
+    provider = grading_provider()
+
+    async def attempt():
+        async with _claude_slots:
+            return await provider.create_message(params)
+
+    return await guarded_call(attempt)
+
+async def _call_claude(prompt: str, system: Optional[list] = None, max_tokens: int = 1024) -> dict:
+    """Claude call on the shared async client — returns parsed JSON dict.
+    Raises AIUnavailableError when Claude is down or rate-limited past our retries."""
+    text = ""
     try:
-        client = _get_claude()
-        message = client.messages.create(
-            model=MODEL,
-            max_tokens=1024,
-            messages=[{"role": "user", "content": prompt}]
-        )
-        text = message.content[0].text.strip()
-        # Strip any markdown code fences
-        text = re.sub(r'^```json\s*', '', text, flags=re.MULTILINE)
-        text = re.sub(r'^```\s*', '', text, flags=re.MULTILINE)
-        text = text.strip()
-        return json.loads(text)
+        message = await _create_message(claude_request_params(prompt, system, max_tokens))
+        text = message.content[0].text
+        return _parse_claude_json(text)
+    except AIUnavailableError:
+        raise
     except json.JSONDecodeError as e:
         print(f"Claude JSON parse error: {e}\nRaw: {text[:300]}")
         return {"relevance": 1, "grammar": 5, "feedback": "AI parse error"}
@@ -88,6 +102,189 @@ def _call_claude(prompt: str) -> dict:
         print(f"Claude API error: {e}")
         return {"relevance": 1, "grammar": 5, "feedback": f"AI Error: {str(e)}"}
 
+def grader_request_params(prompt: str, template: PromptTemplate) -> dict:
+    """Messages API parameters for a rubric grading (also used for batches): the
+    cacheable rubric, the template's max_tokens and a forced submit_grade tool call."""
+    params = claude_request_params(prompt, template.system_blocks, template.max_tokens)
+    params["tools"] = template.tools
+    params["tool_choice"] = template.tool_choice
+    return params
+
+def grade_tool_use(message):
+    """The submit_grade tool_use block of a Messages API reply, if any."""
+    for block in message.content:
+        if getattr(block, "type", None) == "tool_use" and block.name == GRADE_TOOL:
+            return block
+    return None
+
+async def _call_grader(prompt: str, template: PromptTemplate) -> dict:
+    """
+    Rubric grading through the submit_grade tool, validated against the
+    template's output model. A reply that breaks the schema gets one repair
+    turn (the validation errors sent back as an error tool_result); if that
+    fails too the grading comes back without a total_score, so it is never
+    cached. Transient API errors are retried by _create_message; when they
+    persist AIUnavailableError propagates so the job is deferred.
+    """
+    params = grader_request_params(prompt, template)
+    try:
+        for attempt in range(2):
+            message = await _create_message(params)
+            tool_use = grade_tool_use(message)
+            if tool_use is None:
+                print(f"[GRADER] {template.name}: reply had no {GRADE_TOOL} call (stop_reason={message.stop_reason})")
+                break
+            try:
+                return template.validate(tool_use.input)
+            except ValidationError as e:
+                print(f"[GRADER] {template.name}: schema violation (attempt {attempt + 1}): {e.error_count()} errors")
+                params = {**params, "messages": params["messages"] + [
+                    {"role": "assistant", "content": [
+                        {"type": "tool_use", "id": tool_use.id, "name": tool_use.name, "input": tool_use.input},
+                    ]},
+                    {"role": "user", "content": [{
+                        "type": "tool_result", "tool_use_id": tool_use.id, "is_error": True,
+                        "content": f"The grade does not match the schema:\n{e}\nCall {GRADE_TOOL} again with every field corrected.",
+                    }]},
+                ]}
+        return {"relevance": 1, "grammar": 5, "feedback": "AI schema error"}
+    except AIUnavailableError:
+        raise
+    except Exception as e:
+        print(f"Claude API error: {e}")
+        return {"relevance": 1, "grammar": 5, "feedback": f"AI Error: {str(e)}"}
+
+
+def _normalize_input(text: str) -> str:
+    """Collapse whitespace runs — case and punctuation are graded, so they stay."""
+    return " ".join((text or "").split())
+
+def _answer_fingerprint(text: str) -> str:
+    """Dedupe / cache form of an answer: whitespace collapsed, like the prompt.
+    AI_DEDUPE_FOLD_CASE_PUNCTUATION also casefolds and strips punctuation, so
+    "Walk to the table." and "walk to the table" share one grading."""
+    if not settings.AI_DEDUPE_FOLD_CASE_PUNCTUATION:
+        return _normalize_input(text)
+    return " ".join(re.sub(r'[^\w\s]', ' ', (text or "").casefold()).split())
+
+PlannedRequest = Tuple[str, PromptTemplate]   # (user prompt, template it was rendered from)
+
+# Set by planning_requests(): evaluations record their prompt instead of calling Claude
+_planned_requests: ContextVar[Optional[Dict[str, PlannedRequest]]] = ContextVar("planned_ai_requests", default=None)
+
+@contextmanager
+def planning_requests():
+    """Dry-run AI grading. Inside the block every cacheable evaluation records
+    {cache key: prompt} in the yielded dict and returns a zero grade, so the
+    normal grading code can enumerate the Claude calls a re-grade would make
+    (see services/reevaluation.py)."""
+    plan: Dict[str, PlannedRequest] = {}
+    token = _planned_requests.set(plan)
+    try:
+        yield plan
+    finally:
+        _planned_requests.reset(token)
+
+# Set by prefilled_responses(): gradings already obtained by a packed request
+_prefilled_responses: ContextVar[Optional[Dict[str, dict]]] = ContextVar("prefilled_ai_responses", default=None)
+
+@contextmanager
+def prefilled_responses(responses: Dict[str, dict]):
+    """Inside the block, evaluations whose cache key is in `responses` use that
+    grading instead of calling Claude (see grade_packed)."""
+    token = _prefilled_responses.set(responses)
+    try:
+        yield
+    finally:
+        _prefilled_responses.reset(token)
+
+# Gradings currently in flight, by cache key — concurrent submissions giving
+# the same answer to the same item wait for the first call instead of repeating it
+_inflight: Dict[str, asyncio.Future] = {}
+dedupe_stats = {"coalesced": 0}
+
+async def _cached_claude(template: PromptTemplate, answer: str, item_inputs: dict, prompt: str) -> dict:
+    """_call_grader behind answer deduplication and the persistent response cache
+    (services/response_cache.py). Each (item inputs, answer fingerprint) pair is
+    graded once — concurrent duplicates share the in-flight call, later ones hit
+    the cache. Only complete gradings (with a total_score) are cached."""
+    key = response_cache.key(grading_provider().model, template.name, template.version,
+                             {**item_inputs, "answer": _answer_fingerprint(answer)})
+
+    plan = _planned_requests.get()
+    if plan is not None:
+        plan.setdefault(key, (prompt, template))
+        return {"total_score": 0, "passed": False, "feedback": ""}
+
+    prefilled = _prefilled_responses.get()
+    if prefilled and key in prefilled:
+        if settings.AI_CACHE_ENABLED:
+            await response_cache.put(key, prefilled[key])
+        return copy.deepcopy(prefilled[key])
+
+    pending = _inflight.get(key) if settings.AI_DEDUPE_ANSWERS else None
+    if pending is not None:
+        await asyncio.wait([pending])
+        if not pending.cancelled():
+            dedupe_stats["coalesced"] += 1
+            return copy.deepcopy(pending.result())
+        # The first caller was cancelled — grade it ourselves
+
+    future = asyncio.get_running_loop().create_future()
+    _inflight[key] = future
+    try:
+        result = await response_cache.get(key) if settings.AI_CACHE_ENABLED else None
+        if result is None:
+            result = await _call_grader(prompt, template)
+            if settings.AI_CACHE_ENABLED and isinstance(result, dict) and "total_score" in result:
+                await response_cache.put(key, result)
+        future.set_result(result)
+        return copy.deepcopy(result)
+    finally:
+        if not future.done():
+            future.cancel()
+        if _inflight.get(key) is future:
+            del _inflight[key]
+
+
+async def grade_packed(requests: Dict[str, PlannedRequest]) -> Dict[str, dict]:
+    """
+    Grades several planned requests (one candidate's answers) with a single
+    Claude call whose reply is a JSON array keyed by question label.
+    Each entry is validated against its template's output model.
+    Returns {cache key: grading} for the entries that came back valid —
+    anything missing or malformed is left to the normal per-question call.
+    """
+    rubrics: List[str] = []
+    labels: Dict[str, str] = {}
+    blocks = []
+    for n, (key, (prompt, template)) in enumerate(requests.items(), start=1):
+        if template.system not in rubrics:
+            rubrics.append(template.system)
+        label = f"Q{n}"
+        labels[label] = key
+        blocks.append(f"### {label} — grade with RUBRIC {rubrics.index(template.system) + 1}\n{prompt}")
+
+    reply = await _call_claude(
+        "\n\n".join(blocks), packed_system_blocks(tuple(rubrics)),
+        max_tokens=min(sum(template.max_tokens for _, template in requests.values()) + 256, 8192),
+    )
+    if not isinstance(reply, list):
+        print(f"[PACKED] Reply was not a JSON array — grading {len(requests)} answers one by one")
+        return {}
+    graded = {}
+    for entry in reply:
+        if not isinstance(entry, dict) or entry.get("question_id") not in labels:
+            continue
+        key = labels[entry["question_id"]]
+        try:
+            graded[key] = requests[key][1].validate(entry)
+        except ValidationError:
+            pass   # re-graded on its own, with the tool schema and a repair turn
+    if len(graded) < len(requests):
+        print(f"[PACKED] {len(requests) - len(graded)} of {len(requests)} answers missing or invalid in the packed reply")
+    return graded
+
 
 async def evaluate_english_quality(text: str, context_type: str) -> dict:
     """
@@ -118,9 +315,10 @@ Output ONLY valid JSON in this exact format, no other text:
 }}"""
 
     try:
-        loop = asyncio.get_event_loop()
-        result = await loop.run_in_executor(ai_executor, _call_claude, prompt)
+        result = await _call_claude(prompt)
         return result
+    except AIUnavailableError:
+        raise
     except Exception as e:
         print(f"Eval Error: {e}")
         return {"relevance": 1, "grammar": 5, "feedback": "System Error"}
@@ -139,74 +337,16 @@ async def evaluate_video_strict(user_answer: str, correct_answer: str, video_con
     - Instruction Compliance: 2 marks
     - Spelling & Formatting: 2 marks
     """
-    prompt = f"""You are a STRICT English teacher grading a proficiency test. You do NOT give participation points. You FAIL students who deserve to fail.
-
-VIDEO DESCRIPTION: {video_context}
-CORRECT ANSWER: "{correct_answer}"
-USER'S ANSWER: "{user_answer}"
-
-TOTAL MARKS: 15
-
-BE BRUTALLY HONEST. This is NOT about being nice - it's about English proficiency.
-
-CRITICAL RULES:
-1. If the main content is WRONG (wrong object/action), maximum possible score is 6/15 (FAIL)
-2. If they're vague when they should be specific, it shows they DON'T understand
-3. Multiple spelling errors = they can't spell = LOW marks
-4. Missing key details = they didn't pay attention = LOW marks
-5. "Close enough" is NOT acceptable in language learning
-
-EVALUATION CRITERIA:
-
-1. GRAMMAR & STRUCTURE (4 marks):
-   - Missing ONE article (a, an, the) = -1 mark
-   - Wrong preposition = -1 mark
-   - Incomplete sentence = -2 marks
-   - Multiple grammar errors = 0 marks
-
-2. VOCABULARY & WORD CHOICE (4 marks):
-   - Did they identify the CORRECT objects from the video?
-   - Generic words (stuff, things, outside) instead of specific ones = -2 marks minimum
-   - Wrong object entirely = 0 marks
-   - Vague = Poor English = Low marks
-
-3. CLARITY & MEANING (3 marks):
-   - Does it MATCH the correct answer's meaning?
-   - Missing key descriptors = -1 mark each
-   - If answer is vague/unclear/wrong = 0-1 marks maximum
-
-4. INSTRUCTION COMPLIANCE (2 marks):
-   - MUST start with EXACTLY: "walk to" OR "turn right to" OR "turn left to"
-   - "walking", "walked", "go to" = WRONG = 0 marks
-   - All or nothing: 2 marks or 0 marks
-
-5. SPELLING & FORMATTING (2 marks):
-   - ONE spelling error = -1 mark
-   - TWO+ spelling errors = 0 marks
-
-SCORING PHILOSOPHY:
-- If they got the main content WRONG = FAIL (below 8/15)
-- If they were vague/generic = LOW marks (below 10/15)
-- Only give high marks (13+) if answer is truly GOOD
-- Most students should score 6-12, NOT 12-15
-
-Output ONLY valid JSON, no other text:
-{{
-    "grammar_structure_score": 0-4,
-    "vocabulary_word_choice_score": 0-4,
-    "clarity_meaning_score": 0-3,
-    "instruction_compliance_score": 0 or 2,
-    "spelling_formatting_score": 0-2,
-    "total_score": 0-15,
-    "passed": true or false,
-    "feedback": "Specific, constructive feedback explaining deductions",
-    "grade_justification": "Brief breakdown of why each score was given"
-}}"""
+    user_answer = _normalize_input(user_answer)
+    prompt = VIDEO_STRICT.render(context=video_context, correct=correct_answer, answer=user_answer)
 
     try:
-        loop = asyncio.get_event_loop()
-        result = await loop.run_in_executor(ai_executor, _call_claude, prompt)
+        result = await _cached_claude(VIDEO_STRICT, user_answer, {
+            "correct": correct_answer, "context": video_context,
+        }, prompt)
         return result
+    except AIUnavailableError:
+        raise
     except Exception as e:
         print(f"Video Eval Error: {e}")
         return {"total_score": 0, "passed": False, "feedback": "Evaluation Error"}
@@ -217,62 +357,16 @@ async def evaluate_image_strict(user_answer: str, correct_answer: str, image_con
     Strict Image Question Evaluation (15 Marks Total)
     Same rubric as video but focused on visual description.
     """
-    prompt = f"""You are a STRICT English teacher grading a proficiency test. You do NOT give participation points.
-
-IMAGE DESCRIPTION: {image_context}
-CORRECT ANSWER: "{correct_answer}"
-USER'S ANSWER: "{user_answer}"
-
-TOTAL MARKS: 15
-
-EVALUATION CRITERIA:
-
-1. GRAMMAR & STRUCTURE (4 marks):
-   - Missing articles (a, an, the) = -1 mark each
-   - Wrong preposition/verb form = -1 mark
-   - Incomplete/run-on sentence = -2 marks
-
-2. VOCABULARY & OBJECT IDENTIFICATION (4 marks):
-   - Did they identify the CORRECT objects in the image?
-   - Wrong object = 0 marks
-   - Vague description (thing, stuff) = -2 marks
-   - Missing key objects = -1 mark each
-
-3. CLARITY & DETAIL (3 marks):
-   - Does description match the image accurately?
-   - Missing important details = -1 mark each
-   - Confusing/unclear = 0-1 marks
-
-4. INSTRUCTION COMPLIANCE (2 marks):
-   - Must follow the exact format requested
-   - Binary: 2 marks or 0 marks
-
-5. SPELLING & FORMATTING (2 marks):
-   - ONE spelling error = -1 mark
-   - TWO+ spelling errors = 0 marks
-
-STRICT RULES:
-- Wrong content = maximum 6/15
-- Vague answers = maximum 10/15
-- Multiple errors = FAIL
-
-Output ONLY valid JSON, no other text:
-{{
-    "grammar_structure_score": 0-4,
-    "vocabulary_word_choice_score": 0-4,
-    "clarity_meaning_score": 0-3,
-    "instruction_compliance_score": 0 or 2,
-    "spelling_formatting_score": 0-2,
-    "total_score": 0-15,
-    "passed": true or false,
-    "feedback": "Specific feedback explaining deductions",
-    "grade_justification": "Brief breakdown of scores"
-}}"""
+    user_answer = _normalize_input(user_answer)
+    prompt = IMAGE_STRICT.render(context=image_context, correct=correct_answer, answer=user_answer)
 
     try:
-        loop = asyncio.get_event_loop()
-        result = await loop.run_in_executor(ai_executor, _call_claude, prompt)
+        result = await _cached_claude(IMAGE_STRICT, user_answer, {
+            "correct": correct_answer, "context": image_context,
+        }, prompt)
         return result
+    except AIUnavailableError:
+        raise
     except Exception as e:
         print(f"Image Eval Error: {e}")
         return {"total_score": 0, "passed": False, "feedback": "Evaluation Error"}
@@ -311,14 +405,15 @@ Return ONLY valid JSON, no other text:
 }}"""
 
     try:
-        loop = asyncio.get_event_loop()
-        result = await loop.run_in_executor(ai_executor, _call_claude, prompt)
+        result = await _call_claude(prompt)
         # Ensure rank is one of the three valid values
         rank = result.get("rank", "Bad")
         if rank not in ("Good", "Medium", "Bad"):
             rank = "Bad"
         result["rank"] = rank
         return result
+    except AIUnavailableError:
+        raise
     except Exception as e:
         print(f"Visual Rank Eval Error: {e}")
         return {
@@ -338,69 +433,20 @@ async def evaluate_reading_strict(user_summary: str, original_passage: str, refe
     - Coherence & Flow: 2 marks
     - Vocabulary Precision: 1 mark
     """
+    user_summary = _normalize_input(user_summary)
     key_ideas_str = ", ".join(key_ideas) if key_ideas else "Not specified"
-
-    prompt = f"""You are a STRICT English teacher grading a reading comprehension summary. Be harsh but fair.
-
-ORIGINAL PASSAGE: "{original_passage[:500]}..."
-REFERENCE SUMMARY: "{reference_summary}"
-KEY IDEAS TO COVER: {key_ideas_str}
-USER'S SUMMARY: "{user_summary}"
-
-TOTAL MARKS: 15
-
-EVALUATION CRITERIA:
-
-1. KEY IDEA COVERAGE (5 marks):
-   - Award 1 mark for each key idea correctly mentioned
-   - Missing key ideas = direct mark deduction
-   - Added incorrect information = -1 mark
-
-2. PARAPHRASING QUALITY (4 marks):
-   - Direct copy-paste = 0 marks (AUTOMATIC FAIL for this section)
-   - Good paraphrasing with own words = 4 marks
-   - Partial paraphrasing = 2-3 marks
-   - Mostly copied = 0-1 marks
-
-3. GRAMMAR & STRUCTURE (3 marks):
-   - Complete, well-formed sentences = 3 marks
-   - Minor errors = 2 marks
-   - Multiple errors = 1 mark
-   - Major errors = 0 marks
-
-4. COHERENCE & FLOW (2 marks):
-   - Logical order, smooth transitions = 2 marks
-   - Choppy but understandable = 1 mark
-   - Disorganized = 0 marks
-
-5. VOCABULARY PRECISION (1 mark):
-   - Appropriate academic vocabulary = 1 mark
-   - Basic/repetitive vocabulary = 0 marks
-
-STRICT RULES:
-- Copy-paste from passage = maximum 5/15
-- Missing half the key ideas = maximum 8/15
-- Incoherent summary = maximum 6/15
-
-Output ONLY valid JSON, no other text:
-{{
-    "key_idea_coverage_score": 0-5,
-    "paraphrasing_score": 0-4,
-    "grammar_structure_score": 0-3,
-    "coherence_flow_score": 0-2,
-    "vocabulary_precision_score": 0-1,
-    "total_score": 0-15,
-    "passed": true or false,
-    "key_ideas_found": ["list of key ideas student mentioned"],
-    "key_ideas_missing": ["list of key ideas student missed"],
-    "feedback": "Specific feedback on summary quality",
-    "grade_justification": "Brief breakdown of scores"
-}}"""
+    prompt = READING_STRICT.render(
+        passage=original_passage[:500], reference=reference_summary,
+        key_ideas=key_ideas_str, answer=user_summary,
+    )
 
     try:
-        loop = asyncio.get_event_loop()
-        result = await loop.run_in_executor(ai_executor, _call_claude, prompt)
+        result = await _cached_claude(READING_STRICT, user_summary, {
+            "passage": original_passage[:500], "reference": reference_summary, "key_ideas": key_ideas_str,
+        }, prompt)
         return result
+    except AIUnavailableError:
+        raise
     except Exception as e:
         print(f"Reading Eval Error: {e}")
         return {"total_score": 0, "passed": False, "feedback": "Evaluation Error"}
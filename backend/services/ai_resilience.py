@@ -0,0 +1,205 @@
+"""
+Resilience layer for Claude calls (used by ai_engine).
+
+  TokenBucket     client-side rate limit: CLAUDE_REQUESTS_PER_MINUTE with
+                  bursts of CLAUDE_BURST, so a cohort submitting at once
+                  queues locally instead of collecting 429s.
+  retries         full-jitter exponential backoff on retryable errors — 408,
+                  409, 429, 5xx (incl. 529 overloaded), timeouts and
+                  connection errors — honouring retry-after, up to
+                  CLAUDE_MAX_RETRIES times.
+  CircuitBreaker  opens after CLAUDE_BREAKER_FAILURES consecutive calls that
+                  still failed after their retries. While open, calls fail
+                  fast without reaching the API; after
+                  CLAUDE_BREAKER_COOLDOWN_SECONDS a single probe call is let
+                  through (half-open) and its outcome closes or re-opens it.
+
+Both an open breaker and exhausted retries raise AIUnavailableError. The
+graders do not turn it into a fallback grade: it propagates to the grading
+queue, which re-queues the job for after the cooldown instead of scoring the
+answers 0 (services/grading_queue.py).
+
+State is per process (each grading_worker.py has its own bucket and
+breaker), so split CLAUDE_REQUESTS_PER_MINUTE between processes sharing an
+API key. metrics() is reported by GET /health.
+"""
+import asyncio
+import random
+import time
+from typing import Awaitable, Callable, Optional, TypeVar
+
+import anthropic
+
+from config import settings
+
+T = TypeVar("T")
+
+
+class AIUnavailableError(Exception):
+    """Claude cannot be reached right now — retry the whole job later."""
+
+    def __init__(self, message: str, retry_after: float = 0.0):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def is_retryable(error: BaseException) -> bool:
+    if isinstance(error, anthropic.APIConnectionError):   # includes timeouts
+        return True
+    if isinstance(error, anthropic.APIStatusError):
+        return error.status_code in (408, 409, 429) or error.status_code >= 500
+    return False
+
+
+class TokenBucket:
+    def __init__(self, rate_per_minute: int, burst: int):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = max(1, burst)
+        self._tokens = float(self.capacity)
+        self._updated = time.monotonic()
+        self.waits = 0
+
+    def available(self) -> float:
+        if self.rate <= 0:
+            return float(self.capacity)
+        return min(self.capacity, self._tokens + (time.monotonic() - self._updated) * self.rate)
+
+    async def acquire(self):
+        """Take one token, sleeping until it is available. Tokens are reserved
+        synchronously (the balance may go negative), so waiters are served in
+        arrival order without a lock."""
+        if self.rate <= 0:
+            return
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        self._tokens -= 1
+        if self._tokens >= 0:
+            return
+        self.waits += 1
+        try:
+            await asyncio.sleep(-self._tokens / self.rate)
+        except asyncio.CancelledError:
+            self._tokens += 1   # hand the reservation back
+            raise
+
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold: int, cooldown_seconds: float):
+        self.failure_threshold = failure_threshold
+        self.cooldown_seconds = cooldown_seconds
+        self.state = "closed"   # closed | open | half_open
+        self.consecutive_failures = 0
+        self.times_opened = 0
+        self.rejected = 0
+        self._opened_at = 0.0
+        self._probing = False
+
+    def retry_after(self) -> float:
+        if self.state == "closed":
+            return 0.0
+        return max(0.0, self._opened_at + self.cooldown_seconds - time.monotonic())
+
+    def before_call(self):
+        """Raise AIUnavailableError unless a call may go out now."""
+        if self.state == "open" and self.retry_after() <= 0:
+            self.state = "half_open"
+        if self.state == "open" or (self.state == "half_open" and self._probing):
+            self.rejected += 1
+            raise AIUnavailableError("Claude circuit breaker is open", self.retry_after() or self.cooldown_seconds)
+        if self.state == "half_open":
+            self._probing = True
+
+    def record_success(self):
+        if self.state != "closed":
+            print("[AI BREAKER] Closed — Claude is answering again")
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self._probing = False
+
+    def record_failure(self):
+        self.consecutive_failures += 1
+        self._probing = False
+        if self.state == "half_open" or self.consecutive_failures >= self.failure_threshold:
+            if self.state != "open":
+                self.times_opened += 1
+                print(f"[AI BREAKER] Open for {self.cooldown_seconds:.0f}s after "
+                      f"{self.consecutive_failures} consecutive failures")
+            self.state = "open"
+            self._opened_at = time.monotonic()
+
+    def release(self):
+        """The call ended without telling us anything (e.g. cancelled)."""
+        self._probing = False
+
+
+rate_limiter = TokenBucket(settings.CLAUDE_REQUESTS_PER_MINUTE, settings.CLAUDE_BURST)
+breaker = CircuitBreaker(settings.CLAUDE_BREAKER_FAILURES, settings.CLAUDE_BREAKER_COOLDOWN_SECONDS)
+stats = {"calls": 0, "retries": 0, "failures": 0}
+
+
+def _backoff(attempt: int, error: BaseException) -> float:
+    retry_after: Optional[str] = None
+    response = getattr(error, "response", None)
+    if response is not None:
+        retry_after = response.headers.get("retry-after")
+    try:
+        if retry_after is not None:
+            return min(float(retry_after), settings.CLAUDE_RETRY_MAX_SECONDS)
+    except ValueError:
+        pass   # an HTTP date — fall back to our own backoff
+    return random.uniform(0, min(settings.CLAUDE_RETRY_MAX_SECONDS, settings.CLAUDE_RETRY_BASE_SECONDS * 2 ** attempt))
+
+
+async def guarded_call(make_call: Callable[[], Awaitable[T]]) -> T:
+    """Run make_call() behind the breaker and the rate limiter, retrying retryable errors."""
+    breaker.before_call()
+    stats["calls"] += 1
+    try:
+        for attempt in range(settings.CLAUDE_MAX_RETRIES + 1):
+            await rate_limiter.acquire()
+            try:
+                result = await make_call()
+                break
+            except Exception as e:
+                if not is_retryable(e) or attempt >= settings.CLAUDE_MAX_RETRIES:
+                    raise
+                delay = _backoff(attempt, e)
+                stats["retries"] += 1
+                print(f"[AI RETRY] {type(e).__name__} — retry {attempt + 1}/{settings.CLAUDE_MAX_RETRIES} in {delay:.1f}s")
+                await asyncio.sleep(delay)
+    except Exception as e:
+        if not is_retryable(e):
+            if isinstance(e, anthropic.APIStatusError):
+                breaker.record_success()   # the API answered; the request itself was bad
+            else:
+                breaker.release()
+            raise
+        stats["failures"] += 1
+        breaker.record_failure()
+        raise AIUnavailableError(f"Claude unavailable: {type(e).__name__}: {e}",
+                                 breaker.retry_after() or settings.CLAUDE_RETRY_MAX_SECONDS) from e
+    except BaseException:
+        breaker.release()
+        raise
+    breaker.record_success()
+    return result
+
+
+def metrics() -> dict:
+    return {
+        "breaker": {
+            "state": breaker.state,
+            "consecutive_failures": breaker.consecutive_failures,
+            "retry_after_seconds": round(breaker.retry_after(), 1),
+            "times_opened": breaker.times_opened,
+            "rejected_calls": breaker.rejected,
+        },
+        "rate_limiter": {
+            "requests_per_minute": settings.CLAUDE_REQUESTS_PER_MINUTE,
+            "burst": rate_limiter.capacity,
+            "available": round(max(rate_limiter.available(), 0.0), 1),
+            "throttled_calls": rate_limiter.waits,
+        },
+        **stats,
+    }
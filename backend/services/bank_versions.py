@@ -0,0 +1,78 @@
+"""
+Durable bank versions for compact exam sessions.
+
+A compact session (services/session_store.py) stores bank references plus
+the digest of each bank it was drawn from. Bank files live on each
+container's disk and an edit arrives by redeploy, so the old version has to
+outlive the file: every version the registry loads is written to the
+bank_versions table, and sessions drawn from an old version fetch it back
+from there.
+
+  save()            insert the versions loaded since the last call (at
+                    startup, and before any session that references them
+                    is committed); existing rows are left untouched
+  load(*papers)     fetch the versions these stored papers were drawn from
+                    that are neither live nor already in memory, so
+                    expand_paper() rebuilds them exactly
+"""
+from sqlalchemy import and_, or_
+from sqlalchemy.future import select
+
+from database import AsyncSessionLocal, engine
+from models import BankVersion
+from services.banks import bank_registry
+from services.session_store import StoredPaper, is_compact
+
+
+async def save() -> int:
+    """Persist newly loaded bank versions. Returns the number of versions offered.
+    Raises if the database is unreachable (the versions are kept for the next call)."""
+    unsaved = bank_registry.take_unsaved()
+    if not unsaved:
+        return 0
+
+    if engine.dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    rows = [
+        {"bank_name": bank_name, "digest": digest, "source": source}
+        for (bank_name, digest), source in unsaved.items()
+    ]
+    try:
+        async with AsyncSessionLocal() as db:
+            for row in rows:
+                await db.execute(
+                    insert(BankVersion).values(**row)
+                    .on_conflict_do_nothing(index_elements=[BankVersion.bank_name, BankVersion.digest])
+                )
+            await db.commit()
+    except Exception:
+        bank_registry.keep_unsaved(unsaved)
+        raise
+    return len(rows)
+
+
+async def load(*papers: StoredPaper) -> int:
+    """Fetch the old bank versions the given session papers need. Returns the
+    number of versions fetched."""
+    wanted = set()
+    for paper in papers:
+        if is_compact(paper):
+            for bank_name, digest in (paper.get("banks") or {}).items():
+                if digest and not bank_registry.has_version(bank_name, digest):
+                    wanted.add((bank_name, digest))
+    if not wanted:
+        return 0
+
+    async with AsyncSessionLocal() as db:
+        rows = (await db.execute(
+            select(BankVersion).where(or_(*(
+                and_(BankVersion.bank_name == bank_name, BankVersion.digest == digest)
+                for bank_name, digest in wanted
+            )))
+        )).scalars().all()
+    fetched = sum(1 for row in rows if bank_registry.add_version(row.bank_name, row.digest, row.source))
+    if fetched < len(wanted):
+        print(f"[SESSION] {len(wanted) - fetched} bank version(s) not found in bank_versions")
+    return fetched
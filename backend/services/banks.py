@@ -0,0 +1,402 @@
+"""
+In-memory question bank registry.
+
+Every bank file under data/banks is parsed once (at startup via load_all) and
+served from memory afterwards. Each access does a cheap os.stat() and only
+re-parses the file when its mtime or size changed, so editing a bank on disk
+is picked up without a restart.
+
+Each snapshot also carries pre-filtered views keyed by the items' "type"
+field (woven_test.json mixes image-count and mcq-image items), built once
+per bank version, so sampling and bank-size lookups never rescan the file.
+Every view also gets a BankStrata index — positions grouped by "difficulty"
+and by each "tags" entry — so stratified section draws are set lookups.
+
+Compiled banks
+--------------
+`python3 migrate_banks.py --compile` writes data/banks/compiled/<bank>.bin
+next to each JSON bank. A compiled file is a small header, a fixed-width
+offset table and one compact JSON record per item. When a compiled file
+matches the current JSON source (by content hash), the registry memory-maps
+it instead of parsing the JSON. Only the items actually sampled get decoded,
+and every uvicorn worker shares the same page-cached copy. Stale or missing
+compiled files silently fall back to parsing the JSON.
+
+Bank versions
+-------------
+Compact exam sessions (services/session_store.py) record the digest of each
+bank they were drawn from. Every version the registry loads is queued for
+the bank_versions table (services/bank_versions.py persists it before any
+session referencing it is committed), and get_version() serves that exact
+version back — from the live snapshot, or from a copy fetched from the
+database with add_version() — after the file has been edited or redeployed,
+so a typo fix never changes or loses a question a candidate was already given.
+
+Items are returned as read-only sequences so callers cannot accidentally
+mutate the shared bank. The item dicts themselves must be treated as
+read-only as well — copy any field before modifying it.
+"""
+import hashlib
+import json
+import mmap
+import os
+import struct
+import threading
+from array import array
+from collections.abc import Sequence as SequenceABC
+from dataclasses import dataclass, field
+from typing import Any, Dict, FrozenSet, List, Optional, Sequence, Tuple
+
+BANK_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "data", "banks")
+COMPILED_DIR_NAME = "compiled"
+_MAX_ARCHIVED_SNAPSHOTS = 32   # old bank versions kept parsed in memory
+
+# ── Compiled format ──────────────────────────────────────────────────────────
+# header : magic(8s) source_sha1(20s) record_count(I) meta_len(I)
+# meta   : JSON {"types": [distinct item "type" values],
+#                "labels": [[difficulty, [tags]] per record]}  (meta_len bytes)
+# index  : record_count × (offset Q, length I, type_id H) — offsets are absolute
+# records: compact UTF-8 JSON, one per item, in bank order
+COMPILED_MAGIC = b"AXBANK02"
+_HEADER = struct.Struct("<8s20sII")
+_INDEX_ENTRY = struct.Struct("<QIH")
+_NO_TYPE = 0xFFFF
+
+Label = Tuple[Optional[str], List[str]]   # (difficulty, tags) of one item
+
+
+@dataclass(frozen=True)
+class BankStrata:
+    """Positions within one bank view grouped by difficulty and by tag."""
+    difficulty: Dict[str, FrozenSet[int]] = field(default_factory=dict)
+    tags: Dict[str, FrozenSet[int]] = field(default_factory=dict)
+
+
+@dataclass(frozen=True)
+class BankSnapshot:
+    """One parsed version of a bank file."""
+    name: str
+    mtime_ns: int
+    size: int
+    items: Sequence[Dict[str, Any]]
+    # item "type" value -> items of that type, in bank order
+    views: Dict[str, Sequence[Dict[str, Any]]] = field(default_factory=dict)
+    # view key (None = all items) -> difficulty / tag index over that view
+    strata: Dict[Optional[str], BankStrata] = field(default_factory=dict)
+    digest: str = ""          # sha1 of the JSON source
+    compiled: bool = False    # served from a memory-mapped compiled file
+    # lazily built per-version lookups (e.g. item key -> position)
+    _derived: Dict[Any, Any] = field(default_factory=dict, compare=False, repr=False)
+
+    @property
+    def version(self) -> Tuple[int, int]:
+        return (self.mtime_ns, self.size)
+
+    def view(self, type_filter: Optional[str] = None) -> Sequence[Dict[str, Any]]:
+        """All items, or only those whose "type" field equals type_filter."""
+        if type_filter is None:
+            return self.items
+        return self.views.get(type_filter, ())
+
+    def strata_for(self, type_filter: Optional[str] = None) -> BankStrata:
+        return self.strata.get(type_filter) or BankStrata()
+
+    def find(self, key: str, type_filter: Optional[str] = None) -> Optional[int]:
+        """Position of the item with this item_key() inside view(type_filter).
+        Only needed when a stored reference predates the current bank version,
+        so the key index is built on first use rather than at load time."""
+        cache_key = ("keys", type_filter)
+        index = self._derived.get(cache_key)
+        if index is None:
+            index = {item_key(item): i for i, item in enumerate(self.view(type_filter))}
+            self._derived[cache_key] = index
+        return index.get(key)
+
+
+def item_key(item: Dict[str, Any]) -> str:
+    """Stable identifier of a bank item: a short hash of its content. Bank "id"
+    fields are not used because they are optional and not always unique."""
+    canonical = json.dumps(item, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha1(canonical.encode("utf-8")).hexdigest()[:12]
+
+
+class CompiledItems(SequenceABC):
+    """Lazy, read-only item sequence over a memory-mapped compiled bank.
+
+    Indexing decodes just that one record, so random.sample(items, k) costs
+    k small json.loads calls regardless of bank size.
+    """
+
+    def __init__(self, buf: mmap.mmap, index_offset: int, positions: Optional[array] = None, count: int = 0):
+        self._buf = buf
+        self._index_offset = index_offset
+        self._positions = positions   # None = every record in bank order
+        self._count = len(positions) if positions is not None else count
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(self._count))]
+        if i < 0:
+            i += self._count
+        if not 0 <= i < self._count:
+            raise IndexError("bank item index out of range")
+        record = self._positions[i] if self._positions is not None else i
+        offset, length, _ = _INDEX_ENTRY.unpack_from(self._buf, self._index_offset + record * _INDEX_ENTRY.size)
+        return json.loads(self._buf[offset:offset + length])
+
+
+def _parse_bank(name: str, raw: Any) -> Tuple[Dict[str, Any], ...]:
+    """Handles both flat arrays and nested {questions: [...]} format."""
+    # Nested format: {"set_name": "...", "questions": [...]}
+    if isinstance(raw, dict) and "questions" in raw:
+        return tuple(raw["questions"])
+    # Flat array format: [{...}, {...}]
+    if isinstance(raw, list):
+        return tuple(raw)
+    print(f"Unexpected format in {name}")
+    return ()
+
+
+def _build_views(items: Tuple[Dict[str, Any], ...]) -> Dict[str, Tuple[Dict[str, Any], ...]]:
+    grouped: Dict[str, list] = {}
+    for item in items:
+        item_type = item.get("type")
+        if item_type:
+            grouped.setdefault(item_type, []).append(item)
+    return {item_type: tuple(group) for item_type, group in grouped.items()}
+
+
+def _item_labels(item: Dict[str, Any]) -> Label:
+    return item.get("difficulty"), list(item.get("tags") or [])
+
+
+def _build_strata(labels: Sequence[Label]) -> BankStrata:
+    """Index (difficulty, tags) labels, given in view order, by position."""
+    by_difficulty: Dict[str, set] = {}
+    by_tag: Dict[str, set] = {}
+    for position, (difficulty, tags) in enumerate(labels):
+        if difficulty:
+            by_difficulty.setdefault(difficulty, set()).add(position)
+        for tag in tags:
+            by_tag.setdefault(tag, set()).add(position)
+    return BankStrata(
+        difficulty={k: frozenset(v) for k, v in by_difficulty.items()},
+        tags={k: frozenset(v) for k, v in by_tag.items()},
+    )
+
+
+def compile_bank(json_path: str, out_path: str) -> int:
+    """Compile one JSON bank into the binary offset-indexed format.
+    Returns the number of records written."""
+    with open(json_path, "rb") as f:
+        source = f.read()
+    items = _parse_bank(os.path.basename(json_path), json.loads(source))
+
+    type_names = sorted({item.get("type") for item in items if item.get("type")})
+    type_ids = {t: i for i, t in enumerate(type_names)}
+    meta = json.dumps(
+        {"types": type_names, "labels": [_item_labels(item) for item in items]},
+        ensure_ascii=False, separators=(",", ":"),
+    ).encode("utf-8")
+    records = [json.dumps(item, ensure_ascii=False, separators=(",", ":")).encode("utf-8") for item in items]
+
+    offset = _HEADER.size + len(meta) + _INDEX_ENTRY.size * len(records)
+    index = bytearray()
+    for item, record in zip(items, records):
+        index += _INDEX_ENTRY.pack(offset, len(record), type_ids.get(item.get("type"), _NO_TYPE))
+        offset += len(record)
+
+    os.makedirs(os.path.dirname(out_path), exist_ok=True)
+    tmp_path = out_path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(_HEADER.pack(COMPILED_MAGIC, hashlib.sha1(source).digest(), len(records), len(meta)))
+        f.write(meta)
+        f.write(index)
+        for record in records:
+            f.write(record)
+    os.replace(tmp_path, out_path)   # atomic swap — running workers keep their old mapping
+    return len(records)
+
+
+def _open_compiled(path: str, source_sha1: bytes):
+    """Map a compiled bank. Returns (items, views, strata) or None if missing / stale."""
+    try:
+        with open(path, "rb") as f:
+            buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        return None
+
+    if buf.size() < _HEADER.size:
+        buf.close()
+        return None
+    magic, digest, count, meta_len = _HEADER.unpack_from(buf, 0)
+    if magic != COMPILED_MAGIC or digest != source_sha1:
+        buf.close()
+        return None
+
+    meta = json.loads(buf[_HEADER.size:_HEADER.size + meta_len])
+    type_names, labels = meta["types"], meta["labels"]
+    index_offset = _HEADER.size + meta_len
+
+    positions: Dict[int, array] = {}
+    for i in range(count):
+        _, _, type_id = _INDEX_ENTRY.unpack_from(buf, index_offset + i * _INDEX_ENTRY.size)
+        if type_id != _NO_TYPE:
+            positions.setdefault(type_id, array("I")).append(i)
+
+    items = CompiledItems(buf, index_offset, count=count)
+    views = {type_names[t]: CompiledItems(buf, index_offset, positions=p) for t, p in positions.items()}
+    strata = {None: _build_strata(labels)}
+    for t, p in positions.items():
+        strata[type_names[t]] = _build_strata([labels[i] for i in p])
+    return items, views, strata
+
+
+class BankRegistry:
+    """Process-wide cache of parsed bank files keyed by file name."""
+
+    def __init__(self, bank_dir: str = BANK_DIR):
+        self.bank_dir = bank_dir
+        self.compiled_dir = os.path.join(bank_dir, COMPILED_DIR_NAME)
+        self._snapshots: Dict[str, BankSnapshot] = {}
+        self._archived: Dict[Tuple[str, str], BankSnapshot] = {}
+        self._unsaved: Dict[Tuple[str, str], bytes] = {}   # loaded versions not yet in bank_versions
+        self.generation = 0   # bumped on every (re)load — caches derived from all banks key on it
+        self._lock = threading.Lock()
+
+    def load_all(self) -> int:
+        """Parse every *.json bank up front. Returns the number of banks loaded."""
+        if not os.path.isdir(self.bank_dir):
+            print(f"Bank directory not found: {self.bank_dir}")
+            return 0
+        loaded = 0
+        for filename in sorted(os.listdir(self.bank_dir)):
+            if filename.endswith(".json") and self.get(filename) is not None:
+                loaded += 1
+        return loaded
+
+    def compiled_path(self, bank_name: str) -> str:
+        return os.path.join(self.compiled_dir, os.path.splitext(bank_name)[0] + ".bin")
+
+    def has_version(self, bank_name: str, digest: str) -> bool:
+        """Whether get_version() can serve this version without a database fetch."""
+        snapshot = self.get(bank_name)
+        return bool(snapshot and snapshot.digest == digest) or (bank_name, digest) in self._archived
+
+    def get_version(self, bank_name: str, digest: Optional[str]) -> Optional[BankSnapshot]:
+        """The bank exactly as it was at `digest` — the live snapshot if it still
+        matches, otherwise a copy added with add_version(). None if neither."""
+        if not digest:
+            return None
+        snapshot = self.get(bank_name)
+        if snapshot and snapshot.digest == digest:
+            return snapshot
+        return self._archived.get((bank_name, digest))
+
+    def add_version(self, bank_name: str, digest: str, source: bytes) -> Optional[BankSnapshot]:
+        """Parse an old version of a bank (from bank_versions) and keep it in memory."""
+        if hashlib.sha1(source).hexdigest() != digest:
+            print(f"Stored bank {bank_name} version {digest[:12]} is corrupt")
+            return None
+        try:
+            items = _parse_bank(bank_name, json.loads(source))
+        except Exception as e:
+            print(f"Error loading bank {bank_name} version {digest[:12]}: {e}")
+            return None
+        archived = BankSnapshot(name=bank_name, mtime_ns=0, size=len(source), items=items,
+                                views=_build_views(items), digest=digest)
+        with self._lock:
+            if len(self._archived) >= _MAX_ARCHIVED_SNAPSHOTS:
+                self._archived.pop(next(iter(self._archived)))
+            self._archived[(bank_name, digest)] = archived
+        return archived
+
+    def take_unsaved(self) -> Dict[Tuple[str, str], bytes]:
+        """{(bank, digest): source} of the versions loaded since the last call."""
+        with self._lock:
+            unsaved, self._unsaved = self._unsaved, {}
+        return unsaved
+
+    def keep_unsaved(self, versions: Dict[Tuple[str, str], bytes]):
+        """Put versions back after a failed save."""
+        with self._lock:
+            for key, source in versions.items():
+                self._unsaved.setdefault(key, source)
+
+    def get(self, bank_name: str) -> Optional[BankSnapshot]:
+        """Returns the current snapshot, reloading only if the file changed on disk."""
+        file_path = os.path.join(self.bank_dir, bank_name)
+        try:
+            st = os.stat(file_path)
+        except OSError:
+            print(f"Bank not found: {file_path}")
+            return None
+
+        snapshot = self._snapshots.get(bank_name)
+        if snapshot and snapshot.version == (st.st_mtime_ns, st.st_size):
+            return snapshot
+
+        with self._lock:
+            # Another thread may have reloaded while we waited for the lock
+            snapshot = self._snapshots.get(bank_name)
+            if snapshot and snapshot.version == (st.st_mtime_ns, st.st_size):
+                return snapshot
+            try:
+                with open(file_path, "rb") as f:
+                    source = f.read()
+                source_sha1 = hashlib.sha1(source).digest()
+
+                compiled = _open_compiled(self.compiled_path(bank_name), source_sha1)
+                if compiled:
+                    items, views, strata = compiled
+                else:
+                    items = _parse_bank(bank_name, json.loads(source))
+                    views = _build_views(items)
+                    strata = {None: _build_strata([_item_labels(item) for item in items])}
+                    for item_type, view in views.items():
+                        strata[item_type] = _build_strata([_item_labels(item) for item in view])
+            except Exception as e:
+                print(f"Error loading bank {bank_name}: {e}")
+                # Keep serving the last good version rather than an empty bank
+                return snapshot
+            snapshot = BankSnapshot(
+                name=bank_name,
+                mtime_ns=st.st_mtime_ns,
+                size=st.st_size,
+                items=items,
+                views=views,
+                strata=strata,
+                digest=source_sha1.hex(),
+                compiled=compiled is not None,
+            )
+            self._snapshots[bank_name] = snapshot
+            self.generation += 1
+            self._unsaved[(bank_name, snapshot.digest)] = source
+            return snapshot
+
+    def snapshots(self) -> List[BankSnapshot]:
+        """Every bank loaded so far, as last seen — no file system access."""
+        return list(self._snapshots.values())
+
+    def items(self, bank_name: str, type_filter: Optional[str] = None) -> Sequence[Dict[str, Any]]:
+        snapshot = self.get(bank_name)
+        return snapshot.view(type_filter) if snapshot else ()
+
+    def count(self, bank_name: str, type_filter: Optional[str] = None) -> int:
+        return len(self.items(bank_name, type_filter))
+
+    def compile_all(self) -> Dict[str, int]:
+        """Compile every JSON bank into compiled/<bank>.bin. Returns {bank: records}."""
+        written = {}
+        for filename in sorted(os.listdir(self.bank_dir)):
+            if filename.endswith(".json"):
+                written[filename] = compile_bank(
+                    os.path.join(self.bank_dir, filename), self.compiled_path(filename)
+                )
+        return written
+
+
+bank_registry = BankRegistry()
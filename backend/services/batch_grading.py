@@ -0,0 +1,139 @@
+"""
+Batch grading backends for bulk re-evaluation.
+
+A provider takes {custom_id: (prompt, template)}, returns a batch id, and later yields
+(custom_id, validated grading or None) once the batch has ended. custom_ids
+are response-cache keys (sha256 hex, 64 chars), so results can be written
+straight into the cache.
+
+  anthropic — Message Batches API (half price, results within 24 h). Batch
+              ids survive a restart, so a resumed run keeps polling them.
+              Replies that break the grade schema come back as None and
+              are graded live (with a repair turn) during write-back.
+              Needs AI_PROVIDER=anthropic.
+  local     — runs the prompts through the normal Claude call path right
+              away. For development, tests and load tests (with AI_PROVIDER=stub);
+              batches live in memory, so after a restart the prompts are
+              simply planned and submitted again.
+
+Chosen with REEVAL_BATCH_PROVIDER.
+"""
+import asyncio
+import uuid
+from typing import AsyncIterator, Dict, Optional, Tuple
+
+from pydantic import ValidationError
+
+from config import settings
+from services import ai_engine
+from services.ai_engine import PlannedRequest
+from services.ai_resilience import AIUnavailableError
+from services.prompts import PROMPTS
+
+BatchResult = Tuple[str, Optional[dict]]   # (custom_id, validated grading or None on failure)
+
+
+class BatchProvider:
+    name = "base"
+
+    async def submit(self, requests: Dict[str, PlannedRequest]) -> str:
+        raise NotImplementedError
+
+    async def is_done(self, batch_id: str) -> bool:
+        raise NotImplementedError
+
+    def results(self, batch_id: str) -> AsyncIterator[BatchResult]:
+        raise NotImplementedError
+
+
+def _validated(message, template_name: Optional[str]) -> Optional[dict]:
+    """The submit_grade input of a batch reply, validated against its template's
+    output model. After a restart the template of a custom_id is unknown, so a
+    reply is accepted under any grading template whose schema it satisfies."""
+    tool_use = ai_engine.grade_tool_use(message)
+    if tool_use is None:
+        return None
+    candidates = [PROMPTS[template_name]] if template_name in PROMPTS else list(PROMPTS.values())
+    for template in candidates:
+        try:
+            return template.validate(tool_use.input)
+        except ValidationError:
+            continue
+    return None
+
+
+class AnthropicBatchProvider(BatchProvider):
+    name = "anthropic"
+
+    def __init__(self):
+        self._templates: Dict[str, Dict[str, str]] = {}
+
+    async def submit(self, requests: Dict[str, PlannedRequest]) -> str:
+        batch = await ai_engine.anthropic_client().messages.batches.create(requests=[
+            {"custom_id": custom_id, "params": ai_engine.grader_request_params(prompt, template)}
+            for custom_id, (prompt, template) in requests.items()
+        ])
+        # The results only carry custom_ids — keep the template names to validate against
+        self._templates[batch.id] = {custom_id: template.name for custom_id, (_, template) in requests.items()}
+        return batch.id
+
+    async def is_done(self, batch_id: str) -> bool:
+        batch = await ai_engine.anthropic_client().messages.batches.retrieve(batch_id)
+        return batch.processing_status == "ended"
+
+    async def results(self, batch_id: str) -> AsyncIterator[BatchResult]:
+        templates = self._templates.pop(batch_id, {})
+        async for entry in await ai_engine.anthropic_client().messages.batches.results(batch_id):
+            if entry.result.type != "succeeded":
+                # errored / canceled / expired — graded live during write-back
+                yield entry.custom_id, None
+                continue
+            yield entry.custom_id, _validated(entry.result.message, templates.get(entry.custom_id))
+
+
+class LocalBatchProvider(BatchProvider):
+    name = "local"
+
+    def __init__(self):
+        self._batches: Dict[str, Dict[str, PlannedRequest]] = {}
+
+    async def submit(self, requests: Dict[str, PlannedRequest]) -> str:
+        batch_id = f"local_{uuid.uuid4().hex}"
+        self._batches[batch_id] = dict(requests)
+        return batch_id
+
+    async def is_done(self, batch_id: str) -> bool:
+        return True
+
+    @staticmethod
+    async def _grade(prompt: str, template) -> Optional[dict]:
+        try:
+            return await ai_engine._call_grader(prompt, template)
+        except AIUnavailableError as e:
+            # Like an errored batch entry: graded live during write-back
+            print(f"[REEVAL] Local batch item not graded: {e}")
+            return None
+
+    async def results(self, batch_id: str) -> AsyncIterator[BatchResult]:
+        requests = self._batches.pop(batch_id, {})   # unknown after a restart: nothing to yield
+        custom_ids = list(requests)
+        # _call_grader bounds concurrency itself (CLAUDE_MAX_CONCURRENCY)
+        for start in range(0, len(custom_ids), 100):
+            chunk = custom_ids[start:start + 100]
+            replies = await asyncio.gather(*(self._grade(*requests[c]) for c in chunk))
+            for custom_id, reply in zip(chunk, replies):
+                yield custom_id, reply
+
+
+_PROVIDERS = {"anthropic": AnthropicBatchProvider, "local": LocalBatchProvider}
+_providers: Dict[str, BatchProvider] = {}
+
+
+def get_batch_provider(name: Optional[str] = None) -> BatchProvider:
+    """The provider called `name` (default REEVAL_BATCH_PROVIDER) — one instance per process."""
+    name = name or settings.REEVAL_BATCH_PROVIDER
+    if name not in _PROVIDERS:
+        raise ValueError(f"Unknown batch provider '{name}' (expected one of {sorted(_PROVIDERS)})")
+    if name not in _providers:
+        _providers[name] = _PROVIDERS[name]()
+    return _providers[name]
@@ -0,0 +1,119 @@
+"""
+Copy detection for reading summaries.
+
+A summary is compared with its passage through word shingles — runs of
+COPY_SHINGLE_WORDS consecutive words. The passage's shingle set is built
+once per bank version for every reading passage (warm() at startup, rebuilt
+when a bank file changes); a summary then costs one pass over its own words:
+
+  containment            share of the summary's shingles that occur in the
+                         passage — high when it is mostly lifted text
+  per-sentence scores    the same, sentence by sentence, so a summary
+                         stitched together from copied sentences shows up
+                         even when a few linking words of its own lower the
+                         overall figure
+
+check() says a summary is copied when its overall containment reaches
+COPY_MAX_CONTAINMENT, or when at least COPY_MAX_COPIED_SENTENCES of its
+sentences, and no fewer than COPY_MIN_COPIED_SENTENCES, reach
+COPY_SENTENCE_CONTAINMENT — one quoted sentence in a short summary is not
+enough on its own. grade_reading_question rejects
+copied summaries before spending a Claude call on them.
+"""
+import re
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Dict, FrozenSet, List, Tuple
+
+from config import settings
+from services.banks import bank_registry
+from services.similarity import tokens
+
+Shingle = Tuple[str, ...]
+
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+|\n+")
+
+# (bank digests, shingle size, {passage: shingles})
+_passages: Tuple[Tuple[str, ...], int, Dict[str, FrozenSet[Shingle]]] = ((), 0, {})
+
+
+@dataclass
+class CopyReport:
+    containment: float = 0.0                       # share of all summary shingles found in the passage
+    sentences: List[float] = field(default_factory=list)   # containment of each scored sentence
+    copied_sentences: int = 0
+    copied: bool = False
+
+
+def shingles(words: List[str], size: int) -> List[Shingle]:
+    return [tuple(words[i:i + size]) for i in range(len(words) - size + 1)]
+
+
+def _passage_shingles(passage: str, size: int) -> FrozenSet[Shingle]:
+    return frozenset(shingles(tokens(passage), size))
+
+
+@lru_cache(maxsize=256)
+def _uncached_passage(passage: str, size: int) -> FrozenSet[Shingle]:
+    """Shingles of a passage that is not in the current banks (e.g. a paper
+    generated from an older bank version)."""
+    return _passage_shingles(passage, size)
+
+
+def _index() -> Dict[str, FrozenSet[Shingle]]:
+    """{passage: shingles} for the current reading banks, rebuilt when one changes."""
+    global _passages
+    from services.sections import SECTION_TYPES   # sections imports grading, which imports us
+
+    size = settings.COPY_SHINGLE_WORDS
+    specs = [spec for spec in SECTION_TYPES.values() if spec.ai_graded]
+    snapshots = [(spec, bank_registry.get(spec.bank_file)) for spec in specs]
+    digests = tuple(snapshot.digest if snapshot else "" for _, snapshot in snapshots)
+    if (digests, size) != _passages[:2]:
+        index = {}
+        for spec, snapshot in snapshots:
+            for item in (snapshot.view(spec.type_filter) if snapshot else ()):
+                passage = (spec.transform(item, spec.name, 0).get("content") or {}).get("passage")
+                if isinstance(passage, str) and passage.strip() and passage not in index:
+                    index[passage] = _passage_shingles(passage, size)
+        _passages = (digests, size, index)
+    return _passages[2]
+
+
+def warm() -> int:
+    """Build the passage shingles now (startup). Returns the number of passages."""
+    return len(_index())
+
+
+def passage_shingles(passage: str) -> FrozenSet[Shingle]:
+    precomputed = _index().get(passage)
+    return precomputed if precomputed is not None else _uncached_passage(passage, settings.COPY_SHINGLE_WORDS)
+
+
+def check(summary: str, passage: str) -> CopyReport:
+    """How much of the summary is lifted from the passage, overall and per sentence."""
+    report = CopyReport()
+    if not summary or not passage:
+        return report
+    size = settings.COPY_SHINGLE_WORDS
+    source = passage_shingles(passage)
+    found = total = 0
+    for sentence in _SENTENCE_END.split(summary):
+        sentence_shingles = shingles(tokens(sentence), size)
+        if not sentence_shingles:
+            continue   # shorter than one shingle: too little to judge
+        hits = sum(1 for s in sentence_shingles if s in source)
+        found += hits
+        total += len(sentence_shingles)
+        containment = hits / len(sentence_shingles)
+        report.sentences.append(round(containment, 3))
+        if containment >= settings.COPY_SENTENCE_CONTAINMENT:
+            report.copied_sentences += 1
+    if total:
+        report.containment = found / total
+        report.copied = (
+            report.containment >= settings.COPY_MAX_CONTAINMENT
+            or (report.copied_sentences >= settings.COPY_MIN_COPIED_SENTENCES
+                and report.copied_sentences / len(report.sentences) >= settings.COPY_MAX_COPIED_SENTENCES)
+        )
+    return report
@@ -0,0 +1,236 @@
+"""
+Exposure-balanced item sampling.
+
+Uniform random.sample over small banks (e.g. mcq_number_series.json) lets
+some items be served far more often than others. The tracker keeps a serve
+count per (section type, item_key) and, for every section, a min-heap of
+(serve_count, random tiebreak, bank position). Picking `count` items pops the
+`count` least-exposed entries and pushes them back with the incremented
+count, so a paper costs O(count log n) no matter how large the bank is.
+Stratified sections (difficulty / tag quotas) pick the least-served items of
+a stratum with pick_from(); cohort provisioning deals all its papers from
+exposure-ordered decks with deal().
+
+Counts are loaded from the item_exposure table at startup. New serves are
+accumulated in memory and written back as additive upserts every
+EXPOSURE_FLUSH_SECONDS by a task started in the FastAPI lifespan, so several
+workers can share the table. Each flush then reloads the table, so every
+process balances on the serves of all processes, at most one flush
+interval old (its own unflushed serves are added back on top). Pre-generated pool papers are picked inside
+deferred(): their items count towards balancing right away (so consecutive
+pool papers differ), but they are only written to the table when the paper
+is handed out (confirm) — a paper the pool discards gives them back (release).
+"""
+import asyncio
+import contextvars
+import heapq
+import random
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import AbstractSet, Any, Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from sqlalchemy.future import select
+
+from config import settings
+from database import AsyncSessionLocal, engine
+from models import ItemExposure
+from services.banks import item_key
+
+ExposureKey = Tuple[str, str]   # (section_type, item_key)
+
+# Serves picked inside ExposureTracker.deferred() are collected here instead of queued for the table
+_deferred: contextvars.ContextVar[Optional[List[ExposureKey]]] = contextvars.ContextVar("exposure_deferred", default=None)
+
+
+class _SectionHeap:
+    def __init__(self, digest: str, keys: List[str], served: List[int]):
+        self.digest = digest
+        self.keys = keys       # bank position -> item_key
+        self.served = served   # bank position -> current serve count
+        # (serve_count, tiebreak, bank position); an entry whose count no longer
+        # matches served[position] is stale and skipped when popped
+        self.heap = [(count, random.random(), position) for position, count in enumerate(served)]
+        heapq.heapify(self.heap)
+
+
+class ExposureTracker:
+    def __init__(self):
+        self._counts: Dict[ExposureKey, int] = defaultdict(int)
+        self._pending: Dict[ExposureKey, int] = defaultdict(int)
+        self._reserved: Dict[ExposureKey, int] = defaultdict(int)   # deferred serves not yet confirmed
+        self._heaps: Dict[str, _SectionHeap] = {}
+        # generate_papers runs in a worker thread during cohort provisioning
+        self._lock = threading.Lock()
+
+    def _section(self, section_type: str, digest: str, items: Sequence[Dict[str, Any]]) -> _SectionHeap:
+        section = self._heaps.get(section_type)
+        if section is None or section.digest != digest or len(section.heap) > 2 * len(section.keys) + 64:
+            # First use, bank reloaded (positions changed) or too many stale entries
+            keys = [item_key(item) for item in items]
+            section = _SectionHeap(digest, keys, [self._counts[(section_type, key)] for key in keys])
+            self._heaps[section_type] = section
+        return section
+
+    def _serve(self, section_type: str, section: _SectionHeap, position: int):
+        key = (section_type, section.keys[position])
+        self._counts[key] += 1
+        deferred = _deferred.get()
+        if deferred is None:
+            self._pending[key] += 1
+        else:
+            self._reserved[key] += 1
+            deferred.append(key)
+        section.served[position] = self._counts[key]
+        heapq.heappush(section.heap, (self._counts[key], random.random(), position))
+
+    @contextmanager
+    def deferred(self) -> Iterator[List[ExposureKey]]:
+        """Collect the serves picked inside the block (a pool paper) instead of
+        queueing them for item_exposure; pass the list to confirm() or release()."""
+        served: List[ExposureKey] = []
+        token = _deferred.set(served)
+        try:
+            yield served
+        finally:
+            _deferred.reset(token)
+
+    def confirm(self, served: Iterable[ExposureKey]):
+        """The deferred paper was handed out: queue its serves for the table."""
+        with self._lock:
+            for key in served:
+                self._reserved[key] -= 1
+                self._pending[key] += 1
+
+    def release(self, served: Iterable[ExposureKey]):
+        """The deferred paper was discarded: take its serves back."""
+        with self._lock:
+            for section_type, key in served:
+                self._reserved[(section_type, key)] -= 1
+                if self._counts[(section_type, key)] <= 0:
+                    continue
+                self._counts[(section_type, key)] -= 1
+                section = self._heaps.get(section_type)
+                if section is None:
+                    continue
+                for position, item in enumerate(section.keys):
+                    if item == key:
+                        section.served[position] = self._counts[(section_type, key)]
+                        heapq.heappush(section.heap, (section.served[position], random.random(), position))
+
+    def pick(self, section_type: str, digest: str, items: Sequence[Dict[str, Any]], count: int,
+             exclude: AbstractSet[int] = frozenset()) -> List[int]:
+        """Positions of the `count` least-served items of this section's bank
+        view (ties broken randomly), skipping `exclude`, recording them as served."""
+        with self._lock:
+            section = self._section(section_type, digest, items)
+            positions, skipped = [], []
+            while len(positions) < count and section.heap:
+                entry = heapq.heappop(section.heap)
+                served, _, position = entry
+                if served != section.served[position] or position in positions:
+                    continue   # stale, or a duplicate entry left by release()
+                if position in exclude:
+                    skipped.append(entry)
+                    continue
+                positions.append(position)
+            for entry in skipped:
+                heapq.heappush(section.heap, entry)
+            for position in positions:
+                self._serve(section_type, section, position)
+            return positions
+
+    def pick_from(self, section_type: str, digest: str, items: Sequence[Dict[str, Any]],
+                  candidates: AbstractSet[int], count: int) -> List[int]:
+        """Like pick(), restricted to `candidates` (a stratum of the view).
+        Costs O(len(candidates) log count)."""
+        with self._lock:
+            section = self._section(section_type, digest, items)
+            positions = heapq.nsmallest(count, candidates, key=lambda p: (section.served[p], random.random()))
+            for position in positions:
+                self._serve(section_type, section, position)
+            return positions
+
+    def deal(self, section_type: str, digest: str, items: Sequence[Dict[str, Any]],
+             dealer: Callable[[List[int]], List[List[int]]]) -> List[List[int]]:
+        """Hands for a whole cohort (provisioning): dealer() gets a copy of the
+        serve count per bank position and returns the hands, which are then
+        recorded as served in one go."""
+        with self._lock:
+            section = self._section(section_type, digest, items)
+            hands = dealer(list(section.served))
+            for hand in hands:
+                for position in hand:
+                    self._serve(section_type, section, position)
+            return hands
+
+    async def load(self):
+        """Set in-memory counts to the item_exposure table (which has every
+        process's flushed serves) plus this process's unflushed and reserved ones."""
+        async with AsyncSessionLocal() as db:
+            rows = (await db.execute(select(ItemExposure))).scalars().all()
+        with self._lock:
+            counts = defaultdict(int)
+            for row in rows:
+                counts[(row.section_type, row.item_key)] = row.serve_count
+            for local in (self._pending, self._reserved):
+                for key, count in local.items():
+                    counts[key] += count
+            self._counts = counts
+            self._heaps.clear()   # rebuilt from the new counts on next use
+        return len(rows)
+
+    async def flush(self):
+        """Write accumulated serves to item_exposure as additive upserts, then
+        reload the table to pick up the other processes' serves."""
+        written = await self._write_pending()
+        try:
+            await self.load()
+        except Exception as e:
+            print(f"[EXPOSURE] Reload failed: {e}")
+        return written
+
+    async def _write_pending(self) -> int:
+        with self._lock:
+            pending, self._pending = self._pending, defaultdict(int)
+        if not pending:
+            return 0
+
+        if engine.dialect.name == "postgresql":
+            from sqlalchemy.dialects.postgresql import insert
+        else:
+            from sqlalchemy.dialects.sqlite import insert
+        rows = [
+            {"section_type": section_type, "item_key": key, "serve_count": count}
+            for (section_type, key), count in pending.items()
+        ]
+        try:
+            async with AsyncSessionLocal() as db:
+                for start in range(0, len(rows), 500):
+                    stmt = insert(ItemExposure).values(rows[start:start + 500])
+                    stmt = stmt.on_conflict_do_update(
+                        index_elements=[ItemExposure.section_type, ItemExposure.item_key],
+                        set_={"serve_count": ItemExposure.serve_count + stmt.excluded.serve_count},
+                    )
+                    await db.execute(stmt)
+                await db.commit()
+        except Exception as e:
+            print(f"[EXPOSURE] Flush failed, will retry: {e}")
+            with self._lock:
+                for key, count in pending.items():
+                    self._pending[key] += count
+            return 0
+        return len(pending)
+
+    async def run(self):
+        """Periodic flusher — started from the FastAPI lifespan."""
+        try:
+            while True:
+                await asyncio.sleep(settings.EXPOSURE_FLUSH_SECONDS)
+                await self.flush()
+        finally:
+            # Shutdown: persist whatever was served since the last flush
+            await self.flush()
+
+
+exposure_tracker = ExposureTracker()
@@ -1,308 +1,259 @@
-import json
 import random
-import os
-from typing import List, Dict, Any, Optional
+from typing import AbstractSet, List, Dict, Any, Optional, Sequence, Set
 from config import settings
+from services.banks import BANK_DIR, bank_registry, item_key
+from services.sections import get_section
+from services.exposure import exposure_tracker
 
 class QuestionBankService:
-    BANK_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "data", "banks")
+    BANK_DIR = BANK_DIR
 
     @staticmethod
-    def load_bank(bank_name: str) -> List[Dict[str, Any]]:
-        """Loads a JSON bank file by name (e.g., 'jumble.json').
-        Handles both flat arrays and nested {questions: [...]} format.
+    def load_bank(bank_name: str) -> Sequence[Dict[str, Any]]:
+        """Returns the parsed items of a bank file by name (e.g., 'jumble.json').
+        Served from the in-memory bank registry; the file is only re-read when
+        it changes on disk. The returned items are shared — do not mutate them.
         """
-        file_path = os.path.join(QuestionBankService.BANK_DIR, bank_name)
-        if not os.path.exists(file_path):
-            print(f"Bank not found: {file_path}")
-            return []
-        
-        try:
-            with open(file_path, "r", encoding="utf-8") as f:
-                data = json.load(f)
-                
-            # Handle nested format: {"set_name": "...", "questions": [...]}
-            if isinstance(data, dict) and "questions" in data:
-                return data["questions"]
-            # Handle flat array format: [{...}, {...}]
-            elif isinstance(data, list):
-                return data
-            else:
-                print(f"Unexpected format in {bank_name}")
-                return []
-        except Exception as e:
-            print(f"Error loading bank {bank_name}: {e}")
-            return []
+        return bank_registry.items(bank_name)
 
     @staticmethod
     def generate_questions(
         section_type: str, 
         count: int, 
-        marks_per_question: int
+        marks_per_question: int,
+        difficulty: Optional[Dict[str, int]] = None,
+        tags: Optional[List[str]] = None
     ) -> List[Dict[str, Any]]:
         """
         Selects 'count' random questions from the specified section's bank.
         Applies 'marks_per_question' to each.
+        Optional strata: difficulty={"easy": 3, "hard": 2} draws that many items
+        of each level, tags=["counting", ...] guarantees one item per tag.
         """
-        bank_map = {
-            "video": "video.json",
-            "video-robot": "video_robot.json",
-            "image": "image.json",
-            "image-count": "woven_test.json",      # counting questions from woven bank
-            "mcq-image": "woven_test.json",         # image MCQ questions from woven bank
-            "mcq-annotation": "woven2_test.json",     # annotation guideline MCQ (woven2)
-            "reading": "reading.json",
-            "jumble": "jumble.json",
-            "mcq-grammar": "mcq_grammar.json",
-            "mcq-context": "mcq_context.json",
-            "mcq-reading": "mcq_reading.json",
-            "mcq-logical": "mcq_logical.json",
-            "mcq-number-series": "mcq_number_series.json",
-            "mcq-blood-relations": "mcq_blood_relations.json",
-            "mcq-odd-one-out": "mcq_odd_one_out.json",
-            "typing": "typing.json",
-            "typing-easy": "typing_easy.json",
-            "typing-advanced": "typing_advanced.json",
-        }
+        spec = get_section(section_type)
+        if not spec:
+            return []
 
-        filename = bank_map.get(section_type)
-        if not filename:
+        # Load bank data — shared woven banks use the pre-filtered per-type view
+        snapshot = bank_registry.get(spec.bank_file)
+        if not snapshot:
             return []
+        all_items = snapshot.view(spec.type_filter)
 
-        # Load bank data
-        all_items = QuestionBankService.load_bank(filename)
+        # Selection (positions within the view, so sessions can store references)
+        positions = QuestionBankService._select_positions(
+            section_type, snapshot, spec.type_filter, count, difficulty, tags
+        )
 
-        # For woven banks: filter by the 'type' field
-        if section_type in ('image-count', 'mcq-image'):
-            all_items = [q for q in all_items if q.get('type') == section_type]
-        elif section_type == 'mcq-annotation':
-            # woven2_test.json items are all mcq-image type; no filter needed
-            pass
+        return [
+            QuestionBankService._build_question(spec, section_type, all_items, position, marks_per_question)
+            for position in positions
+        ]
 
-        # Random Selection
-        # If requested count > available, take all available (or duplicate if really needed? No, let's max out at available)
-        selected_items = []
-        if count >= len(all_items):
-            selected_items = all_items
-        else:
-            selected_items = random.sample(all_items, count)
+    @staticmethod
+    def _draw(section_type: str, snapshot, view: Sequence[Dict[str, Any]], k: int,
+              taken: Set[int], candidates: Optional[AbstractSet[int]] = None) -> List[int]:
+        """Up to k positions not in 'taken', from 'candidates' (a stratum) or the whole view."""
+        if k <= 0:
+            return []
+        if candidates is not None:
+            pool = candidates - taken
+            if settings.EXPOSURE_BALANCED_SAMPLING:
+                return exposure_tracker.pick_from(section_type, snapshot.digest, view, pool, k)
+            return random.sample(sorted(pool), min(k, len(pool)))
+        if settings.EXPOSURE_BALANCED_SAMPLING:
+            # Least-served items first, random among ties
+            return exposure_tracker.pick(section_type, snapshot.digest, view, k, exclude=taken)
+        drawn = random.sample(range(len(view)), min(len(view), k + len(taken)))
+        return [p for p in drawn if p not in taken][:k]
 
-        # Transform to internal Question Question schema structure
-        generated_questions = []
-        
-        for item in selected_items:
-            q_structure = {
-                "question_type": section_type,
-                "marks": marks_per_question,
-                "content": {},
-                "grading_config": {}
-            }
-            
-            # Map specific bank fields to standard JSONB columns
-            
-            # 1. Video (both legacy and robot episode types)
-            if section_type in ("video", "video-robot"):
-                q_structure["content"] = {
-                    "url": item.get("video_url"),
-                    "title": item.get("title") or item.get("prompt", "Video description task")
-                }
-                q_structure["grading_config"] = {
-                    "reference": item.get("reference_context") or item.get("correct_answer", ""),
-                    "key_ideas": item.get("key_ideas") or list(item.get("key_elements", {}).values()) or [],
-                    "alternative_answers": item.get("alternative_answers", []),
-                    "acceptable_synonyms": item.get("acceptable_synonyms", {}),
-                    "marks_distribution": item.get("marks_distribution", {})
-                }
-                
-            # 2. Image (AI-description)
-            elif section_type == "image":
-                q_structure["content"] = {
-                    "url": item.get("image_url") or item.get("video_url"),  # Fallback in case of wrong field
-                    "title": item.get("title") or item.get("prompt", "Image description task")  # Fallback to prompt
-                }
-                q_structure["grading_config"] = {
-                    "reference": item.get("reference_context") or item.get("correct_answer", ""),  # Fallback to correct_answer
-                    "key_ideas": item.get("key_ideas") or list(item.get("key_elements", {}).values()) or []
-                }
+    @staticmethod
+    def _select_positions(
+        section_type: str,
+        snapshot,
+        type_filter: Optional[str],
+        count: int,
+        difficulty: Optional[Dict[str, int]] = None,
+        tags: Optional[List[str]] = None
+    ) -> List[int]:
+        """
+        Picks 'count' distinct positions in the section's bank view.
+        Strata come from the snapshot's difficulty/tag index, so every stratum
+        draw is a set lookup: first one item per requested tag (preferring
+        difficulty levels that still have quota), then the difficulty quotas,
+        then the remainder from the whole bank.
+        """
+        view = snapshot.view(type_filter)
+        # If requested count > available, take all available
+        if count >= len(view):
+            return list(range(len(view)))
 
-            # 2b. Image-Count (type a number, exact match grading)
-            elif section_type == "image-count":
-                q_structure["content"] = {
-                    "url": item.get("image_url"),
-                    "title": item.get("title"),
-                    "question": item.get("title"),
-                }
-                q_structure["grading_config"] = {
-                    "correct_answer": item.get("correct_answer"),
-                    "tolerance": item.get("tolerance", 0)
-                }
+        strata = snapshot.strata_for(type_filter)
+        quotas = {level: n for level, n in (difficulty or {}).items() if n > 0}
+        chosen: List[int] = []
+        taken: Set[int] = set()
 
-            # 2c. MCQ-Image (image shown + shuffled MCQ options)
-            elif section_type in ("mcq-image", "mcq-annotation"):
-                # Handle mcq-multi-image items that end up in this section
-                if item.get("type") == "mcq-multi-image":
-                    # Shuffle options once for the whole question
-                    original_options = item.get("options", {})
-                    option_keys  = sorted(original_options.keys())
-                    option_texts = [original_options[k] for k in option_keys]
-                    random.shuffle(option_texts)
-                    new_options = {k: option_texts[i] for i, k in enumerate(option_keys)}
-                    text_to_key = {v: k for k, v in new_options.items()}
+        def take(positions):
+            chosen.extend(positions)
+            taken.update(positions)
+            for position in positions:
+                for level in quotas:
+                    if position in strata.difficulty.get(level, ()):
+                        quotas[level] -= 1
+                        break
 
-                    # Remap each sub-image's correct answer to shuffled positions
-                    sub_images = []
-                    for sub in item.get("sub_images", []):
-                        orig_correct_text = original_options.get(sub["correct_answer"], "")
-                        new_correct = text_to_key.get(orig_correct_text, sub["correct_answer"])
-                        sub_images.append({
-                            "url": sub["url"],
-                            "correct_answer": new_correct,
-                            "correct_answer_text": orig_correct_text
-                        })
+        for tag in tags or []:
+            tagged = strata.tags.get(tag, frozenset())
+            if len(chosen) >= count or tagged & taken:
+                continue
+            preferred = tagged & frozenset().union(
+                *(strata.difficulty.get(level, frozenset()) for level, n in quotas.items() if n > 0)
+            )
+            take(QuestionBankService._draw(section_type, snapshot, view, 1, taken, (preferred - taken) or tagged))
 
-                    q_structure["question_type"] = "mcq-multi-image"
-                    q_structure["marks"] = marks_per_question * len(sub_images)
-                    q_structure["content"] = {
-                        "guideline": item.get("guideline"),
-                        "scenario" : item.get("scenario"),
-                        "question" : item.get("title"),
-                        "note"     : item.get("note"),
-                        "options"  : new_options,
-                        "sub_images": sub_images
-                    }
-                    q_structure["grading_config"] = {
-                        "sub_images": sub_images,   # each has correct_answer
-                        "marks_per_image": marks_per_question
-                    }
-                else:
-                    original_options = item.get("options", {})
-                    original_correct  = item.get("correct_answer", "")
-                    correct_text = original_options.get(original_correct, "")
+        for level in list(quotas):
+            wanted = min(quotas[level], count - len(chosen))
+            take(QuestionBankService._draw(section_type, snapshot, view, wanted, taken, strata.difficulty.get(level, frozenset())))
+
+        take(QuestionBankService._draw(section_type, snapshot, view, count - len(chosen), taken))
+        return chosen
+
+    @staticmethod
+    def _build_question(spec, section_type: str, items: Sequence[Dict[str, Any]], position: int, marks: int) -> Dict[str, Any]:
+        """Transform one bank item to the internal Question schema structure."""
+        item = items[position]
+        q = spec.transform(item, section_type, marks)
+        # Provenance for compact session storage (see services/session_store.py)
+        q["bank_item"] = {"section": section_type, "index": position, "key": item_key(item)}
+        return q
 
-                    option_keys   = sorted(original_options.keys())
-                    option_texts  = [original_options[k] for k in option_keys]
-                    random.shuffle(option_texts)
-                    new_options = {}
-                    new_correct = original_correct
-                    for i, key in enumerate(option_keys):
-                        new_options[key] = option_texts[i]
-                        if option_texts[i] == correct_text:
-                            new_correct = key
+    @staticmethod
+    def generate_paper(template_config: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Builds one candidate's full paper from a test's template_config.
+        Sections keep their configured order; questions are shuffled within
+        each section and numbered with a running temp_id.
+        """
+        generated_questions = []
+        temp_id = 1
 
-                    q_structure["content"] = {
-                        "url"      : item.get("image_url"),
-                        "guideline": item.get("guideline"),
-                        "scenario" : item.get("scenario"),
-                        "note"     : item.get("Note") or item.get("note"),
-                        "question" : item.get("title"),
-                        "options"  : new_options
-                    }
-                    q_structure["grading_config"] = {
-                        "correct_answer": new_correct
-                    }
+        for section in template_config:
+            section_type = section.get("type")
+            count = section.get("count", 1)
+            marks = section.get("marks", 5)
 
-            # 3. Reading (Summary)
-            elif section_type == "reading":
-                 q_structure["content"] = {
-                    "passage": item.get("passage"),
-                    "title": item.get("title")
-                }
-                 q_structure["grading_config"] = {
-                    "reference": item.get("reference_summary"),
-                    "key_ideas": item.get("key_ideas", [])
-                }
-            
-            # 4. Jumble — shuffle letter assignments so answer isn't always A B C D
-            elif section_type == "jumble":
-                original_jumble = item.get("jumble", {})
-                original_answer = (item.get("answer") or item.get("correct_answer", "")).strip()
+            # Generate random questions from bank
+            section_questions = QuestionBankService.generate_questions(
+                section_type=section_type,
+                count=count,
+                marks_per_question=marks,
+                difficulty=section.get("difficulty"),
+                tags=section.get("tags")
+            )
 
-                # Get the correct sentence order from original answer
-                answer_keys = original_answer.split()  # e.g. ["B", "A", "C", "D"]
-                # Build ordered sentence parts in correct reading order
-                ordered_parts = [original_jumble[k] for k in answer_keys if k in original_jumble]
+            # Shuffle questions within this section (keeps sections in order)
+            random.shuffle(section_questions)
 
-                # Create new random letter assignment
-                labels = list(original_jumble.keys())  # ["A", "B", "C", "D"]
-                shuffled_labels = labels[:]
-                random.shuffle(shuffled_labels)
+            # Add temp_id for tracking
+            for q in section_questions:
+                q["temp_id"] = temp_id
+                # Preserve generator-set type (e.g. mcq-multi-image); fall back to section_type
+                q["type"] = q.get("question_type", section_type)
+                generated_questions.append(q)
+                temp_id += 1
 
-                # Map: ordered_parts[i] -> shuffled_labels[i]
-                # So the correct answer is shuffled_labels in order
-                new_jumble = {}
-                for i, part in enumerate(ordered_parts):
-                    new_jumble[shuffled_labels[i]] = part
-                new_correct = " ".join(shuffled_labels)  # e.g. "C A D B"
+        return generated_questions
 
-                parts_list = [f"{k}: {v}" for k, v in sorted(new_jumble.items())]
-                sentence_display = " | ".join(parts_list) if parts_list else ""
+    @staticmethod
+    def _deal_positions(pool_size: int, count: int, cohort_size: int,
+                        served: Optional[Sequence[int]] = None) -> List[List[int]]:
+        """
+        Picks 'count' distinct bank positions for each of 'cohort_size' candidates.
+        Instead of an independent random.sample per candidate, one shuffled deck
+        of the whole bank is dealt out in consecutive hands and reshuffled when it
+        runs low — so a cohort sees every item before any item repeats.
+        With 'served' (serve count per position) each deck is ordered least-served
+        first, random among ties, counting the hands already dealt — exposure
+        balancing for the whole cohort at one sort per pass over the bank.
+        """
+        if count >= pool_size:
+            return [random.sample(range(pool_size), pool_size) for _ in range(cohort_size)]
 
-                q_structure["content"] = {
-                    "jumble": new_jumble,
-                    "sentence": sentence_display
-                }
-                q_structure["grading_config"] = {
-                    "correct_answer": new_correct
-                }
-            
-            # 5. MCQ (Grammar / Reading / Context) — shuffle options
-            elif section_type.startswith("mcq"):
-                original_options = item.get("options", {})
-                original_correct = item.get("correct_answer", "")
-                correct_text = original_options.get(original_correct, "")
+        dealt = list(served) if served is not None else None
 
-                # Shuffle: get all option texts, shuffle, reassign to A, B, C...
-                option_keys = sorted(original_options.keys())  # ["A", "B", "C"]
-                option_texts = [original_options[k] for k in option_keys]
-                random.shuffle(option_texts)
+        def fresh_deck() -> List[int]:
+            if dealt is None:
+                return random.sample(range(pool_size), pool_size)
+            return sorted(range(pool_size), key=lambda p: (dealt[p], random.random()))
 
-                new_options = {}
-                new_correct = original_correct
-                for i, key in enumerate(option_keys):
-                    new_options[key] = option_texts[i]
-                    if option_texts[i] == correct_text:
-                        new_correct = key
+        hands = []
+        deck: List[int] = []
+        cursor = 0
+        for _ in range(cohort_size):
+            if len(deck) - cursor < count:
+                # Carry the leftovers over so no hand contains the same item twice
+                leftover = deck[cursor:]
+                held = set(leftover)
+                deck = leftover + [p for p in fresh_deck() if p not in held]
+                cursor = 0
+            hand = deck[cursor:cursor + count]
+            cursor += count
+            if dealt is not None:
+                for position in hand:
+                    dealt[position] += 1
+                random.shuffle(hand)   # the deck is in exposure order
+            hands.append(hand)
+        return hands
 
-                if section_type == "mcq-reading":
-                    q_structure["content"] = {
-                        "passage": item.get("content"),
-                        "question": item.get("question_text"),
-                        "options": new_options
-                    }
-                else:
-                    q_structure["content"] = {
-                        "question": item.get("content") or item.get("question_text"),
-                        "options": new_options
-                    }
-                q_structure["grading_config"] = {
-                    "correct_answer": new_correct
-                }
+    @staticmethod
+    def generate_papers(template_config: List[Dict[str, Any]], cohort_size: int) -> List[List[Dict[str, Any]]]:
+        """
+        Builds papers for a whole cohort at once (admin pre-provisioning).
+        Same layout as generate_paper. Each section is sampled for the entire
+        cohort with dealt permutations of the bank — ordered by exposure when
+        balancing is on (the serves are recorded once for the cohort). Only
+        stratified sections (difficulty / tags) are still selected per candidate.
+        """
+        papers: List[List[Dict[str, Any]]] = [[] for _ in range(cohort_size)]
 
-            # 6. Typing Speed (all variants)
-            elif section_type in ("typing", "typing-easy", "typing-advanced"):
-                # Determine grading mode from section type or difficulty field
-                if section_type == "typing-easy":
-                    grading_mode = "speed"
-                elif section_type == "typing-advanced":
-                    grading_mode = "accuracy"
-                else:
-                    grading_mode = "both"  # legacy
+        for section in template_config:
+            section_type = section.get("type")
+            spec = get_section(section_type)
+            if not spec:
+                continue
+            count = section.get("count", 1)
+            marks = section.get("marks", 5)
+            snapshot = bank_registry.get(spec.bank_file)
+            if not snapshot:
+                continue
+            all_items = snapshot.view(spec.type_filter)
+            pool_size = len(all_items)
 
-                q_structure["type"] = "typing"  # Frontend always renders as 'typing'
-                q_structure["content"] = {
-                    "passage": item.get("passage"),
-                    "word_count": item.get("word_count"),
-                    "time_limit": item.get("time_limit_seconds", 60),
-                    "grading_mode": grading_mode,
-                }
-                q_structure["grading_config"] = {
-                    "original_passage": item.get("passage"),
-                    "time_limit": item.get("time_limit_seconds", 60),
-                    "grading_mode": grading_mode,
-                    "benchmark_wpm": 30,
-                    "benchmark_accuracy": 90
-                }
+            stratified = section.get("difficulty") or section.get("tags")
+            if stratified and count < pool_size:
+                # Honour the strata per candidate
+                hands = []
+                for _ in range(cohort_size):
+                    positions = QuestionBankService._select_positions(
+                        section_type, snapshot, spec.type_filter, count,
+                        section.get("difficulty"), section.get("tags")
+                    )
+                    random.shuffle(positions)
+                    hands.append(positions)
+            elif settings.EXPOSURE_BALANCED_SAMPLING and count < pool_size:
+                hands = exposure_tracker.deal(
+                    section_type, snapshot.digest, all_items,
+                    lambda served: QuestionBankService._deal_positions(pool_size, count, cohort_size, served)
+                )
+            else:
+                hands = QuestionBankService._deal_positions(pool_size, count, cohort_size)
+            for paper, positions in zip(papers, hands):
+                # Hands are already in random order
+                for position in positions:
+                    paper.append(QuestionBankService._build_question(spec, section_type, all_items, position, marks))
 
-            generated_questions.append(q_structure)
-            
-        return generated_questions
+        for paper in papers:
+            for temp_id, q in enumerate(paper, start=1):
+                q["temp_id"] = temp_id
+                q["type"] = q.get("question_type", q["bank_item"]["section"])
+        return papers
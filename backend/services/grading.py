@@ -1,11 +1,179 @@
+import asyncio
+import re
+from typing import Any, FrozenSet, Iterable, List, Optional, Tuple
+
+from config import settings
 from services.ai_engine import (
-    get_vector_similarity,
-    check_key_ideas,
     evaluate_english_quality,
     evaluate_video_strict,
     evaluate_image_strict,
     evaluate_reading_strict
 )
+from services import copy_detection, local_scorer, similarity
+from services.ai_resilience import AIUnavailableError
+from services.banks import bank_registry
+
+# Global cap on in-flight AI-graded questions (shared by every submission)
+ai_grading_slots = asyncio.Semaphore(settings.AI_GRADING_CONCURRENCY)
+
+
+async def run_ai_grader(grade_coro):
+    """Run one AI grading coroutine once a concurrency slot is free."""
+    async with ai_grading_slots:
+        return await grade_coro
+
+
+# ─── Visual pre-grader ────────────────────────────────────────────────────────
+# Cheap rules that give obviously failing visual answers a deterministic "Bad"
+# before they reach Claude. Only cases the rubric cannot rank above Bad
+# (< 7/15) are short-circuited; anything borderline still goes to the AI.
+pregrade_stats = {"checked": 0, "short_circuited": 0}
+
+_WORD = re.compile(r"[a-z]+(?:'[a-z]+)?")
+_vocabulary: Tuple[int, FrozenSet[str]] = (-1, frozenset())   # (registry generation, words)
+
+
+def _words(text: str) -> List[str]:
+    return _WORD.findall((text or "").lower())
+
+
+def _flatten_text(value: Any) -> Iterable[str]:
+    if isinstance(value, str):
+        yield value
+    elif isinstance(value, dict):
+        for v in value.values():
+            yield from _flatten_text(v)
+    elif isinstance(value, (list, tuple)):
+        for v in value:
+            yield from _flatten_text(v)
+
+
+def _bank_vocabulary() -> FrozenSet[str]:
+    """Every word that appears somewhere in the loaded question banks. This is
+    the whole "dictionary" of the word-ratio check — not a spelling lexicon:
+    a correctly spelt word that no bank contains counts as unknown too.
+    Rebuilt only when the registry has (re)loaded a bank."""
+    global _vocabulary
+    generation = bank_registry.generation
+    if generation != _vocabulary[0]:
+        words = set()
+        for snapshot in bank_registry.snapshots():
+            for item in snapshot.items:
+                for text in _flatten_text(item):
+                    words.update(_words(text))
+        _vocabulary = (generation, frozenset(words))
+    return _vocabulary[1]
+
+
+def pregrade_visual(student_text: str, reference: str, key_ideas: list, alternatives: Optional[list] = None,
+                    synonyms: Optional[dict] = None, required_prefix: Optional[list] = None) -> Optional[str]:
+    """
+    The reason a visual answer is certainly Bad, or None to send it to Claude.
+      - fewer than PREGRADE_MIN_WORDS words
+      - under PREGRADE_MIN_DICTIONARY_RATIO of its words appear in the banks
+        or the question itself (bank words only — no spelling lexicon, so
+        uncommon correct words count against the answer too)
+      - no word in common with the reference, alternative answers, key ideas
+        or acceptable synonyms
+      - required prefix missing AND overlap with the reference below
+        PREGRADE_PREFIX_MIN_OVERLAP (wrong content caps the rubric at 6/15,
+        and the missing prefix costs the 2 compliance marks)
+    """
+    words = _words(student_text)
+    if len(words) < settings.PREGRADE_MIN_WORDS:
+        return "The answer is too short to describe the clip."
+
+    targets = [reference or ""] + [str(a) for a in (alternatives or [])]
+    targets.append(" ".join(_flatten_text(key_ideas or [])))
+    targets.append(" ".join([*(synonyms or {}), *_flatten_text(synonyms or {})]))
+    known = _bank_vocabulary().union(*(_words(t) for t in targets))
+    if sum(1 for w in words if w in known) / len(words) < settings.PREGRADE_MIN_DICTIONARY_RATIO:
+        return "The answer is not recognisable English."
+
+    overlap = max(similarity.similarities(student_text, targets))
+    if overlap == 0:
+        return "The answer does not describe anything in the clip."
+
+    if required_prefix:
+        normalized = " ".join(words)
+        if not any(normalized.startswith(" ".join(_words(p))) for p in required_prefix) \
+                and overlap < settings.PREGRADE_PREFIX_MIN_OVERLAP:
+            prefixes = " / ".join(f'"{p}"' for p in required_prefix)
+            return f"The answer does not start with {prefixes} and does not match the clip."
+    return None
+
+
+def _pregraded_bad(reason: str) -> dict:
+    return {
+        "score": 0,
+        "breakdown": {
+            "rank": "Bad",
+            "internal_score": 0,
+            "feedback": reason,
+            "passed": False,
+            "pre_graded": True
+        }
+    }
+
+
+def _pregrade(student_text, reference, key_ideas, alternatives=None, synonyms=None, required_prefix=None) -> Optional[dict]:
+    if not settings.AI_PREGRADE_ENABLED:
+        return None
+    pregrade_stats["checked"] += 1
+    reason = pregrade_visual(student_text, reference, key_ideas, alternatives, synonyms, required_prefix)
+    if reason is None:
+        return None
+    pregrade_stats["short_circuited"] += 1
+    return _pregraded_bad(reason)
+
+
+# ─── Visual grading cascade ──────────────────────────────────────────────────
+# Answers the pre-grader lets through are scored locally against the accepted
+# captions; where the calibrated thresholds are confident the rank is final,
+# otherwise Claude grades as usual (services/local_scorer.py).
+cascade_stats = {"checked": 0, "local_bad": 0, "local_good": 0}
+
+_LOCAL_FEEDBACK = {
+    "Good": "The answer closely matches the expected description.",
+    "Bad": "The answer does not match the expected description closely enough.",
+}
+
+
+def _cascade(question_type, student_text, reference, alternatives=None, synonyms=None) -> Optional[dict]:
+    if not settings.AI_CASCADE_ENABLED:
+        return None
+    thresholds = local_scorer.load_calibration().get(question_type)
+    if not thresholds:
+        return None
+    cascade_stats["checked"] += 1
+    local_score = local_scorer.score(student_text, reference, alternatives, synonyms)
+    rank = local_scorer.decide(thresholds, local_score)
+    if rank is None:
+        return None
+    cascade_stats[f"local_{rank.lower()}"] += 1
+    return {
+        "score": 0,
+        "breakdown": {
+            "rank": rank,
+            # The local similarity (0-1) and the calibrated threshold it crossed
+            "internal_score": round(local_score, 3),
+            "cascade_threshold": thresholds["good_from" if rank == "Good" else "bad_below"],
+            "feedback": _LOCAL_FEEDBACK[rank],
+            "passed": rank == "Good",
+            "local_graded": True
+        }
+    }
+
+
+def ai_unavailable_grade(question_type: str, error: Exception) -> dict:
+    """The pre-queue error grade, for inline callers that have no grading queue
+    to defer to when the graders raise AIUnavailableError (legacy tests,
+    /exam/submit-answer)."""
+    feedback = f"Evaluation Error: {error}"
+    if question_type == "reading":
+        return {"score": 0, "breakdown": {"passed": False, "feedback": feedback}}
+    return {"score": 0, "breakdown": {"rank": "Bad", "internal_score": 0, "feedback": feedback, "passed": False}}
+
 
 # ─── Visual rank helper ───────────────────────────────────────────────────────
 def _score_to_rank(score: float) -> str:
@@ -20,10 +188,14 @@ def _score_to_rank(score: float) -> str:
         return "Bad"
 
 
-async def grade_video_question(student_text: str, reference_caption: str, key_ideas: list, video_context: str = ""):
+async def grade_video_question(student_text: str, reference_caption: str, key_ideas: list, video_context: str = "",
+                               alternative_answers: Optional[list] = None, acceptable_synonyms: Optional[dict] = None,
+                               required_prefix: Optional[list] = None, question_type: str = "video"):
     """
     Video Grading: 15-mark AI evaluation → converted to Good/Medium/Bad rank.
     Score stored as 0 (visual does not count toward total).
+    Obviously failing answers are ranked Bad by the pre-grader, and answers the
+    calibrated local scorer is confident about are ranked without an AI call.
     """
     if not student_text or not student_text.strip():
         return {
@@ -36,12 +208,22 @@ async def grade_video_question(student_text: str, reference_caption: str, key_id
             }
         }
 
+    pregraded = _pregrade(student_text, reference_caption, key_ideas, alternative_answers, acceptable_synonyms,
+                          required_prefix)
+    if pregraded:
+        return pregraded
+    local = _cascade(question_type, student_text, reference_caption, alternative_answers, acceptable_synonyms)
+    if local:
+        return local
+
     try:
         eval_result = await evaluate_video_strict(
             user_answer=student_text,
             correct_answer=reference_caption or "",
             video_context=video_context or "Video description task"
         )
+    except AIUnavailableError:
+        raise   # deferred by the grading queue, not scored 0
     except Exception as e:
         print(f"Video Eval Error: {e}")
         eval_result = {"total_score": 0, "feedback": f"Evaluation Error: {str(e)}"}
@@ -60,10 +242,14 @@ async def grade_video_question(student_text: str, reference_caption: str, key_id
     }
 
 
-async def grade_image_question(student_text: str, reference_caption: str, key_ideas: list, image_context: str = ""):
+async def grade_image_question(student_text: str, reference_caption: str, key_ideas: list, image_context: str = "",
+                               alternative_answers: Optional[list] = None, acceptable_synonyms: Optional[dict] = None,
+                               question_type: str = "image"):
     """
     Image Grading: 15-mark AI evaluation → converted to Good/Medium/Bad rank.
     Score stored as 0 (visual does not count toward total).
+    Obviously failing answers are ranked Bad by the pre-grader, and answers the
+    calibrated local scorer is confident about are ranked without an AI call.
     """
     if not student_text or not student_text.strip():
         return {
@@ -76,12 +262,21 @@ async def grade_image_question(student_text: str, reference_caption: str, key_id
             }
         }
 
+    pregraded = _pregrade(student_text, reference_caption, key_ideas, alternative_answers, acceptable_synonyms)
+    if pregraded:
+        return pregraded
+    local = _cascade(question_type, student_text, reference_caption, alternative_answers, acceptable_synonyms)
+    if local:
+        return local
+
     try:
         eval_result = await evaluate_image_strict(
             user_answer=student_text,
             correct_answer=reference_caption or "",
             image_context=image_context or "Image description task"
         )
+    except AIUnavailableError:
+        raise   # deferred by the grading queue, not scored 0
     except Exception as e:
         print(f"Image Eval Error: {e}")
         eval_result = {"total_score": 0, "feedback": f"Evaluation Error: {str(e)}"}
@@ -121,13 +316,14 @@ async def grade_reading_question(student_text: str, original_passage: str, refer
         }
     
     # 1. Copy-Paste Detection (quick check before AI eval)
-    copy_score = await get_vector_similarity(student_text, original_passage or "")
-    if copy_score > 0.85:  # If 85% similar to original text -> It's copied
+    copy_report = copy_detection.check(student_text, original_passage or "")
+    if copy_report.copied:
         return {
-            "score": 0, 
+            "score": 0,
             "breakdown": {
                 "error": "Plagiarism Detected (Too similar to passage)",
-                "similarity_to_passage": f"{round(copy_score*100)}%",
+                "similarity_to_passage": f"{round(copy_report.containment*100)}%",
+                "copied_sentences": f"{copy_report.copied_sentences}/{len(copy_report.sentences)}",
                 "feedback": "Your summary appears to be copied directly from the passage. Write in your own words."
             }
         }
@@ -140,6 +336,8 @@ async def grade_reading_question(student_text: str, original_passage: str, refer
             reference_summary=reference_summary or "",
             key_ideas=key_ideas or []
         )
+    except AIUnavailableError:
+        raise   # deferred by the grading queue, not scored 0
     except Exception as e:
         print(f"Reading Eval Error: {e}")
         eval_result = {"total_score": 0, "passed": False, "feedback": f"Evaluation Error: {str(e)}"}
@@ -237,6 +435,30 @@ async def grade_mcq_question(student_answer: str, correct_answer: str, marks: in
     }
 
 
+async def grade_multi_image_question(student_answer: str, sub_images: list, marks_per_image: int):
+    """
+    Grading for mcq-multi-image questions (one MCQ answer per sub-image).
+    student_answer is JSON: {"0": "c", "1": "d", "2": "b"}
+    """
+    import json
+    try:
+        answers = json.loads(student_answer) if student_answer else {}
+    except:
+        answers = {}
+
+    total_score = 0
+    breakdown = {}
+    for i, sub in enumerate(sub_images):
+        given  = str(answers.get(str(i), "")).strip().lower()
+        expect = str(sub.get("correct_answer", "")).strip().lower()
+        if given == expect:
+            total_score += marks_per_image
+            breakdown[f"image_{i+1}"] = {"score": marks_per_image, "correct": True}
+        else:
+            breakdown[f"image_{i+1}"] = {"score": 0, "correct": False, "expected": expect, "given": given}
+    return {"score": total_score, "breakdown": breakdown}
+
+
 async def grade_image_count_question(student_answer: str, correct_answer: int, marks: int, tolerance: int = 0):
     """
     Grading for image-count questions.
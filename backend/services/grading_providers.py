@@ -0,0 +1,202 @@
+"""
+Backends that answer ai_engine's Messages API requests.
+
+  anthropic — the real API on one long-lived AsyncAnthropic client (shared
+              keep-alive pool, CLAUDE_TIMEOUT_SECONDS).
+  stub      — no network. Answers every request with a deterministic,
+              rubric-shaped grade derived from a hash of the request, after a
+              simulated latency, and fails a configurable share of calls. For
+              load-testing finish_exam / re-evaluation and benchmarking the
+              grading pipeline's throughput and tail latency on a laptop.
+
+Chosen with AI_PROVIDER. Both return anthropic.types.Message objects, so
+everything above them — tool-call validation, repair turns, packed grading,
+retries and the circuit breaker — runs unchanged. The provider's model name is
+part of the response-cache key, so stub grades never mix with real ones.
+
+Stub tuning (STUB_*): latency is log-normal around STUB_LATENCY_MEDIAN_MS
+with shape STUB_LATENCY_SIGMA (long right tail, like the real API);
+STUB_ERROR_RATE of calls raise STUB_ERROR_STATUS (retryable by default);
+STUB_SCHEMA_ERROR_RATE of tool replies break the grade schema to exercise
+the repair turn. STUB_SEED makes a run's latency/error sequence repeatable.
+"""
+import asyncio
+import hashlib
+import json
+import random
+import re
+from typing import Any, Dict, List, Optional
+
+import anthropic
+from anthropic.types import Message
+
+try:  # anthropic >= 1.0 is built on httpx2, older SDKs on httpx
+    import httpx2 as httpx
+except ImportError:
+    import httpx
+
+from config import settings
+from services.prompts import PROMPTS, PromptTemplate
+
+
+class GradingProvider:
+    name = "base"
+    model = ""
+
+    async def create_message(self, params: Dict[str, Any]) -> Message:
+        """Answer one Messages API request (the kwargs of messages.create)."""
+        raise NotImplementedError
+
+    async def close(self):
+        pass
+
+
+class AnthropicGradingProvider(GradingProvider):
+    name = "anthropic"
+
+    def __init__(self):
+        self.model = settings.AI_MODEL
+        limit = settings.CLAUDE_MAX_CONCURRENCY
+        http_client = anthropic.DefaultAsyncHttpxClient(
+            limits=httpx.Limits(
+                max_connections=limit,
+                max_keepalive_connections=limit,
+                keepalive_expiry=settings.CLAUDE_KEEPALIVE_SECONDS,
+            ),
+            timeout=httpx.Timeout(settings.CLAUDE_TIMEOUT_SECONDS, connect=10.0),
+        )
+        # Retries are ours (services/ai_resilience.py) so the breaker sees every failure
+        self.client = anthropic.AsyncAnthropic(api_key=settings.ANTHROPIC_API_KEY, http_client=http_client, max_retries=0)
+
+    async def create_message(self, params: Dict[str, Any]) -> Message:
+        return await self.client.messages.create(**params)
+
+    async def close(self):
+        await self.client.close()
+
+
+# ─── Stub ────────────────────────────────────────────────────────────────────
+_PACKED_LABEL = re.compile(r"^### (Q\d+) — grade with RUBRIC (\d+)", re.MULTILINE)
+_STATUS_ERRORS = {429: "RateLimitError", 529: "OverloadedError"}
+
+
+def _sample(schema: Dict[str, Any], rng: random.Random) -> Any:
+    """A random value satisfying a (flat) pydantic JSON schema."""
+    if "enum" in schema:
+        return rng.choice(schema["enum"])
+    kind = schema.get("type")
+    if kind in ("number", "integer"):
+        value = rng.uniform(schema.get("minimum", 0), schema.get("maximum", 10))
+        return round(value) if kind == "integer" else round(value * 2) / 2
+    if kind == "boolean":
+        return rng.random() < 0.5
+    if kind == "array":
+        return [f"idea {rng.randint(1, 9)}" for _ in range(rng.randint(0, 3))]
+    return "Stub feedback."
+
+
+def stub_grade(template: PromptTemplate, rng: random.Random) -> Dict[str, Any]:
+    """A rubric-shaped grade for template: component scores within their bounds,
+    total_score their sum and passed = total_score >= 8."""
+    properties = template.output_model.model_json_schema()["properties"]
+    grade = {name: _sample(schema, rng) for name, schema in properties.items()}
+    total = sum(v for k, v in grade.items() if k.endswith("_score") and k != "total_score")
+    grade["total_score"] = min(total, properties["total_score"].get("maximum", total))
+    grade["passed"] = grade["total_score"] >= 8
+    return grade
+
+
+class StubGradingProvider(GradingProvider):
+    name = "stub"
+    model = "stub-grader"
+
+    def __init__(self):
+        self._chaos = random.Random(settings.STUB_SEED)
+        self.calls = 0
+
+    def _error(self) -> anthropic.APIStatusError:
+        status = settings.STUB_ERROR_STATUS
+        response = httpx.Response(status, request=httpx.Request("POST", "https://stub.invalid/v1/messages"))
+        error_class = getattr(anthropic, _STATUS_ERRORS.get(status, ""), None)
+        if error_class is None:
+            error_class = anthropic.InternalServerError if status >= 500 else anthropic.APIStatusError
+        return error_class(f"Stub error {status}", response=response, body=None)
+
+    async def create_message(self, params: Dict[str, Any]) -> Message:
+        self.calls += 1
+        latency = settings.STUB_LATENCY_MEDIAN_MS / 1000 * self._chaos.lognormvariate(0, settings.STUB_LATENCY_SIGMA)
+        await asyncio.sleep(latency)
+        if self._chaos.random() < settings.STUB_ERROR_RATE:
+            raise self._error()
+
+        # Same request → same grade (dedupe/cache behave as with the real API)
+        digest = hashlib.sha256(json.dumps(params, sort_keys=True, default=str).encode()).digest()
+        rng = random.Random(digest)
+        if params.get("tools"):
+            content = [self._tool_use(params, rng)]
+        else:
+            content = [{"type": "text", "text": json.dumps(self._text_reply(params, rng))}]
+        return Message.model_validate({
+            "id": f"msg_stub_{digest.hex()[:24]}",
+            "type": "message",
+            "role": "assistant",
+            "model": self.model,
+            "content": content,
+            "stop_reason": "tool_use" if params.get("tools") else "end_turn",
+            "stop_sequence": None,
+            "usage": {"input_tokens": 0, "output_tokens": 0},
+        })
+
+    def _tool_use(self, params: Dict[str, Any], rng: random.Random) -> Dict[str, Any]:
+        template = _template_for(_system_text(params))
+        grade = stub_grade(template, rng) if template else {}
+        if grade and self._chaos.random() < settings.STUB_SCHEMA_ERROR_RATE:
+            grade["total_score"] = 99   # out of range — triggers the repair turn
+        return {"type": "tool_use", "id": f"toolu_stub_{rng.getrandbits(48):012x}",
+                "name": params["tools"][0]["name"], "input": grade}
+
+    def _text_reply(self, params: Dict[str, Any], rng: random.Random) -> Any:
+        system = _system_text(params)
+        prompt = params["messages"][-1]["content"]
+        labels = _PACKED_LABEL.findall(prompt) if isinstance(prompt, str) else []
+        if labels:
+            # Packed request: one entry per label, graded with its RUBRIC n
+            rubrics = re.split(r"^=== RUBRIC \d+ ===\n", system, flags=re.MULTILINE)[1:]
+            entries = []
+            for label, n in labels:
+                template = _template_for(rubrics[int(n) - 1]) if int(n) <= len(rubrics) else None
+                if template:
+                    entries.append({"question_id": label, **stub_grade(template, rng)})
+            return entries
+        # Legacy free-form prompts (evaluate_english_quality / evaluate_visual_rank)
+        return {
+            "relevance": 1, "grammar": rng.randint(3, 9), "vocab_score": rng.randint(3, 9),
+            "coherence_score": rng.randint(3, 9), "rank": rng.choice(["Good", "Medium", "Bad"]),
+            "feedback": "Stub feedback.", "key_elements_found": [], "key_elements_missing": [],
+        }
+
+
+def _system_text(params: Dict[str, Any]) -> str:
+    system = params.get("system") or ""
+    if isinstance(system, list):
+        return "\n\n".join(block.get("text", "") for block in system)
+    return system
+
+
+def _template_for(text: str) -> Optional[PromptTemplate]:
+    """The registered template whose rubric starts `text`."""
+    for template in PROMPTS.values():
+        if text.startswith(template.system):
+            return template
+    return None
+
+
+_PROVIDERS = {"anthropic": AnthropicGradingProvider, "stub": StubGradingProvider}
+
+
+def create_grading_provider(name: Optional[str] = None) -> GradingProvider:
+    """A new provider called `name` (default AI_PROVIDER)."""
+    name = name or settings.AI_PROVIDER
+    if name not in _PROVIDERS:
+        raise ValueError(f"Unknown AI provider '{name}' (expected one of {sorted(_PROVIDERS)})")
+    return _PROVIDERS[name]()
@@ -0,0 +1,375 @@
+"""
+Durable background grading of submitted template exams.
+
+POST /exam/tests/{id}/finish saves the answers, marks the TestResult
+"submitted" and inserts a grading_jobs row in the same transaction, then
+returns immediately. Worker loops — GRADING_WORKERS of them inside each web
+process and/or any number of `python3 grading_worker.py` processes — claim
+jobs from the table, grade the paper and flip the result to "graded".
+Clients poll GET /exam/results/{id}/status. A result has at most one active
+(queued or running) job — a unique partial index, inserted into with ON
+CONFLICT DO NOTHING — so the orphan sweep every process runs at startup
+never enqueues a result twice. Inline grading (ASYNC_GRADING off) inserts
+its job already claimed, so no worker picks that result up meanwhile.
+
+Claiming
+--------
+Postgres: one UPDATE … WHERE id = (SELECT … FOR UPDATE SKIP LOCKED LIMIT 1)
+RETURNING, so concurrent workers never block on or double-claim a job.
+SQLite: optimistic compare-and-set — pick a candidate, then UPDATE it only
+if its status/attempts are unchanged; a rowcount of 0 means someone else won.
+
+A claimed job is invisible for GRADING_VISIBILITY_SECONDS, and the worker
+renews that lease every third of it while the paper is being graded. If the
+worker dies, the job becomes claimable again once the lease expires. Every
+later write is a compare-and-set on the claimed attempt number, and the
+breakdown is only stored while the result is still "submitted" — a worker
+that lost its lease stops grading and writes nothing. Failures are
+retried with exponential backoff up to GRADING_MAX_ATTEMPTS, after which the
+result is marked "grading_failed". A job that fails because Claude is
+unavailable (services/ai_resilience.py) is re-queued for after the circuit
+breaker's cooldown without using up an attempt.
+"""
+import asyncio
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional, Tuple
+
+from sqlalchemy import and_, func, inspect, or_, text, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+
+from config import settings
+from database import AsyncSessionLocal, engine
+from models import ACTIVE_GRADING_JOB, ExamSession, GradingJob, TestResult
+from services import bank_versions
+from services.ai_resilience import AIUnavailableError
+from services.results import build_section_summary, session_breakdown_entry
+from services.sections import grade_paper
+from services.session_store import expand_paper
+
+ClaimedJob = Tuple[int, int, int, int]   # (job_id, result_id, session_id, attempts)
+
+
+def _utcnow() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+async def grade_submission(result_id: int, session_id: int, job: Optional[Tuple[int, int]] = None) -> bool:
+    """Grade one submitted session and store the v2 breakdown on its TestResult.
+    With job=(job_id, claimed attempts) the breakdown is only stored while that
+    claim still holds, and the job is marked done in the same transaction.
+    Returns whether the breakdown was stored."""
+    # Load what we need, then release the connection while Claude is working
+    async with AsyncSessionLocal() as db:
+        exam_result = (await db.execute(select(TestResult).where(TestResult.id == result_id))).scalars().first()
+        session = (await db.execute(select(ExamSession).where(ExamSession.id == session_id))).scalars().first()
+    if not exam_result or not session:
+        print(f"[GRADING] Result {result_id} / session {session_id} not found — skipping")
+        return False
+    if exam_result.status != "submitted":
+        return False   # already graded (duplicate enqueue)
+
+    answers = session.answers or {}
+    await bank_versions.load(session.generated_questions)
+    questions = expand_paper(session.generated_questions)
+    grades = await grade_paper(questions, answers, session)
+    breakdown = [
+        session_breakdown_entry(q, answers.get(str(q["temp_id"]), ""), grade_data)
+        for q, grade_data in zip(questions, grades)
+    ]
+    section_summary, total_score = build_section_summary(breakdown)
+
+    async with AsyncSessionLocal() as db:
+        if job is not None:
+            held = await db.execute(_job_update(*job).values(status="done", locked_until=None))
+            if held.rowcount != 1:
+                print(f"[GRADING] Result {result_id}: job {job[0]} was reclaimed — discarding this grading")
+                return False
+        stored = await db.execute(
+            update(TestResult)
+            .where(TestResult.id == result_id, TestResult.status == "submitted")
+            .values(
+                total_score=total_score,
+                ai_breakdown={
+                    "version": 2,
+                    "section_summary": section_summary,
+                    "questions": breakdown
+                },
+                status="graded",
+            )
+        )
+        await db.commit()
+    return stored.rowcount == 1
+
+
+async def _mark_failed(result_id: int):
+    try:
+        async with AsyncSessionLocal() as db:
+            exam_result = (await db.execute(select(TestResult).where(TestResult.id == result_id))).scalars().first()
+            if exam_result and exam_result.status == "submitted":
+                exam_result.status = "grading_failed"
+                await db.commit()
+    except Exception as e:
+        print(f"[GRADING ERROR] Could not mark result {result_id} as failed: {e}")
+
+
+def _insert():
+    if engine.dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert
+
+
+async def enqueue_grading(db: AsyncSession, result_id: int, session_id: int,
+                          claim: bool = False) -> Optional[ClaimedJob]:
+    """Add a grading job to the caller's transaction (committed with the answers).
+    Idempotent: returns the new job, or None if the result already has an
+    active one. With claim=True the job is inserted already claimed by the
+    caller (inline grading runs it with run_job); otherwise call
+    grading_queue.notify() after the commit to wake local workers."""
+    now = _utcnow()
+    values = {"result_id": result_id, "session_id": session_id, "status": "queued",
+              "attempts": 0, "run_after": now}
+    if claim:
+        values.update(status="running", attempts=1,
+                      locked_until=now + timedelta(seconds=settings.GRADING_VISIBILITY_SECONDS))
+    job_id = (await db.execute(
+        _insert()(GradingJob).values(**values)
+        .on_conflict_do_nothing(index_elements=[GradingJob.result_id], index_where=text(ACTIVE_GRADING_JOB))
+        .returning(GradingJob.id)
+    )).scalar()
+    if job_id is None:
+        return None
+    return job_id, result_id, session_id, values["attempts"]
+
+
+async def ensure_active_job_index():
+    """Create the one-active-job-per-result index on tables that predate it,
+    retiring duplicate active jobs first (the oldest one is kept)."""
+    index = next(i for i in GradingJob.__table__.indexes if i.name == "uq_grading_jobs_active_result")
+    async with engine.begin() as conn:
+        exists = await conn.run_sync(
+            lambda sync_conn: any(i["name"] == index.name for i in inspect(sync_conn).get_indexes("grading_jobs"))
+        )
+        if exists:
+            return
+        keep = (
+            select(func.min(GradingJob.id))
+            .where(text(ACTIVE_GRADING_JOB))
+            .group_by(GradingJob.result_id)
+        )
+        await conn.execute(
+            update(GradingJob)
+            .where(text(ACTIVE_GRADING_JOB), GradingJob.id.not_in(keep))
+            .values(status="failed", locked_until=None, last_error="duplicate job")
+        )
+        await conn.run_sync(index.create)
+
+
+def _claimable(now: datetime):
+    return or_(
+        and_(GradingJob.status == "queued", GradingJob.run_after <= now),
+        and_(GradingJob.status == "running", GradingJob.locked_until < now),
+    )
+
+
+async def _claim_postgres(db: AsyncSession, now: datetime, lease: datetime) -> Optional[ClaimedJob]:
+    candidate = (
+        select(GradingJob.id)
+        .where(_claimable(now))
+        .order_by(GradingJob.id)
+        .limit(1)
+        .with_for_update(skip_locked=True)
+        .scalar_subquery()
+    )
+    row = (await db.execute(
+        update(GradingJob)
+        .where(GradingJob.id == candidate)
+        .values(status="running", attempts=GradingJob.attempts + 1, locked_until=lease)
+        .returning(GradingJob.id, GradingJob.result_id, GradingJob.session_id, GradingJob.attempts)
+    )).first()
+    return tuple(row) if row else None
+
+
+async def _claim_compare_and_set(db: AsyncSession, now: datetime, lease: datetime) -> Optional[ClaimedJob]:
+    candidates = (await db.execute(
+        select(GradingJob.id, GradingJob.result_id, GradingJob.session_id, GradingJob.status, GradingJob.attempts)
+        .where(_claimable(now))
+        .order_by(GradingJob.id)
+        .limit(5)
+    )).all()
+    for job_id, result_id, session_id, status, attempts in candidates:
+        claimed = await db.execute(
+            update(GradingJob)
+            .where(GradingJob.id == job_id, GradingJob.status == status, GradingJob.attempts == attempts)
+            .values(status="running", attempts=attempts + 1, locked_until=lease)
+        )
+        if claimed.rowcount == 1:
+            return job_id, result_id, session_id, attempts + 1
+    return None
+
+
+async def claim_job() -> Optional[ClaimedJob]:
+    now = _utcnow()
+    lease = now + timedelta(seconds=settings.GRADING_VISIBILITY_SECONDS)
+    claim = _claim_postgres if engine.dialect.name == "postgresql" else _claim_compare_and_set
+    async with AsyncSessionLocal() as db:
+        job = await claim(db, now, lease)
+        await db.commit()
+    return job
+
+
+def _job_update(job_id: int, claimed: int):
+    """UPDATE of a job that only applies while this claim (attempt number) still holds it."""
+    return update(GradingJob).where(
+        GradingJob.id == job_id, GradingJob.status == "running", GradingJob.attempts == claimed
+    )
+
+
+async def _update_job(job_id: int, claimed: int, **values) -> bool:
+    async with AsyncSessionLocal() as db:
+        updated = await db.execute(_job_update(job_id, claimed).values(**values))
+        await db.commit()
+    return updated.rowcount == 1
+
+
+async def _heartbeat(job_id: int, attempts: int, grading: asyncio.Task) -> bool:
+    """Renew the job's lease while it is graded. Returns True (after cancelling
+    the grading) once the lease turns out to be lost to another worker."""
+    interval = max(1.0, settings.GRADING_VISIBILITY_SECONDS / 3)
+    while True:
+        await asyncio.sleep(interval)
+        lease = _utcnow() + timedelta(seconds=settings.GRADING_VISIBILITY_SECONDS)
+        try:
+            renewed = await _update_job(job_id, attempts, locked_until=lease)
+        except Exception as e:
+            print(f"[GRADING] Could not renew the lease of job {job_id}: {e}")
+            continue
+        if not renewed:
+            print(f"[GRADING] Job {job_id} was reclaimed by another worker — stopping")
+            grading.cancel()
+            return True
+
+
+async def run_job(job: ClaimedJob) -> str:
+    """Grade a claimed job. Returns "done", "deferred" (Claude unavailable,
+    re-queued for after the cooldown), "retry", "failed" or "lost" (reclaimed)."""
+    job_id, result_id, session_id, attempts = job
+    if attempts > settings.GRADING_MAX_ATTEMPTS:
+        # Lease expired too many times (worker keeps dying on this one)
+        await _update_job(job_id, attempts, status="failed", locked_until=None)
+        await _mark_failed(result_id)
+        return "failed"
+
+    grading = asyncio.create_task(grade_submission(result_id, session_id, job=(job_id, attempts)))
+    heartbeat = asyncio.create_task(_heartbeat(job_id, attempts, grading))
+    try:
+        await grading
+    except asyncio.CancelledError:
+        if heartbeat.done() and not heartbeat.cancelled() and heartbeat.result():
+            return "lost"   # the new holder grades it
+        raise
+    except AIUnavailableError as e:
+        # Claude is down or rate-limited, not this paper's fault: wait out the
+        # circuit breaker without using up an attempt
+        delay = max(e.retry_after, settings.GRADING_BACKOFF_SECONDS)
+        print(f"[GRADING] Result {result_id} deferred {delay:.0f}s: {e}")
+        await _update_job(job_id, attempts, status="queued", attempts=attempts - 1, locked_until=None,
+                          last_error=str(e)[:2000], run_after=_utcnow() + timedelta(seconds=delay))
+        return "deferred"
+    except Exception as e:
+        print(f"[GRADING ERROR] Result {result_id} (attempt {attempts}): {e}")
+        if attempts >= settings.GRADING_MAX_ATTEMPTS:
+            await _update_job(job_id, attempts, status="failed", locked_until=None, last_error=str(e)[:2000])
+            await _mark_failed(result_id)
+            return "failed"
+        else:
+            backoff = min(settings.GRADING_BACKOFF_SECONDS * 2 ** (attempts - 1), 600)
+            await _update_job(job_id, attempts, status="queued", locked_until=None, last_error=str(e)[:2000],
+                              run_after=_utcnow() + timedelta(seconds=backoff))
+            return "retry"
+    finally:
+        heartbeat.cancel()
+
+    # Already graded elsewhere: the job is done too (no-op if the write above marked it)
+    await _update_job(job_id, attempts, status="done", locked_until=None)
+    return "done"
+
+
+class GradingQueue:
+    """Worker loops draining grading_jobs (in-process or in grading_worker.py)."""
+
+    def __init__(self, workers: int):
+        self.workers = workers
+        self._tasks: List[asyncio.Task] = []
+        self._wakeup: Optional[asyncio.Event] = None
+
+    @property
+    def running(self) -> bool:
+        return bool(self._tasks)
+
+    def notify(self):
+        """Wake idle local workers (jobs enqueued by other processes are found by polling)."""
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _enqueue_orphans(self) -> int:
+        """Results left "submitted" without a job (e.g. before the jobs table existed).
+        Safe to run from every process at once: enqueue_grading is idempotent,
+        and inline grading holds a claimed job, so it is never swept up here."""
+        async with AsyncSessionLocal() as db:
+            has_job = select(GradingJob.id).where(GradingJob.result_id == TestResult.id).exists()
+            results = (await db.execute(
+                select(TestResult).where(TestResult.status == "submitted", ~has_job)
+            )).scalars().all()
+            enqueued = 0
+            for r in results:
+                session = (await db.execute(
+                    select(ExamSession)
+                    .where(ExamSession.user_id == r.user_id)
+                    .where(ExamSession.test_id == r.test_id)
+                    .where(ExamSession.is_completed == True)
+                    .order_by(ExamSession.started_at.desc())
+                    .limit(1)
+                )).scalars().first()
+                if session and await enqueue_grading(db, r.id, session.id):
+                    enqueued += 1
+            await db.commit()
+            return enqueued
+
+    async def start(self) -> int:
+        self._wakeup = asyncio.Event()
+        enqueued = 0
+        try:
+            enqueued = await self._enqueue_orphans()
+        except Exception as e:
+            print(f"[GRADING] Could not enqueue orphaned results: {e}")
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        return enqueued
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _worker(self):
+        while True:
+            try:
+                job = await claim_job()
+            except Exception as e:
+                print(f"[GRADING] Claim failed: {e}")
+                job = None
+            if job:
+                await run_job(job)
+                continue
+            # Idle: wait for a local enqueue or the next poll
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=settings.GRADING_POLL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+
+grading_queue = GradingQueue(workers=settings.GRADING_WORKERS)
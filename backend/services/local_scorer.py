@@ -0,0 +1,202 @@
+"""
+Local similarity scorer for the visual grading cascade.
+
+score() compares a candidate's caption with the question's reference and
+alternative answers: character 3-5-gram TF-IDF vectors (n-grams stay inside
+word boundaries, so spelling slips and inflections still overlap), cosine
+similarity (services/similarity.py), best match wins. Acceptable synonyms are folded onto their
+canonical word on both sides first. IDF weights are fitted on every reference
+and alternative in the visual banks and refitted when a bank changes.
+
+The cascade (services/grading.py) turns a score into a rank only where the
+score has historically agreed with Claude: calibrate_cascade.py replays
+graded answers, fits per question type a `bad_below` and a `good_from`
+threshold whose bands each reach CASCADE_TARGET_AGREEMENT with Claude's
+rank over at least CASCADE_MIN_SAMPLES answers, and writes them to
+CASCADE_CALIBRATION_PATH. Scores in between go to Claude as before.
+"""
+import json
+import os
+import re
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from config import settings
+from services.banks import bank_registry
+from services.similarity import TfidfModel, Vector, cosine
+
+NGRAM_SIZES = (3, 4, 5)
+
+_WORD = re.compile(r"[a-z0-9]+(?:'[a-z]+)?")
+
+# (bank digests, model fitted on those versions)
+_fitted: Tuple[Tuple[str, ...], TfidfModel] = ((), TfidfModel(()))
+# (mtime_ns of the calibration file, {question_type: thresholds})
+_calibration: Tuple[Optional[int], Dict[str, dict]] = (None, {})
+
+Sample = Tuple[float, str]   # (local score, Claude's rank)
+
+
+# ─── Scoring ─────────────────────────────────────────────────────────────────
+def _synonym_patterns(synonyms: Optional[dict]) -> Tuple[Tuple[re.Pattern, str], ...]:
+    pairs = []
+    for canonical, alternatives in (synonyms or {}).items():
+        for alt in (alternatives if isinstance(alternatives, list) else [alternatives]):
+            if isinstance(alt, str) and alt.strip():
+                pairs.append((alt.lower().strip(), str(canonical).lower()))
+    pairs.sort(key=lambda pair: -len(pair[0]))   # "cell phone" before "phone"
+    return tuple((re.compile(rf"\b{re.escape(alt)}\b"), canonical) for alt, canonical in pairs)
+
+
+def normalize(text: str, synonyms: Optional[dict] = None) -> str:
+    """Lower-cased words, with acceptable synonyms replaced by their canonical form."""
+    text = " ".join(_WORD.findall((text or "").lower()))
+    for pattern, canonical in _synonym_patterns(synonyms):
+        text = pattern.sub(canonical, text)
+    return text
+
+
+def char_ngrams(text: str) -> List[str]:
+    grams = []
+    for word in text.split():
+        padded = f" {word} "
+        for n in NGRAM_SIZES:
+            grams.extend(padded[i:i + n] for i in range(max(1, len(padded) - n + 1)))
+    return grams
+
+
+def _visual_banks() -> list:
+    """Current snapshots of the banks behind the visual question types."""
+    from services.sections import BUCKET_VISUAL, SECTION_TYPES   # sections imports grading, which imports us
+
+    names = sorted({spec.bank_file for spec in SECTION_TYPES.values() if spec.bucket == BUCKET_VISUAL})
+    return [snapshot for snapshot in map(bank_registry.get, names) if snapshot is not None]
+
+
+def _model() -> Tuple[Tuple[str, ...], TfidfModel]:
+    """Character n-gram TF-IDF over every reference and alternative answer in
+    the visual banks, refitted only when one of those banks changes."""
+    global _fitted
+    snapshots = _visual_banks()
+    digests = tuple(snapshot.digest for snapshot in snapshots)
+    if digests != _fitted[0]:
+        documents = []
+        for snapshot in snapshots:
+            for item in snapshot.items:
+                reference = item.get("reference_context") or item.get("correct_answer") or ""
+                for text in [reference, *item.get("alternative_answers", [])]:
+                    if isinstance(text, str) and text.strip():
+                        documents.append(normalize(text, item.get("acceptable_synonyms")))
+        _fitted = (digests, TfidfModel(documents, analyzer=char_ngrams))
+    return _fitted
+
+
+@lru_cache(maxsize=4096)
+def _vector(text: str, digests: Tuple[str, ...]) -> Vector:
+    """Vector of normalized text (digests key the cache to one model fit)."""
+    return _fitted[1].vector(text)
+
+
+def score(student_text: str, reference: str, alternatives: Optional[Sequence[str]] = None,
+          synonyms: Optional[dict] = None) -> float:
+    """Best cosine similarity (0-1) between the answer and any accepted caption."""
+    digests = _model()[0]
+    answer = _vector(normalize(student_text, synonyms), digests)
+    if not answer:
+        return 0.0
+    targets = [reference or ""] + [str(a) for a in (alternatives or [])]
+    return max(cosine(answer, _vector(normalize(t, synonyms), digests)) for t in targets)
+
+
+# ─── Calibration ─────────────────────────────────────────────────────────────
+def load_calibration() -> Dict[str, dict]:
+    """{question_type: thresholds} from CASCADE_CALIBRATION_PATH, re-read when the file changes."""
+    global _calibration
+    try:
+        mtime = os.stat(settings.CASCADE_CALIBRATION_PATH).st_mtime_ns
+    except OSError:
+        return {}
+    if mtime != _calibration[0]:
+        try:
+            with open(settings.CASCADE_CALIBRATION_PATH) as f:
+                _calibration = (mtime, json.load(f).get("types", {}))
+        except (OSError, ValueError) as e:
+            print(f"[CASCADE] Could not read {settings.CASCADE_CALIBRATION_PATH}: {e}")
+            _calibration = (mtime, {})
+    return _calibration[1]
+
+
+def decide(thresholds: Optional[dict], local_score: float) -> Optional[str]:
+    """"Bad" / "Good" where the thresholds are confident, None for the uncertain band."""
+    if not thresholds:
+        return None
+    bad_below, good_from = thresholds.get("bad_below"), thresholds.get("good_from")
+    if bad_below is not None and local_score < bad_below:
+        return "Bad"
+    if good_from is not None and local_score >= good_from:
+        return "Good"
+    return None
+
+
+def _band_edge(samples: List[Sample], label: str, target: float, min_samples: int) -> Optional[int]:
+    """How many leading samples form the widest band labelled `label` at least
+    `target` of the time (None if no band of min_samples qualifies). A band
+    never splits samples with equal scores."""
+    best, agreeing = None, 0
+    for i, (value, rank) in enumerate(samples):
+        agreeing += rank == label
+        size = i + 1
+        if size < len(samples) and samples[i + 1][0] == value:
+            continue
+        if size >= min_samples and agreeing / size >= target:
+            best = size
+    return best
+
+
+def fit_thresholds(samples: Iterable[Sample], target: Optional[float] = None,
+                   min_samples: Optional[int] = None) -> dict:
+    """Widest Bad band at the bottom and Good band at the top of the score
+    range that agree with Claude's rank at least `target` of the time."""
+    target = settings.CASCADE_TARGET_AGREEMENT if target is None else target
+    min_samples = settings.CASCADE_MIN_SAMPLES if min_samples is None else min_samples
+    ordered = sorted(samples)
+    thresholds = {"bad_below": None, "good_from": None}
+
+    size = _band_edge(ordered, "Bad", target, min_samples)
+    if size:
+        upper = ordered[size][0] if size < len(ordered) else ordered[-1][0] + 1e-6
+        thresholds["bad_below"] = round((ordered[size - 1][0] + upper) / 2, 6)
+
+    descending = ordered[::-1]
+    size = _band_edge(descending, "Good", target, min_samples)
+    if size:
+        lower = descending[size][0] if size < len(descending) else descending[-1][0] - 1e-6
+        thresholds["good_from"] = round((descending[size - 1][0] + lower) / 2, 6)
+
+    if None not in thresholds.values() and thresholds["good_from"] < thresholds["bad_below"]:
+        thresholds["good_from"] = thresholds["bad_below"]
+    return thresholds
+
+
+def evaluate(samples: Iterable[Sample], thresholds: Optional[dict]) -> dict:
+    """How a set of thresholds would have done: share of answers decided
+    locally (= Claude calls saved) and their agreement with Claude's rank."""
+    samples = list(samples)
+    decided = agreed = 0
+    bands = {"Bad": [0, 0], "Good": [0, 0]}   # rank -> [decided, agreed]
+    for value, rank in samples:
+        local_rank = decide(thresholds, value)
+        if local_rank is None:
+            continue
+        decided += 1
+        agreed += local_rank == rank
+        bands[local_rank][0] += 1
+        bands[local_rank][1] += local_rank == rank
+    return {
+        "samples": len(samples),
+        "decided_locally": decided,
+        "calls_saved": round(decided / len(samples), 4) if samples else 0.0,
+        "agreement": round(agreed / decided, 4) if decided else None,
+        "bands": {rank: {"decided": d, "agreement": round(a / d, 4) if d else None}
+                  for rank, (d, a) in bands.items()},
+    }
@@ -0,0 +1,128 @@
+"""
+Pre-generated paper pool for template tests.
+
+Sampling, shuffling and transforming a full template paper is the bulk of the
+work behind GET /exam/tests/{id}. The pool keeps PAPER_POOL_SIZE ready-made
+generated_questions payloads per active template test, so starting a test is
+just "pop a paper + insert the ExamSession". A background task started in the
+FastAPI lifespan tops the pools up after every take.
+
+A test becomes "active" the first time a candidate starts it in this process,
+and is dropped again after PAPER_POOL_IDLE_SECONDS without a take. Papers are
+tagged with the test's template and the digests of the banks it draws from,
+so editing a template or a bank file silently discards stale papers.
+
+Papers are generated in a worker thread, off the event loop. Their items
+count as served (services/exposure.py) only when a paper is handed out;
+discarded papers give their serves back.
+"""
+import asyncio
+import json
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+from config import settings
+from services.banks import bank_registry
+from services.exposure import ExposureKey, exposure_tracker
+from services.generator import QuestionBankService
+from services.sections import get_section
+
+Paper = List[Dict[str, Any]]
+
+
+def _paper_key(template_config: List[Dict[str, Any]]) -> Tuple[str, Tuple[str, ...]]:
+    """Identifies what a pooled paper was generated from."""
+    template = json.dumps(template_config, sort_keys=True)
+    digests = []
+    for section in template_config:
+        spec = get_section(section.get("type"))
+        snapshot = bank_registry.get(spec.bank_file) if spec else None
+        digests.append(snapshot.digest if snapshot else "")
+    return template, tuple(digests)
+
+
+def _generate(template_config: List[Dict[str, Any]]) -> Tuple[Paper, List[ExposureKey]]:
+    """One pool paper and the serves it will record once handed out (runs in a thread)."""
+    with exposure_tracker.deferred() as served:
+        paper = QuestionBankService.generate_paper(template_config)
+    return paper, served
+
+
+class _TestPool:
+    def __init__(self, template_config: List[Dict[str, Any]], key):
+        self.template_config = template_config
+        self.key = key
+        self.papers: Deque[Tuple[Paper, List[ExposureKey]]] = deque()
+        self.last_used = time.monotonic()
+
+    def discard(self):
+        while self.papers:
+            exposure_tracker.release(self.papers.popleft()[1])
+
+
+class PaperPool:
+    def __init__(self, size: int, idle_seconds: int):
+        self.size = size
+        self.idle_seconds = idle_seconds
+        self._pools: Dict[int, _TestPool] = {}
+        self._wakeup: Optional[asyncio.Event] = None
+
+    def take(self, test_id: int, template_config: List[Dict[str, Any]]) -> Optional[Paper]:
+        """Pop a ready paper for this test, or None if the pool is empty.
+        Registers the test for background top-up either way."""
+        if self.size <= 0:
+            return None
+
+        key = _paper_key(template_config)
+        pool = self._pools.get(test_id)
+        if pool is None or pool.key != key:
+            # New test, edited template or reloaded bank — start a fresh pool
+            if pool is not None:
+                pool.discard()
+            pool = _TestPool(template_config, key)
+            self._pools[test_id] = pool
+        pool.last_used = time.monotonic()
+
+        paper = None
+        if pool.papers:
+            paper, served = pool.papers.popleft()
+            exposure_tracker.confirm(served)
+        if self._wakeup is not None:
+            self._wakeup.set()
+        return paper
+
+    def stats(self) -> Dict[int, int]:
+        return {test_id: len(pool.papers) for test_id, pool in self._pools.items()}
+
+    async def _fill_once(self):
+        now = time.monotonic()
+        for test_id, pool in list(self._pools.items()):
+            if now - pool.last_used > self.idle_seconds:
+                self._pools.pop(test_id, None)
+                pool.discard()
+                continue
+            while len(pool.papers) < self.size and self._pools.get(test_id) is pool:
+                # Sampling and transforming is CPU work — keep it off the event loop
+                paper, served = await asyncio.to_thread(_generate, pool.template_config)
+                if self._pools.get(test_id) is pool:
+                    pool.papers.append((paper, served))
+                else:
+                    exposure_tracker.release(served)   # pool replaced meanwhile
+
+    async def run(self):
+        """Background filler loop — started from the FastAPI lifespan."""
+        self._wakeup = asyncio.Event()
+        while True:
+            try:
+                await self._fill_once()
+            except Exception as e:
+                print(f"[PAPER POOL] Fill error: {e}")
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=30)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+
+paper_pool = PaperPool(size=settings.PAPER_POOL_SIZE, idle_seconds=settings.PAPER_POOL_IDLE_SECONDS)
@@ -0,0 +1,315 @@
+"""
+Versioned prompt templates for the AI graders.
+
+Each template is a static system block — the rubric, identical on every call
+and marked cacheable so Claude's prompt cache can reuse the prefix — plus a
+small per-answer user block rendered with str.format. The grade comes back
+through a forced `submit_grade` tool call whose input schema is the
+template's pydantic output model, so replies are validated instead of
+regex-parsed (ai_engine._call_grader). System blocks and tool definitions
+are built once at import.
+
+Bump a template's version whenever its wording changes: the version is part
+of the response-cache key (services/response_cache.py), so grades produced
+under the old wording are not served again.
+"""
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Any, Dict, List, Literal, Tuple, Type
+
+from pydantic import BaseModel, Field
+
+GRADE_TOOL = "submit_grade"
+
+
+# ─── Output schemas ──────────────────────────────────────────────────────────
+class VisualGrade(BaseModel):
+    """15-mark video / image description rubric."""
+    grammar_structure_score: float = Field(ge=0, le=4)
+    vocabulary_word_choice_score: float = Field(ge=0, le=4)
+    clarity_meaning_score: float = Field(ge=0, le=3)
+    instruction_compliance_score: Literal[0, 2]
+    spelling_formatting_score: float = Field(ge=0, le=2)
+    total_score: float = Field(ge=0, le=15)
+    passed: bool
+    feedback: str
+    grade_justification: str = ""
+
+
+class ReadingGrade(BaseModel):
+    """15-mark reading summary rubric."""
+    key_idea_coverage_score: float = Field(ge=0, le=5)
+    paraphrasing_score: float = Field(ge=0, le=4)
+    grammar_structure_score: float = Field(ge=0, le=3)
+    coherence_flow_score: float = Field(ge=0, le=2)
+    vocabulary_precision_score: float = Field(ge=0, le=1)
+    total_score: float = Field(ge=0, le=15)
+    passed: bool
+    key_ideas_found: List[str] = []
+    key_ideas_missing: List[str] = []
+    feedback: str
+    grade_justification: str = ""
+
+
+@dataclass(frozen=True)
+class PromptTemplate:
+    name: str
+    version: int
+    system: str
+    user: str
+    output_model: Type[BaseModel]
+    max_tokens: int   # room for the tool call plus feedback text
+    # Pre-rendered Messages API system parameter (cache breakpoint after the rubric)
+    system_blocks: List[Dict[str, Any]] = field(init=False, repr=False, compare=False)
+    # Pre-rendered grade tool and the tool_choice forcing it
+    tools: List[Dict[str, Any]] = field(init=False, repr=False, compare=False)
+    tool_choice: Dict[str, Any] = field(init=False, repr=False, compare=False)
+
+    def __post_init__(self):
+        object.__setattr__(self, "system_blocks", [
+            {"type": "text", "text": self.system, "cache_control": {"type": "ephemeral"}}
+        ])
+        object.__setattr__(self, "tools", [{
+            "name": GRADE_TOOL,
+            "description": "Record the grade for the answer, following the rubric.",
+            "input_schema": self.output_model.model_json_schema(),
+        }])
+        object.__setattr__(self, "tool_choice", {"type": "tool", "name": GRADE_TOOL})
+
+    def validate(self, data: Any) -> Dict[str, Any]:
+        """The grade as a plain dict; raises pydantic.ValidationError on schema violations."""
+        return self.output_model.model_validate(data).model_dump()
+
+    def render(self, **fields) -> str:
+        """The per-answer user message."""
+        return self.user.format(**fields)
+
+
+PROMPTS: Dict[str, PromptTemplate] = {}
+
+
+def register(template: PromptTemplate) -> PromptTemplate:
+    PROMPTS[template.name] = template
+    return template
+
+
+def get_prompt(name: str) -> PromptTemplate:
+    return PROMPTS[name]
+
+
+VIDEO_STRICT = register(PromptTemplate(
+    name="video_strict",
+    version=3,
+    output_model=VisualGrade,
+    max_tokens=700,
+    system="""You are a STRICT English teacher grading a proficiency test. You do NOT give participation points. You FAIL students who deserve to fail.
+Each message gives you a VIDEO DESCRIPTION, the CORRECT ANSWER and the USER'S ANSWER to grade.
+
+TOTAL MARKS: 15
+
+BE BRUTALLY HONEST. This is NOT about being nice - it's about English proficiency.
+
+CRITICAL RULES:
+1. If the main content is WRONG (wrong object/action), maximum possible score is 6/15 (FAIL)
+2. If they're vague when they should be specific, it shows they DON'T understand
+3. Multiple spelling errors = they can't spell = LOW marks
+4. Missing key details = they didn't pay attention = LOW marks
+5. "Close enough" is NOT acceptable in language learning
+
+EVALUATION CRITERIA:
+
+1. GRAMMAR & STRUCTURE (4 marks):
+   - Missing ONE article (a, an, the) = -1 mark
+   - Wrong preposition = -1 mark
+   - Incomplete sentence = -2 marks
+   - Multiple grammar errors = 0 marks
+
+2. VOCABULARY & WORD CHOICE (4 marks):
+   - Did they identify the CORRECT objects from the video?
+   - Generic words (stuff, things, outside) instead of specific ones = -2 marks minimum
+   - Wrong object entirely = 0 marks
+   - Vague = Poor English = Low marks
+
+3. CLARITY & MEANING (3 marks):
+   - Does it MATCH the correct answer's meaning?
+   - Missing key descriptors = -1 mark each
+   - If answer is vague/unclear/wrong = 0-1 marks maximum
+
+4. INSTRUCTION COMPLIANCE (2 marks):
+   - MUST start with EXACTLY: "walk to" OR "turn right to" OR "turn left to"
+   - "walking", "walked", "go to" = WRONG = 0 marks
+   - All or nothing: 2 marks or 0 marks
+
+5. SPELLING & FORMATTING (2 marks):
+   - ONE spelling error = -1 mark
+   - TWO+ spelling errors = 0 marks
+
+SCORING PHILOSOPHY:
+- If they got the main content WRONG = FAIL (below 8/15)
+- If they were vague/generic = LOW marks (below 10/15)
+- Only give high marks (13+) if answer is truly GOOD
+- Most students should score 6-12, NOT 12-15
+
+Report the grade with these fields:
+{
+    "grammar_structure_score": 0-4,
+    "vocabulary_word_choice_score": 0-4,
+    "clarity_meaning_score": 0-3,
+    "instruction_compliance_score": 0 or 2,
+    "spelling_formatting_score": 0-2,
+    "total_score": 0-15,
+    "passed": true or false,
+    "feedback": "Specific, constructive feedback explaining deductions",
+    "grade_justification": "Brief breakdown of why each score was given"
+}""",
+    user="""VIDEO DESCRIPTION: {context}
+CORRECT ANSWER: "{correct}"
+USER'S ANSWER: "{answer}"
+
+Grade the USER'S ANSWER now.""",
+))
+
+IMAGE_STRICT = register(PromptTemplate(
+    name="image_strict",
+    version=3,
+    output_model=VisualGrade,
+    max_tokens=700,
+    system="""You are a STRICT English teacher grading a proficiency test. You do NOT give participation points.
+Each message gives you an IMAGE DESCRIPTION, the CORRECT ANSWER and the USER'S ANSWER to grade.
+
+TOTAL MARKS: 15
+
+EVALUATION CRITERIA:
+
+1. GRAMMAR & STRUCTURE (4 marks):
+   - Missing articles (a, an, the) = -1 mark each
+   - Wrong preposition/verb form = -1 mark
+   - Incomplete/run-on sentence = -2 marks
+
+2. VOCABULARY & OBJECT IDENTIFICATION (4 marks):
+   - Did they identify the CORRECT objects in the image?
+   - Wrong object = 0 marks
+   - Vague description (thing, stuff) = -2 marks
+   - Missing key objects = -1 mark each
+
+3. CLARITY & DETAIL (3 marks):
+   - Does description match the image accurately?
+   - Missing important details = -1 mark each
+   - Confusing/unclear = 0-1 marks
+
+4. INSTRUCTION COMPLIANCE (2 marks):
+   - Must follow the exact format requested
+   - Binary: 2 marks or 0 marks
+
+5. SPELLING & FORMATTING (2 marks):
+   - ONE spelling error = -1 mark
+   - TWO+ spelling errors = 0 marks
+
+STRICT RULES:
+- Wrong content = maximum 6/15
+- Vague answers = maximum 10/15
+- Multiple errors = FAIL
+
+Report the grade with these fields:
+{
+    "grammar_structure_score": 0-4,
+    "vocabulary_word_choice_score": 0-4,
+    "clarity_meaning_score": 0-3,
+    "instruction_compliance_score": 0 or 2,
+    "spelling_formatting_score": 0-2,
+    "total_score": 0-15,
+    "passed": true or false,
+    "feedback": "Specific feedback explaining deductions",
+    "grade_justification": "Brief breakdown of scores"
+}""",
+    user="""IMAGE DESCRIPTION: {context}
+CORRECT ANSWER: "{correct}"
+USER'S ANSWER: "{answer}"
+
+Grade the USER'S ANSWER now.""",
+))
+
+READING_STRICT = register(PromptTemplate(
+    name="reading_strict",
+    version=3,
+    output_model=ReadingGrade,
+    max_tokens=900,
+    system="""You are a STRICT English teacher grading a reading comprehension summary. Be harsh but fair.
+Each message gives you the ORIGINAL PASSAGE (first 500 characters), a REFERENCE SUMMARY, the KEY IDEAS TO COVER and the USER'S SUMMARY to grade.
+
+TOTAL MARKS: 15
+
+EVALUATION CRITERIA:
+
+1. KEY IDEA COVERAGE (5 marks):
+   - Award 1 mark for each key idea correctly mentioned
+   - Missing key ideas = direct mark deduction
+   - Added incorrect information = -1 mark
+
+2. PARAPHRASING QUALITY (4 marks):
+   - Direct copy-paste = 0 marks (AUTOMATIC FAIL for this section)
+   - Good paraphrasing with own words = 4 marks
+   - Partial paraphrasing = 2-3 marks
+   - Mostly copied = 0-1 marks
+
+3. GRAMMAR & STRUCTURE (3 marks):
+   - Complete, well-formed sentences = 3 marks
+   - Minor errors = 2 marks
+   - Multiple errors = 1 mark
+   - Major errors = 0 marks
+
+4. COHERENCE & FLOW (2 marks):
+   - Logical order, smooth transitions = 2 marks
+   - Choppy but understandable = 1 mark
+   - Disorganized = 0 marks
+
+5. VOCABULARY PRECISION (1 mark):
+   - Appropriate academic vocabulary = 1 mark
+   - Basic/repetitive vocabulary = 0 marks
+
+STRICT RULES:
+- Copy-paste from passage = maximum 5/15
+- Missing half the key ideas = maximum 8/15
+- Incoherent summary = maximum 6/15
+
+Report the grade with these fields:
+{
+    "key_idea_coverage_score": 0-5,
+    "paraphrasing_score": 0-4,
+    "grammar_structure_score": 0-3,
+    "coherence_flow_score": 0-2,
+    "vocabulary_precision_score": 0-1,
+    "total_score": 0-15,
+    "passed": true or false,
+    "key_ideas_found": ["list of key ideas student mentioned"],
+    "key_ideas_missing": ["list of key ideas student missed"],
+    "feedback": "Specific feedback on summary quality",
+    "grade_justification": "Brief breakdown of scores"
+}""",
+    user="""ORIGINAL PASSAGE: "{passage}..."
+REFERENCE SUMMARY: "{reference}"
+KEY IDEAS TO COVER: {key_ideas}
+USER'S SUMMARY: "{answer}"
+
+Grade the USER'S SUMMARY now.""",
+))
+
+
+# ─── Packed grading (AI_PACKED_VISUAL_GRADING) ───────────────────────────────
+# Several answers of one candidate in one request; each question names the
+# rubric (one of the templates above) it is graded against.
+PACKED_HEADER = """You grade several answers from ONE candidate in a single pass. Each question below says which RUBRIC applies. Grade every question independently and exactly as its rubric instructs — do not let one answer influence another."""
+
+PACKED_FOOTER = """RESPONSE FORMAT (replaces the output instruction inside each rubric):
+Output ONLY a JSON array, no other text, with exactly one object per question. Each object is the JSON object its rubric asks for, plus "question_id" set to the question's label:
+[{"question_id": "Q1", ...}, {"question_id": "Q2", ...}]"""
+
+
+@lru_cache(maxsize=32)
+def packed_system_blocks(rubrics: Tuple[str, ...]) -> List[Dict[str, Any]]:
+    """System block for a packed request over the given rubric texts (RUBRIC 1..n)."""
+    sections = [PACKED_HEADER]
+    for n, rubric in enumerate(rubrics, start=1):
+        sections.append(f"=== RUBRIC {n} ===\n{rubric}")
+    sections.append(PACKED_FOOTER)
+    return [{"type": "text", "text": "\n\n".join(sections), "cache_control": {"type": "ephemeral"}}]
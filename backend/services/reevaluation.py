@@ -0,0 +1,351 @@
+"""
+Re-evaluation of AI-graded questions — one result, or a whole test in bulk.
+
+regrade_result() re-runs the AI graders (video, image, reading) on a stored
+breakdown using the candidate's saved answers; MCQ, jumble and typing are
+rule-based and left alone. POST /admin/results/{id}/re-evaluate uses it
+directly.
+
+POST /admin/tests/{id}/re-evaluate creates a reevaluation_runs row and
+ReevaluationRunner works through it in the background:
+
+  1. batching — dry-run regrade_result() over every graded result under
+     ai_engine.planning_requests() to collect the unique Claude requests
+     (duplicate answers collapse to one cache key), drop those already in
+     the response cache, submit the rest through the batch provider
+     (services/batch_grading.py) in REEVAL_BATCH_SIZE batches and drain
+     each finished batch into the response cache.
+  2. writing  — regrade_result() again, REEVAL_CHUNK_SIZE results at a time;
+     every AI call is now a cache hit (failed batch items are graded live),
+     and each chunk is written in one transaction together with the cursor.
+
+The run row is the checkpoint: submitted / drained batch ids and the last
+result id written. After a crash the run is resumed at startup — pending
+batches are drained again, anything still uncached is re-submitted, and
+write-back continues after the cursor. A lease (locked_until, renewed at
+each checkpoint) keeps two processes from working on the same run.
+"""
+import asyncio
+import copy
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import or_, update
+from sqlalchemy.future import select
+
+from config import settings
+from database import AsyncSessionLocal
+from models import ExamSession, ReevaluationRun, TestResult
+from services import bank_versions
+from services.ai_engine import PlannedRequest, planning_requests
+from services.batch_grading import get_batch_provider
+from services.grading import run_ai_grader
+from services.response_cache import response_cache
+from services.results import recompute_section_summary, unwrap_breakdown
+from services.sections import AI_GRADED_TYPES, get_question_spec
+from services.session_store import expand_paper
+
+ACTIVE_STATUSES = ("queued", "batching", "writing")
+_MAX_STORED_ERRORS = 200
+
+
+def _utcnow() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+async def regrade_result(raw_breakdown: Any, session: ExamSession) -> Dict[str, Any]:
+    """
+    Re-grades the AI-graded questions of a stored breakdown (mutated in place).
+    Returns {"ai_breakdown", "total_score", "re_evaluated", "errors"}.
+    """
+    questions, section_summary, is_v2 = unwrap_breakdown(raw_breakdown)
+
+    answers = session.answers or {}
+    # Build question map: temp_id -> full question object
+    await bank_versions.load(session.generated_questions)
+    question_map = {q["temp_id"]: q for q in expand_paper(session.generated_questions) if "temp_id" in q}
+
+    to_grade = []
+    errors = []
+    for item in questions:
+        q_type = item.get("type", "")
+        q_id   = item.get("question_id")
+
+        # Only re-evaluate AI-graded types
+        if q_type not in AI_GRADED_TYPES:
+            continue
+
+        student_text = str(answers.get(str(q_id), answers.get(q_id, ""))).strip()
+        if not student_text:
+            item["student_score"] = 0
+            item.pop("override_score", None)
+            continue
+
+        q_data = question_map.get(q_id, {})
+        if not q_data or q_data.get("missing_item"):
+            # Re-grading against an empty reference would overwrite a real score
+            errors.append(f"Q{q_id} ({q_type}): question no longer available in the bank — kept stored grade")
+            continue
+        to_grade.append((item, get_question_spec(q_type).grade(q_data, student_text, session)))
+
+    # Claude calls run concurrently, bounded by AI_GRADING_CONCURRENCY
+    outcomes = await asyncio.gather(
+        *(run_ai_grader(grade_coro) for _, grade_coro in to_grade), return_exceptions=True
+    )
+    re_evaluated = 0
+    for (item, _), grade_data in zip(to_grade, outcomes):
+        if isinstance(grade_data, Exception):
+            errors.append(f"Q{item.get('question_id')} ({item.get('type', '')}): {str(grade_data)}")
+            continue
+        item["student_score"] = round(grade_data.get("score", 0), 1)
+        item["ai_feedback"]   = grade_data.get("breakdown", {})
+        item.pop("override_score", None)
+        re_evaluated += 1
+
+    # Recompute section_summary and total
+    if is_v2:
+        section_summary, new_total = recompute_section_summary(questions)
+        ai_breakdown = {"version": 2, "section_summary": section_summary, "questions": questions}
+    else:
+        new_total = sum(item.get("override_score", item.get("student_score", 0)) for item in questions)
+        ai_breakdown = questions
+
+    return {"ai_breakdown": ai_breakdown, "total_score": new_total,
+            "re_evaluated": re_evaluated, "errors": errors}
+
+
+async def _load_chunk(test_id: int, after_id: int, limit: int) -> List[Tuple[TestResult, Optional[ExamSession]]]:
+    """Next graded results of a test (by id) with each candidate's latest completed session."""
+    async with AsyncSessionLocal() as db:
+        results = (await db.execute(
+            select(TestResult)
+            .where(TestResult.test_id == test_id)
+            .where(TestResult.status.in_(("graded", "re-evaluated")))
+            .where(TestResult.id > after_id)
+            .order_by(TestResult.id)
+            .limit(limit)
+        )).scalars().all()
+        if not results:
+            return []
+        sessions = (await db.execute(
+            select(ExamSession)
+            .where(ExamSession.test_id == test_id)
+            .where(ExamSession.user_id.in_({r.user_id for r in results}))
+            .where(ExamSession.is_completed == True)
+            .order_by(ExamSession.started_at)
+        )).scalars().all()
+    latest = {s.user_id: s for s in sessions}   # ordered by started_at: last one wins
+    return [(r, latest.get(r.user_id)) for r in results]
+
+
+def run_progress(run: ReevaluationRun) -> Dict[str, Any]:
+    """Progress summary returned by the admin endpoints."""
+    return {
+        "run_id": run.id,
+        "test_id": run.test_id,
+        "status": run.status,
+        "provider": run.provider,
+        "results": {"total": run.total_results, "written": run.written_results},
+        "requests": {
+            "total": run.total_requests,
+            "already_cached": run.cached_requests,
+            "batched": run.total_requests - run.cached_requests,
+            "completed": run.completed_requests,
+        },
+        "batches": {"submitted": len(run.batch_ids or []), "drained": len(run.drained_batch_ids or [])},
+        "progress_pct": round(100 * run.written_results / run.total_results, 1) if run.total_results else
+                        (100.0 if run.status == "done" else 0.0),
+        "errors": (run.errors or [])[-20:],
+        "error_count": len(run.errors or []),
+        "created_at": run.created_at,
+        "finished_at": run.finished_at,
+    }
+
+
+class ReevaluationRunner:
+    """Background tasks working through reevaluation_runs (started from the FastAPI lifespan)."""
+
+    def __init__(self):
+        self._tasks: Dict[int, asyncio.Task] = {}
+
+    def launch(self, run_id: int):
+        if run_id not in self._tasks:
+            task = asyncio.create_task(self._run(run_id))
+            self._tasks[run_id] = task
+            task.add_done_callback(lambda _: self._tasks.pop(run_id, None))
+
+    async def resume(self) -> int:
+        """Pick up runs interrupted by a crash or restart."""
+        async with AsyncSessionLocal() as db:
+            run_ids = (await db.execute(
+                select(ReevaluationRun.id)
+                .where(ReevaluationRun.status.in_(ACTIVE_STATUSES))
+                .where(or_(ReevaluationRun.locked_until.is_(None), ReevaluationRun.locked_until < _utcnow()))
+            )).scalars().all()
+        for run_id in run_ids:
+            self.launch(run_id)
+        return len(run_ids)
+
+    async def stop(self):
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    # ── checkpointing ────────────────────────────────────────────────────────
+    async def _claim(self, run_id: int) -> Optional[ReevaluationRun]:
+        now = _utcnow()
+        async with AsyncSessionLocal() as db:
+            claimed = await db.execute(
+                update(ReevaluationRun)
+                .where(ReevaluationRun.id == run_id)
+                .where(ReevaluationRun.status.in_(ACTIVE_STATUSES))
+                .where(or_(ReevaluationRun.locked_until.is_(None), ReevaluationRun.locked_until < now))
+                .values(locked_until=now + timedelta(seconds=settings.REEVAL_LEASE_SECONDS))
+            )
+            await db.commit()
+            if claimed.rowcount != 1:
+                return None
+            return (await db.execute(select(ReevaluationRun).where(ReevaluationRun.id == run_id))).scalars().first()
+
+    async def _checkpoint(self, run: ReevaluationRun, db=None, **values):
+        """Persist progress on the run row and renew the lease (in `db`'s transaction if given)."""
+        for name, value in values.items():
+            setattr(run, name, value)
+        values["locked_until"] = _utcnow() + timedelta(seconds=settings.REEVAL_LEASE_SECONDS)
+        stmt = update(ReevaluationRun).where(ReevaluationRun.id == run.id).values(**values)
+        if db is not None:
+            await db.execute(stmt)
+            return
+        async with AsyncSessionLocal() as session:
+            await session.execute(stmt)
+            await session.commit()
+
+    def _add_errors(self, run: ReevaluationRun, errors: List[str]) -> List[str]:
+        return ((run.errors or []) + errors)[-_MAX_STORED_ERRORS:]
+
+    # ── phases ───────────────────────────────────────────────────────────────
+    async def _plan(self, run: ReevaluationRun) -> Tuple[Dict[str, PlannedRequest], int]:
+        """Unique Claude requests (by cache key) a re-grade of every result needs, and the result count."""
+        requests: Dict[str, PlannedRequest] = {}
+        total_results = 0
+        cursor = 0
+        while True:
+            chunk = await _load_chunk(run.test_id, cursor, settings.REEVAL_CHUNK_SIZE)
+            if not chunk:
+                break
+            cursor = chunk[-1][0].id
+            for exam_result, session in chunk:
+                total_results += 1
+                if session is None:
+                    continue
+                with planning_requests() as plan:
+                    await regrade_result(copy.deepcopy(exam_result.ai_breakdown), session)
+                requests.update(plan)
+            await self._checkpoint(run)   # renew the lease on large tests
+        return requests, total_results
+
+    async def _drain(self, run: ReevaluationRun, provider, batch_id: str):
+        """Wait for a batch to end and store its successful replies in the response cache."""
+        while not await provider.is_done(batch_id):
+            await self._checkpoint(run)
+            await asyncio.sleep(settings.REEVAL_POLL_SECONDS)
+        replies: Dict[str, dict] = {}
+        async for custom_id, reply in provider.results(batch_id):
+            # Only complete gradings — anything else is graded live during write-back
+            if isinstance(reply, dict) and "total_score" in reply:
+                replies[custom_id] = reply
+        await response_cache.put_many(replies)
+        await self._checkpoint(
+            run,
+            drained_batch_ids=(run.drained_batch_ids or []) + [batch_id],
+            completed_requests=run.completed_requests + len(replies),
+        )
+        print(f"[REEVAL] Run {run.id}: batch {batch_id} drained ({len(replies)} gradings cached)")
+
+    async def _batch(self, run: ReevaluationRun):
+        provider = get_batch_provider(run.provider)
+        # Resume: batches submitted before a restart still hold paid-for results
+        for batch_id in run.batch_ids or []:
+            if batch_id not in (run.drained_batch_ids or []):
+                await self._drain(run, provider, batch_id)
+
+        requests, total_results = await self._plan(run)
+        missing = await response_cache.missing(list(requests))
+        await self._checkpoint(
+            run, total_results=total_results, total_requests=len(requests),
+            cached_requests=max(len(requests) - len(missing) - run.completed_requests, 0),
+        )
+        print(f"[REEVAL] Run {run.id}: {total_results} results, {len(requests)} unique AI requests, "
+              f"{len(missing)} to grade via '{provider.name}'")
+
+        submitted = []
+        for start in range(0, len(missing), settings.REEVAL_BATCH_SIZE):
+            batch = {key: requests[key] for key in missing[start:start + settings.REEVAL_BATCH_SIZE]}
+            batch_id = await provider.submit(batch)
+            submitted.append(batch_id)
+            await self._checkpoint(run, batch_ids=(run.batch_ids or []) + [batch_id])
+        for batch_id in submitted:
+            await self._drain(run, provider, batch_id)
+
+    async def _write_back(self, run: ReevaluationRun):
+        while True:
+            chunk = await _load_chunk(run.test_id, run.last_result_id, settings.REEVAL_CHUNK_SIZE)
+            if not chunk:
+                return
+            # Grade with no connection held (all cache hits unless a batch item failed)
+            updates, errors = [], []
+            for exam_result, session in chunk:
+                if session is None:
+                    errors.append(f"Result {exam_result.id}: exam session not found")
+                    continue
+                outcome = await regrade_result(exam_result.ai_breakdown, session)
+                updates.append((exam_result.id, outcome))
+                errors.extend(f"Result {exam_result.id} {e}" for e in outcome["errors"])
+
+            async with AsyncSessionLocal() as db:
+                for result_id, outcome in updates:
+                    await db.execute(
+                        update(TestResult)
+                        .where(TestResult.id == result_id)
+                        .values(ai_breakdown=outcome["ai_breakdown"], total_score=outcome["total_score"],
+                                status="re-evaluated")
+                    )
+                await self._checkpoint(
+                    run, db,
+                    last_result_id=chunk[-1][0].id,
+                    written_results=run.written_results + len(chunk),
+                    errors=self._add_errors(run, errors),
+                )
+                await db.commit()
+
+    async def _run(self, run_id: int):
+        run = await self._claim(run_id)
+        if run is None:
+            return   # finished, or another process holds the lease
+        try:
+            if run.status in ("queued", "batching"):
+                await self._checkpoint(run, status="batching")
+                await self._batch(run)
+                await self._checkpoint(run, status="writing")
+            await self._write_back(run)
+            await self._checkpoint(run, status="done", finished_at=datetime.now(timezone.utc))
+            print(f"[REEVAL] Run {run.id} done: {run.written_results} results re-evaluated")
+        except asyncio.CancelledError:
+            # Shutdown — release the lease so the next startup resumes right away
+            await asyncio.shield(self._release(run.id))
+            raise
+        except Exception as e:
+            print(f"[REEVAL ERROR] Run {run.id}: {e}")
+            await self._checkpoint(run, status="failed", errors=self._add_errors(run, [f"Run failed: {e}"]),
+                                   finished_at=datetime.now(timezone.utc))
+            return
+        await self._release(run.id)
+
+    async def _release(self, run_id: int):
+        async with AsyncSessionLocal() as db:
+            await db.execute(update(ReevaluationRun).where(ReevaluationRun.id == run_id).values(locked_until=None))
+            await db.commit()
+
+
+reevaluation_runner = ReevaluationRunner()
@@ -0,0 +1,167 @@
+"""
+Persistent cache of Claude grading responses.
+
+Re-evaluations, queue retries and the many identical short answers a cohort
+gives to the same robot video would otherwise pay a full API round-trip for
+work that was already done. Entries are keyed by a sha256 of
+(model, prompt template, template version, normalized inputs), so changing
+the model or bumping a template version (services/prompts.py) stops old
+grades from being reused.
+
+Storage is a local SQLite file (AI_CACHE_PATH) in WAL mode, so the web
+process and grading_worker.py processes on the same host share it. Entries
+expire after AI_CACHE_TTL_SECONDS. The file is capped at AI_CACHE_MAX_ENTRIES:
+every hit refreshes an entry's last_used stamp, and writes periodically evict
+the least recently used rows beyond the cap.
+"""
+import asyncio
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from config import settings
+
+# Evict at most once every this many writes
+_EVICT_EVERY = 100
+
+
+class ResponseCache:
+    def __init__(self, path: str, max_entries: int, ttl_seconds: int):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._conn: Optional[sqlite3.Connection] = None
+        # One connection shared by the to_thread() workers
+        self._lock = threading.Lock()
+        self._writes = 0
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(model: str, template: str, version: int, inputs: Dict[str, Any]) -> str:
+        payload = json.dumps([model, template, version, inputs], sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                " key TEXT PRIMARY KEY,"
+                " value TEXT NOT NULL,"
+                " created_at REAL NOT NULL,"
+                " last_used REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS ix_responses_last_used ON responses (last_used)")
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    def _get(self, key: str) -> Optional[dict]:
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            row = conn.execute(
+                "SELECT value FROM responses WHERE key = ? AND created_at > ?",
+                (key, now - self.ttl_seconds),
+            ).fetchone()
+            if row is None:
+                return None
+            conn.execute("UPDATE responses SET last_used = ? WHERE key = ?", (now, key))
+            conn.commit()
+        return json.loads(row[0])
+
+    def _put(self, key: str, value: dict):
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            conn.execute(
+                "INSERT OR REPLACE INTO responses (key, value, created_at, last_used) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value, ensure_ascii=False), now, now),
+            )
+            self._writes += 1
+            if self._writes % _EVICT_EVERY == 1:
+                self._evict(conn, now)
+            conn.commit()
+
+    def _put_many(self, entries: Dict[str, dict]):
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            conn.executemany(
+                "INSERT OR REPLACE INTO responses (key, value, created_at, last_used) VALUES (?, ?, ?, ?)",
+                [(key, json.dumps(value, ensure_ascii=False), now, now) for key, value in entries.items()],
+            )
+            self._writes += len(entries)
+            self._evict(conn, now)
+            conn.commit()
+
+    def _missing(self, keys: List[str]) -> List[str]:
+        live_after = time.time() - self.ttl_seconds
+        present = set()
+        with self._lock:
+            conn = self._connect()
+            for start in range(0, len(keys), 500):
+                chunk = keys[start:start + 500]
+                rows = conn.execute(
+                    f"SELECT key FROM responses WHERE created_at > ? AND key IN ({','.join('?' * len(chunk))})",
+                    (live_after, *chunk),
+                ).fetchall()
+                present.update(row[0] for row in rows)
+        return [key for key in keys if key not in present]
+
+    def _evict(self, conn: sqlite3.Connection, now: float):
+        conn.execute("DELETE FROM responses WHERE created_at <= ?", (now - self.ttl_seconds,))
+        (count,) = conn.execute("SELECT COUNT(*) FROM responses").fetchone()
+        if count > self.max_entries:
+            conn.execute(
+                "DELETE FROM responses WHERE key IN "
+                "(SELECT key FROM responses ORDER BY last_used LIMIT ?)",
+                (count - self.max_entries,),
+            )
+
+    async def get(self, key: str) -> Optional[dict]:
+        """Cached response for key, or None. Cache errors count as a miss."""
+        try:
+            value = await asyncio.to_thread(self._get, key)
+        except Exception as e:
+            print(f"[AI CACHE] Lookup failed: {e}")
+            value = None
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    async def put(self, key: str, value: dict):
+        try:
+            await asyncio.to_thread(self._put, key, value)
+        except Exception as e:
+            print(f"[AI CACHE] Write failed: {e}")
+
+    async def put_many(self, entries: Dict[str, dict]):
+        """Store many responses in one transaction (bulk re-evaluation)."""
+        if entries:
+            await asyncio.to_thread(self._put_many, entries)
+
+    async def missing(self, keys: List[str]) -> List[str]:
+        """The keys with no live entry, in their original order."""
+        return await asyncio.to_thread(self._missing, keys)
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+response_cache = ResponseCache(
+    path=settings.AI_CACHE_PATH,
+    max_entries=settings.AI_CACHE_MAX_ENTRIES,
+    ttl_seconds=settings.AI_CACHE_TTL_SECONDS,
+)
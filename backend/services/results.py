@@ -0,0 +1,221 @@
+"""
+Result assembly for session (template) exams.
+
+Turns graded session questions into the breakdown entries stored in
+TestResult.ai_breakdown and computes the v2 section_summary. Shared by the
+finish endpoint, the background grading workers and the admin override /
+re-evaluation paths.
+"""
+import json
+from typing import Any, Dict, List, Tuple
+
+from services.sections import VISUAL_TYPES, TYPING_TYPES
+
+
+def session_breakdown_entry(q: Dict[str, Any], student_text: str, grade_data: Dict[str, Any]) -> Dict[str, Any]:
+    """One ai_breakdown question entry for a graded session question."""
+    grading_config = q.get("grading_config", {})
+    question_type = q["type"]
+
+    question_score = grade_data.get('score', 0)
+
+    content = q.get("content") or {}
+    question_text = content.get("question", content.get("text", content.get("content", "")))
+    content_url   = content.get("url", "")
+    passage       = content.get("passage", "")
+    options       = content.get("options", {})
+    jumble_parts  = content.get("jumble", {})
+
+    # Build human-readable correct_answer and student_answer for multi-image
+    sub_images_breakdown = None
+    if question_type == 'mcq-multi-image':
+        sub_images_gc = grading_config.get("sub_images", [])
+        content_sub_images = content.get("sub_images", [])
+        try:
+            raw_answers = json.loads(student_text) if student_text else {}
+        except:
+            raw_answers = {}
+        correct_answer = " | ".join(
+            f"Image {i+1}: {sub.get('correct_answer_text', sub.get('correct_answer', '?'))} ({sub.get('correct_answer', '?')})"
+            for i, sub in enumerate(sub_images_gc)
+        )
+        student_display_parts = []
+        sub_images_breakdown = []
+        mpi = grading_config.get("marks_per_image", 4)
+        for i, sub in enumerate(sub_images_gc):
+            chosen_key = raw_answers.get(str(i), "")
+            chosen_text = options.get(chosen_key, "") if chosen_key else "No answer"
+            correct_key = sub.get("correct_answer", "")
+            correct_text = sub.get("correct_answer_text", options.get(correct_key, ""))
+            is_correct = chosen_key.strip().lower() == correct_key.strip().lower() if chosen_key else False
+            # Get image URL from content sub_images (has the actual URL)
+            img_url = content_sub_images[i]["url"] if i < len(content_sub_images) else sub.get("url", "")
+            sub_images_breakdown.append({
+                "image_url": img_url,
+                "correct_answer": correct_key,
+                "correct_answer_text": correct_text,
+                "student_answer": chosen_key or "—",
+                "student_answer_text": chosen_text,
+                "is_correct": is_correct,
+                "score": mpi if is_correct else 0,
+                "max_marks": mpi
+            })
+            student_display_parts.append(f"Image {i+1}: {chosen_text} ({chosen_key or '—'})")
+        student_display = " | ".join(student_display_parts)
+    else:
+        correct_answer = grading_config.get("reference", grading_config.get("correct_answer", grading_config.get("original_passage", "N/A")))
+        student_display = student_text[:500] if student_text else "No answer provided"
+
+    bd_entry = {
+        "question_id": q["temp_id"],
+        "type": question_type,
+        "content_url": content_url,
+        "passage": passage,
+        "question_text": question_text[:500] if question_text else "",
+        "options": options,
+        "jumble": jumble_parts,
+        "correct_answer": correct_answer[:500] if isinstance(correct_answer, str) else str(correct_answer),
+        "student_answer": student_display,
+        "max_marks": q["marks"],
+        "student_score": question_score,
+        "ai_feedback": grade_data.get('breakdown', {})
+    }
+    if sub_images_breakdown:
+        bd_entry["sub_images_breakdown"] = sub_images_breakdown
+    return bd_entry
+
+
+def build_section_summary(breakdown: List[Dict[str, Any]]) -> Tuple[Dict[str, Any], float]:
+    """Returns (section_summary, total_score) for a freshly graded breakdown."""
+    mcq_jumble_qs = [b for b in breakdown if b['type'] not in VISUAL_TYPES and b['type'] not in TYPING_TYPES]
+    typing_qs     = [b for b in breakdown if b['type'] in TYPING_TYPES]
+    visual_qs     = [b for b in breakdown if b['type'] in VISUAL_TYPES]
+
+    # --- MCQ + Jumble section ---
+    mcq_correct = sum(b['student_score'] for b in mcq_jumble_qs)
+    mcq_max     = sum(b['max_marks']     for b in mcq_jumble_qs)
+    mcq_pct     = round((mcq_correct / mcq_max) * 100, 1) if mcq_max > 0 else 0.0
+
+    # --- Typing section ---
+    typing_tasks = []
+    for b in typing_qs:
+        fb  = b.get('ai_feedback', {})
+        wpm = fb.get('net_wpm', 0)
+        acc = fb.get('accuracy', 0)
+        typing_tasks.append({
+            'question_id': b['question_id'],
+            'type':        b['type'],
+            'wpm':         wpm,
+            'accuracy':    acc,
+            'passed':      acc >= 80
+        })
+    avg_wpm       = round(sum(t['wpm']      for t in typing_tasks) / len(typing_tasks), 1) if typing_tasks else 0
+    avg_accuracy  = round(sum(t['accuracy'] for t in typing_tasks) / len(typing_tasks), 1) if typing_tasks else 100
+    typing_passed = all(t['passed'] for t in typing_tasks) if typing_tasks else True
+    typing_fail_reasons = [
+        f"Task {i+1} accuracy {t['accuracy']}% is below 80%"
+        for i, t in enumerate(typing_tasks) if not t['passed']
+    ]
+
+    # --- Visual section ---
+    visual_ranks = []
+    for b in visual_qs:
+        fb   = b.get('ai_feedback', {})
+        rank = fb.get('rank', 'Bad')
+        visual_ranks.append({
+            'question_id': b['question_id'],
+            'type':        b['type'],
+            'rank':        rank,
+            'feedback':    fb.get('feedback', ''),
+            'passed':      rank in ('Good', 'Medium')
+        })
+    visual_passed_count = sum(1 for q in visual_ranks if q['passed'])
+    visual_total        = len(visual_ranks)
+    visual_pass_pct     = round((visual_passed_count / visual_total) * 100) if visual_total > 0 else 100
+    visual_passed = all(q['passed'] for q in visual_ranks) if visual_ranks else True
+
+    section_summary = {
+        'mcq_jumble': {
+            'score_pct':      mcq_pct,
+            'correct_marks':  mcq_correct,
+            'max_marks':      mcq_max,
+            'question_count': len(mcq_jumble_qs)
+        },
+        'typing': {
+            'tasks':          typing_tasks,
+            'avg_wpm':        avg_wpm,
+            'avg_accuracy':   avg_accuracy,
+            'benchmark_wpm':  30,
+            'passed':         typing_passed,
+            'fail_reasons':   typing_fail_reasons,
+            'question_count': len(typing_qs)
+        },
+        'visual': {
+            'questions':      visual_ranks,
+            'passed':         visual_passed,
+            'pass_pct':       visual_pass_pct,
+            'passed_count':   visual_passed_count,
+            'question_count': visual_total
+        },
+        'overall_passed': typing_passed and visual_passed
+    }
+
+    # total_score = raw MCQ+Jumble correct marks; capped at actual max to prevent >100%
+    total_score = min(mcq_correct, mcq_max)
+    return section_summary, total_score
+
+
+# ─── Stored breakdown helpers (overrides / re-evaluation) ──────────────────────
+def unwrap_breakdown(raw):
+    """Returns (questions_list, section_summary, is_v2_format)."""
+    if isinstance(raw, dict) and raw.get("version") == 2:
+        return raw.get("questions", []), raw.get("section_summary", {}), True
+    return (raw if isinstance(raw, list) else []), {}, False
+
+
+def recompute_section_summary(questions):
+    """Recomputes section_summary + MCQ% total from the questions list."""
+    mcq_qs    = [b for b in questions if b.get('type') not in VISUAL_TYPES and b.get('type') not in TYPING_TYPES]
+    typing_qs = [b for b in questions if b.get('type') in TYPING_TYPES]
+    visual_qs = [b for b in questions if b.get('type') in VISUAL_TYPES]
+
+    mcq_correct = sum(b.get('override_score', b.get('student_score', 0)) for b in mcq_qs)
+    mcq_max     = sum(b.get('max_marks', 0) for b in mcq_qs)
+    mcq_pct     = round((mcq_correct / mcq_max) * 100, 1) if mcq_max > 0 else 0.0
+
+    typing_tasks = []
+    for b in typing_qs:
+        fb  = b.get('ai_feedback', {})
+        acc = fb.get('accuracy', 0)
+        typing_tasks.append({'question_id': b.get('question_id'), 'type': b.get('type'),
+                             'wpm': fb.get('net_wpm', 0), 'accuracy': acc, 'passed': acc >= 80})
+    avg_wpm      = round(sum(t['wpm']      for t in typing_tasks) / len(typing_tasks), 1) if typing_tasks else 0
+    avg_accuracy = round(sum(t['accuracy'] for t in typing_tasks) / len(typing_tasks), 1) if typing_tasks else 100
+    typing_passed = all(t['passed'] for t in typing_tasks) if typing_tasks else True
+
+    visual_ranks = []
+    for b in visual_qs:
+        fb   = b.get('ai_feedback', {})
+        rank = fb.get('rank', 'Bad')
+        visual_ranks.append({'question_id': b.get('question_id'), 'type': b.get('type'),
+                             'rank': rank, 'feedback': fb.get('feedback', ''),
+                             'passed': rank in ('Good', 'Medium')})
+    visual_passed_count = sum(1 for q in visual_ranks if q['passed'])
+    visual_total        = len(visual_ranks)
+    visual_pass_pct     = round((visual_passed_count / visual_total) * 100) if visual_total > 0 else 100
+    visual_passed = all(q['passed'] for q in visual_ranks) if visual_ranks else True
+
+    summary = {
+        'mcq_jumble': {'score_pct': mcq_pct, 'correct_marks': mcq_correct,
+                       'max_marks': mcq_max, 'question_count': len(mcq_qs)},
+        'typing':  {'tasks': typing_tasks, 'avg_wpm': avg_wpm, 'avg_accuracy': avg_accuracy,
+                    'benchmark_wpm': 30, 'passed': typing_passed,
+                    'fail_reasons': [f"Task {i+1} accuracy {t['accuracy']}% below 80%"
+                                     for i, t in enumerate(typing_tasks) if not t['passed']],
+                    'question_count': len(typing_qs)},
+        'visual':  {'questions': visual_ranks, 'passed': visual_passed,
+                    'pass_pct': visual_pass_pct, 'passed_count': visual_passed_count,
+                    'question_count': visual_total},
+        'overall_passed': typing_passed and visual_passed
+    }
+    return summary, mcq_correct   # raw correct marks, NOT a percentage
@@ -0,0 +1,284 @@
+"""
+Section-type registry — the single place that declares every question bank.
+
+Each SectionSpec says which bank file a template section draws from, which
+"type" filter applies inside shared files, how a bank item becomes an exam
+question, how a submitted answer is graded and which scoring bucket the
+result is summarised under. The generator, the admin bank endpoints and the
+grading dispatch in finish_exam / re-evaluate all look sections up here.
+
+Adding a bank means adding one entry to SECTION_TYPES.
+"""
+import asyncio
+import json
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Any, Awaitable, Callable, Dict, FrozenSet, List, Optional
+
+from config import settings
+from services import transformers
+from services.ai_engine import grade_packed, planning_requests, prefilled_responses
+from services.response_cache import response_cache
+from services.grading import (
+    grade_video_question,
+    grade_image_question,
+    grade_image_count_question,
+    grade_multi_image_question,
+    grade_reading_question,
+    grade_jumble_question,
+    grade_mcq_question,
+    grade_typing_question,
+    ai_grading_slots,
+    run_ai_grader,
+)
+
+# Scoring buckets used by the v2 section_summary
+BUCKET_VISUAL = "visual"   # Good/Medium/Bad rank, does not count toward total
+BUCKET_TYPING = "typing"   # WPM/accuracy pass-fail, does not count toward total
+BUCKET_MCQ    = "mcq"      # objective marks — counts toward total_score
+
+# grader(question_dict, student_text, exam_session_or_None) -> {"score", "breakdown"}
+Grader = Callable[[Dict[str, Any], str, Any], Awaitable[Dict[str, Any]]]
+# transform(bank_item, section_type, marks, perm=None) -> question_dict
+Transformer = Callable[..., Dict[str, Any]]
+
+
+@dataclass(frozen=True)
+class SectionSpec:
+    name: str
+    bank_file: Optional[str]        # None = question type produced by another section
+    transform: Optional[Transformer]
+    grade: Grader
+    bucket: str
+    type_filter: Optional[str] = None   # item "type" to keep when a bank file is shared
+    ai_graded: bool = False             # graded by Claude (re-evaluate, concurrency limits)
+
+
+# ─── Grader adapters (session question dict → grading.py signatures) ─────────
+
+async def _grade_video(q, student_text, session):
+    grading_config = q.get("grading_config") or {}
+    content = q.get("content") or {}
+    return await grade_video_question(
+        student_text,
+        grading_config.get("reference", ""),
+        grading_config.get("key_ideas", []),
+        content.get("title", "Video description task"),
+        alternative_answers=grading_config.get("alternative_answers", []),
+        acceptable_synonyms=grading_config.get("acceptable_synonyms", {}),
+        required_prefix=grading_config.get("required_prefix", []),
+        question_type=q.get("type", "video"),
+    )
+
+
+async def _grade_image(q, student_text, session):
+    grading_config = q.get("grading_config") or {}
+    content = q.get("content") or {}
+    return await grade_image_question(
+        student_text,
+        grading_config.get("reference", ""),
+        grading_config.get("key_ideas", []),
+        content.get("title", "Image description task"),
+        alternative_answers=grading_config.get("alternative_answers", []),
+        acceptable_synonyms=grading_config.get("acceptable_synonyms", {}),
+        question_type=q.get("type", "image"),
+    )
+
+
+async def _grade_reading(q, student_text, session):
+    grading_config = q.get("grading_config") or {}
+    content = q.get("content") or {}
+    return await grade_reading_question(
+        student_text,
+        content.get("passage", ""),
+        grading_config.get("reference", ""),
+        grading_config.get("key_ideas", [])
+    )
+
+
+async def _grade_jumble(q, student_text, session):
+    grading_config = q.get("grading_config") or {}
+    return await grade_jumble_question(student_text, grading_config.get("correct_answer", ""), q["marks"])
+
+
+async def _grade_mcq(q, student_text, session):
+    grading_config = q.get("grading_config") or {}
+    return await grade_mcq_question(student_text, grading_config.get("correct_answer", ""), q["marks"])
+
+
+async def _grade_multi_image(q, student_text, session):
+    grading_config = q.get("grading_config") or {}
+    return await grade_multi_image_question(
+        student_text,
+        grading_config.get("sub_images", []),
+        grading_config.get("marks_per_image", 4)
+    )
+
+
+async def _grade_image_count(q, student_text, session):
+    grading_config = q.get("grading_config") or {}
+    return await grade_image_count_question(
+        student_text,
+        grading_config.get("correct_answer", 0),
+        q["marks"],
+        grading_config.get("tolerance", 0)
+    )
+
+
+async def _grade_typing(q, student_text, session):
+    grading_config = q.get("grading_config") or {}
+    try:
+        answer_data = json.loads(student_text)
+        typed_text = answer_data.get("typed_text", "")
+        client_time = answer_data.get("time_seconds", 0)
+    except (json.JSONDecodeError, TypeError, AttributeError):
+        # Not the {"typed_text", "time_seconds"} payload (AttributeError: JSON but not an object)
+        typed_text = student_text
+        client_time = 0
+
+    # Server-side time validation
+    time_limit = grading_config.get("time_limit", 60)
+    if session and session.started_at:
+        elapsed = (datetime.now(timezone.utc) - session.started_at.replace(tzinfo=timezone.utc)).total_seconds()
+        if client_time > 0 and client_time <= elapsed + 5:
+            time_taken = client_time
+        else:
+            time_taken = min(elapsed, time_limit)
+    else:
+        time_taken = min(client_time, time_limit) if client_time > 0 else time_limit
+
+    return await grade_typing_question(
+        typed_text,
+        grading_config.get("original_passage", ""),
+        time_taken,
+        q["marks"],
+        grading_mode=grading_config.get("grading_mode", "both")
+    )
+
+
+# ─── Registry ────────────────────────────────────────────────────────────────
+
+def _spec(name, bank_file, transform, grade, bucket, **kwargs) -> SectionSpec:
+    return SectionSpec(name=name, bank_file=bank_file, transform=transform,
+                       grade=grade, bucket=bucket, **kwargs)
+
+
+SECTION_TYPES: Dict[str, SectionSpec] = {s.name: s for s in (
+    _spec("video",               "video.json",               transformers.transform_video,       _grade_video,       BUCKET_VISUAL, ai_graded=True),
+    _spec("video-robot",         "video_robot.json",         transformers.transform_video,       _grade_video,       BUCKET_VISUAL, ai_graded=True),
+    _spec("image",               "image.json",               transformers.transform_image,       _grade_image,       BUCKET_VISUAL, ai_graded=True),
+    # counting + image MCQ questions share the woven bank
+    _spec("image-count",         "woven_test.json",          transformers.transform_image_count, _grade_image_count, BUCKET_MCQ, type_filter="image-count"),
+    _spec("mcq-image",           "woven_test.json",          transformers.transform_mcq_image,   _grade_mcq,         BUCKET_MCQ, type_filter="mcq-image"),
+    # annotation guideline MCQ (woven2) — all items kept, multi-image ones included
+    _spec("mcq-annotation",      "woven2_test.json",         transformers.transform_mcq_image,   _grade_mcq,         BUCKET_MCQ),
+    _spec("reading",             "reading.json",             transformers.transform_reading,     _grade_reading,     BUCKET_MCQ, ai_graded=True),
+    _spec("jumble",              "jumble.json",              transformers.transform_jumble,      _grade_jumble,      BUCKET_MCQ),
+    _spec("mcq-grammar",         "mcq_grammar.json",         transformers.transform_mcq,         _grade_mcq,         BUCKET_MCQ),
+    _spec("mcq-context",         "mcq_context.json",         transformers.transform_mcq,         _grade_mcq,         BUCKET_MCQ),
+    _spec("mcq-reading",         "mcq_reading.json",         transformers.transform_mcq,         _grade_mcq,         BUCKET_MCQ),
+    _spec("mcq-logical",         "mcq_logical.json",         transformers.transform_mcq,         _grade_mcq,         BUCKET_MCQ),
+    _spec("mcq-number-series",   "mcq_number_series.json",   transformers.transform_mcq,         _grade_mcq,         BUCKET_MCQ),
+    _spec("mcq-blood-relations", "mcq_blood_relations.json", transformers.transform_mcq,         _grade_mcq,         BUCKET_MCQ),
+    _spec("mcq-odd-one-out",     "mcq_odd_one_out.json",     transformers.transform_mcq,         _grade_mcq,         BUCKET_MCQ),
+    _spec("typing",              "typing.json",              transformers.transform_typing,      _grade_typing,      BUCKET_TYPING),
+    _spec("typing-easy",         "typing_easy.json",         transformers.transform_typing,      _grade_typing,      BUCKET_TYPING),
+    _spec("typing-advanced",     "typing_advanced.json",     transformers.transform_typing,      _grade_typing,      BUCKET_TYPING),
+)}
+
+# Question types that only exist as the output of another section's transformer
+# (mcq-image / mcq-annotation emit "mcq-multi-image" for multi-image items)
+DERIVED_QUESTION_TYPES: Dict[str, SectionSpec] = {s.name: s for s in (
+    _spec("mcq-multi-image", None, None, _grade_multi_image, BUCKET_MCQ),
+)}
+
+
+def get_section(section_type: str) -> Optional[SectionSpec]:
+    """Spec for a selectable template section type."""
+    return SECTION_TYPES.get(section_type)
+
+
+def get_question_spec(question_type: str) -> Optional[SectionSpec]:
+    """Spec for a generated question's type (sections + derived types)."""
+    return SECTION_TYPES.get(question_type) or DERIVED_QUESTION_TYPES.get(question_type)
+
+
+def types_in_bucket(bucket: str) -> FrozenSet[str]:
+    return frozenset(
+        name for name, spec in {**SECTION_TYPES, **DERIVED_QUESTION_TYPES}.items()
+        if spec.bucket == bucket
+    )
+
+
+VISUAL_TYPES = types_in_bucket(BUCKET_VISUAL)
+TYPING_TYPES = types_in_bucket(BUCKET_TYPING)
+AI_GRADED_TYPES = frozenset(name for name, spec in SECTION_TYPES.items() if spec.ai_graded)
+
+
+MANUAL_REVIEW = {"score": 0, "breakdown": {"error": "Manual review needed"}}
+# The bank item behind a compact session question can no longer be found
+# (services/session_store.py) — never graded against its empty config
+MISSING_ITEM_REVIEW = {
+    "score": 0,
+    "breakdown": {"error": "Manual review needed: question no longer available in the bank", "missing_item": True},
+}
+
+
+async def _prefetch_packed(questions: List[Dict[str, Any]], answers: Dict[str, Any], session) -> Dict[str, dict]:
+    """
+    AI_PACKED_VISUAL_GRADING: grade all of a candidate's visual answers that
+    are not cached yet with one packed Claude request. A dry run of the normal
+    graders (ai_engine.planning_requests) yields the per-question requests, so
+    the packed call covers exactly what the per-question path would send.
+    Returns {cache key: grading} for ai_engine.prefilled_responses().
+    """
+    visual = [
+        (q, answers.get(str(q["temp_id"]), ""))
+        for q in questions
+        if q["type"] in VISUAL_TYPES and SECTION_TYPES[q["type"]].ai_graded
+    ]
+    if len(visual) < 2:
+        return {}
+    with planning_requests() as plan:
+        await asyncio.gather(*(get_question_spec(q["type"]).grade(q, text, session) for q, text in visual))
+    keys = await response_cache.missing(list(plan)) if settings.AI_CACHE_ENABLED else list(plan)
+    if len(keys) < 2:
+        return {}
+    try:
+        # One packed request takes one AI grading slot
+        async with ai_grading_slots:
+            return await grade_packed({key: plan[key] for key in keys})
+    except Exception as e:
+        print(f"[PACKED] Packed grading failed, grading one by one: {e}")
+        return {}
+
+
+async def grade_paper(questions: List[Dict[str, Any]], answers: Dict[str, Any], session) -> List[Dict[str, Any]]:
+    """
+    Grades every question of a session paper; returns grade dicts in paper order.
+    AI-graded questions (Claude round-trips) are started together and bounded by
+    AI_GRADING_CONCURRENCY; objective graders never hit the network and complete
+    inline while the AI calls are in flight. With AI_PACKED_VISUAL_GRADING the
+    visual answers are first graded together in one request.
+    """
+    prefetched = await _prefetch_packed(questions, answers, session) if settings.AI_PACKED_VISUAL_GRADING else {}
+
+    grades: List[Optional[Dict[str, Any]]] = [None] * len(questions)
+    ai_tasks = {}
+    with prefilled_responses(prefetched):
+        for i, q in enumerate(questions):
+            student_text = answers.get(str(q["temp_id"]), "")
+            spec = get_question_spec(q["type"])
+            if not spec:
+                grades[i] = MANUAL_REVIEW
+            elif q.get("missing_item"):
+                grades[i] = MISSING_ITEM_REVIEW
+            elif spec.ai_graded:
+                ai_tasks[i] = asyncio.ensure_future(run_ai_grader(spec.grade(q, student_text, session)))
+            else:
+                grades[i] = await spec.grade(q, student_text, session)
+
+    if ai_tasks:
+        for i, grade_data in zip(ai_tasks, await asyncio.gather(*ai_tasks.values())):
+            grades[i] = grade_data
+    return grades
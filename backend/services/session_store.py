@@ -0,0 +1,114 @@
+"""
+Compact ExamSession.generated_questions encoding.
+
+A fully generated paper repeats every reading passage, option dict and
+sub-image list for every candidate (tens of KB per row). When
+COMPACT_SESSIONS is on, sessions store only what is needed to rebuild the
+paper from the in-memory bank:
+
+    {
+        "format": "compact-v1",
+        "banks": {"mcq_grammar.json": "<sha1 of the bank source>", ...},
+        "questions": [
+            {"id": 1, "s": "mcq-grammar", "i": 17, "k": "a1b2c3d4e5f6", "m": 2, "p": [2, 0, 1]},
+            ...
+        ]
+    }
+
+i = position in the section's bank view, k = item_key() of that item,
+m = marks per question, p = option / jumble permutation. If the bank has
+changed since the session was written, the paper is rebuilt from the
+recorded bank version (BankRegistry.get_version) — callers fetch it from the
+bank_versions table first with services.bank_versions.load(). Without it,
+items are looked up by key in the live bank; a question that cannot be found
+either way comes back with missing_item set, and the graders refuse to score
+it. Legacy rows (a plain list of full questions) are returned as-is,
+so every reader goes through expand_paper() regardless of the row's age.
+"""
+from typing import Any, Dict, List, Optional, Union
+
+from services.banks import bank_registry, item_key
+from services.sections import get_section
+
+COMPACT_FORMAT = "compact-v1"
+
+StoredPaper = Union[List[Dict[str, Any]], Dict[str, Any], None]
+
+
+def is_compact(stored: StoredPaper) -> bool:
+    return isinstance(stored, dict) and stored.get("format") == COMPACT_FORMAT
+
+
+def encode_paper(questions: List[Dict[str, Any]]) -> StoredPaper:
+    """Compact form of a freshly generated paper. Falls back to the full list
+    if any question lacks bank provenance (e.g. built outside the generator)."""
+    banks: Dict[str, str] = {}
+    refs = []
+    for q in questions:
+        source = q.get("bank_item")
+        spec = get_section(source.get("section")) if source else None
+        snapshot = bank_registry.get(spec.bank_file) if spec else None
+        if not snapshot:
+            return questions
+        banks[spec.bank_file] = snapshot.digest
+        ref = {
+            "id": q["temp_id"],
+            "s": source["section"],
+            "i": source["index"],
+            "k": source["key"],
+            # multi-image questions scale marks by sub-image count; store the per-item marks
+            "m": q.get("grading_config", {}).get("marks_per_image", q["marks"]),
+        }
+        if q.get("perm") is not None:
+            ref["p"] = q["perm"]
+        refs.append(ref)
+    return {"format": COMPACT_FORMAT, "banks": banks, "questions": refs}
+
+
+def _rebuild(ref: Dict[str, Any], banks: Dict[str, str]) -> Dict[str, Any]:
+    section_type = ref["s"]
+    spec = get_section(section_type)
+    item: Optional[Dict[str, Any]] = None
+
+    # The bank version this session was drawn from (from bank_versions if edited since)
+    snapshot = bank_registry.get_version(spec.bank_file, banks.get(spec.bank_file)) if spec else None
+    exact = snapshot is not None
+    if snapshot is None and spec:
+        snapshot = bank_registry.get(spec.bank_file)
+
+    if snapshot:
+        view = snapshot.view(spec.type_filter)
+        position: Optional[int] = ref["i"]
+        if not exact:
+            # That version is gone — locate the unchanged item by key in the live bank
+            if not (0 <= position < len(view) and item_key(view[position]) == ref["k"]):
+                position = snapshot.find(ref["k"], spec.type_filter)
+        if position is not None and 0 <= position < len(view):
+            item = view[position]
+
+    if item is None:
+        print(f"[SESSION] Bank item {section_type}/{ref['k']} no longer available")
+        return {
+            "temp_id": ref["id"],
+            "type": section_type,
+            "question_type": section_type,
+            "marks": ref["m"],
+            "content": {},
+            "grading_config": {},
+            "missing_item": True,
+        }
+
+    q = spec.transform(item, section_type, ref["m"], ref.get("p"))
+    q["temp_id"] = ref["id"]
+    q["type"] = q.get("question_type", section_type)
+    return q
+
+
+def expand_paper(stored: StoredPaper) -> List[Dict[str, Any]]:
+    """Full question list for a stored session paper (compact or legacy)."""
+    if not stored:
+        return []
+    if not is_compact(stored):
+        return stored
+    banks = stored.get("banks", {})
+    return [_rebuild(ref, banks) for ref in stored.get("questions", [])]
@@ -0,0 +1,169 @@
+"""
+TF-IDF text similarity over the question banks.
+
+The bank texts answers are compared with — reading passages, reference
+captions and summaries, alternative answers and key ideas of every
+AI-graded section — are vectorised once per bank version: IDF is fitted on
+all of them, and each text's unit-length sparse vector is stored. A student
+answer is vectorised once and scored against those precomputed vectors
+inline, so there is no thread-pool hop and no re-tokenising of the bank side
+per call. The index is rebuilt lazily when a bank file changes; warm() builds
+it at startup, right after the banks are loaded.
+
+  similarity(a, b)               cosine similarity of two texts (0-1)
+  similarities(text, targets)    one answer against many texts
+  batch_similarities(texts, ts)  many answers against many texts — a sparse
+                                 matrix product through an inverted index of
+                                 the targets, touching only shared terms
+  key_idea_coverage(text, ideas) share of key ideas whose IDF-weighted terms
+                                 are mostly present in the answer
+
+Vectors are plain {term: weight} dicts; TfidfModel takes any analyzer, so
+the cascade's character n-gram scorer (services/local_scorer.py) shares it.
+"""
+import math
+import re
+from collections import Counter, defaultdict
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from services.banks import bank_registry
+
+Vector = Dict[str, float]
+
+_TOKEN = re.compile(r"\w+")
+
+
+def tokens(text: str) -> List[str]:
+    """Lower-cased word tokens (punctuation dropped)."""
+    return _TOKEN.findall((text or "").lower())
+
+
+class TfidfModel:
+    """Smoothed IDF fitted on a document collection; sublinear TF; unit-length vectors."""
+
+    def __init__(self, documents: Iterable[str], analyzer: Callable[[str], Iterable[str]] = tokens):
+        self.analyzer = analyzer
+        df = Counter()
+        n = 0
+        for document in documents:
+            df.update(set(analyzer(document)))
+            n += 1
+        self.idf = {term: math.log((1 + n) / (1 + count)) + 1 for term, count in df.items()}
+        self.unseen_idf = math.log(1 + n) + 1   # a term no bank text contains
+
+    def weight(self, term: str) -> float:
+        return self.idf.get(term, self.unseen_idf)
+
+    def vector(self, text: str) -> Vector:
+        counts = Counter(self.analyzer(text))
+        weights = {term: (1 + math.log(tf)) * self.weight(term) for term, tf in counts.items()}
+        norm = math.sqrt(sum(w * w for w in weights.values()))
+        return {term: w / norm for term, w in weights.items()} if norm else {}
+
+
+def cosine(a: Vector, b: Vector) -> float:
+    if len(a) > len(b):
+        a, b = b, a
+    return sum(w * b.get(term, 0.0) for term, w in a.items())
+
+
+# ─── Bank text index ─────────────────────────────────────────────────────────
+class BankTextIndex:
+    """TF-IDF model and precomputed vectors of one version of the AI-graded banks."""
+
+    def __init__(self, digests: Tuple[str, ...], texts: Sequence[str]):
+        self.digests = digests
+        self.model = TfidfModel(texts)
+        self.vectors: Dict[str, Vector] = {text: self.model.vector(text) for text in texts}
+
+    def vector(self, text: str) -> Vector:
+        """Precomputed for bank texts, computed on the fly for anything else."""
+        vector = self.vectors.get(text)
+        return vector if vector is not None else self.model.vector(text or "")
+
+
+_index: Optional[BankTextIndex] = None
+
+
+def _bank_texts(item: dict, spec) -> Iterable[str]:
+    # The transformer yields exactly the strings the graders receive
+    question = spec.transform(item, spec.name, 0)
+    content, config = question.get("content") or {}, question.get("grading_config") or {}
+    yield content.get("passage")
+    yield config.get("reference")
+    yield from config.get("alternative_answers") or []
+    yield from config.get("key_ideas") or []
+
+
+def index() -> BankTextIndex:
+    """The index of the current bank versions, rebuilt when an AI-graded bank changes."""
+    global _index
+    from services.sections import SECTION_TYPES   # sections imports grading, which imports us
+
+    specs = [spec for spec in SECTION_TYPES.values() if spec.ai_graded]
+    snapshots = {spec.name: bank_registry.get(spec.bank_file) for spec in specs}
+    digests = tuple(snapshot.digest if snapshot else "" for snapshot in snapshots.values())
+    if _index is None or _index.digests != digests:
+        texts = {}
+        for spec in specs:
+            snapshot = snapshots[spec.name]
+            for item in (snapshot.view(spec.type_filter) if snapshot else ()):
+                for text in _bank_texts(item, spec):
+                    if isinstance(text, str) and text.strip():
+                        texts[text] = None
+        _index = BankTextIndex(digests, list(texts))
+    return _index
+
+
+def warm() -> int:
+    """Build the index now (startup). Returns the number of precomputed texts."""
+    return len(index().vectors)
+
+
+def similarity(text1: str, text2: str) -> float:
+    """Cosine similarity of two texts under the bank TF-IDF weights."""
+    if not text1 or not text2:
+        return 0.0
+    current = index()
+    return cosine(current.vector(text1), current.vector(text2))
+
+
+def similarities(text: str, targets: Sequence[str]) -> List[float]:
+    """Similarity of one answer to each target, vectorising the answer once."""
+    current = index()
+    answer = current.vector(text) if text else {}
+    return [cosine(answer, current.vector(t)) if t else 0.0 for t in targets]
+
+
+def batch_similarities(texts: Sequence[str], targets: Sequence[str]) -> List[List[float]]:
+    """len(texts) × len(targets) similarity matrix. The targets are inverted
+    into term -> [(column, weight)], so each answer only visits the postings
+    of its own terms."""
+    current = index()
+    postings: Dict[str, List[Tuple[int, float]]] = defaultdict(list)
+    for column, target in enumerate(targets):
+        for term, weight in current.vector(target).items():
+            postings[term].append((column, weight))
+    matrix = []
+    for text in texts:
+        row = [0.0] * len(targets)
+        for term, weight in current.vector(text).items():
+            for column, target_weight in postings.get(term, ()):
+                row[column] += weight * target_weight
+        matrix.append(row)
+    return matrix
+
+
+def key_idea_coverage(student_text: str, key_ideas: Sequence[str]) -> float:
+    """Share of key ideas with more than half of their IDF weight present in the answer."""
+    if not key_ideas:
+        return 1.0
+    current = index()
+    present = set(tokens(student_text))
+    covered = 0
+    for idea in key_ideas:
+        idea_terms = set(tokens(idea))
+        total = sum(current.model.weight(t) for t in idea_terms)
+        if total and sum(current.model.weight(t) for t in idea_terms & present) / total > 0.5:
+            covered += 1
+    return covered / len(key_ideas)
@@ -0,0 +1,260 @@
+"""
+Bank item -> exam question transformers.
+
+Each transformer takes one raw bank item and maps it onto the internal
+question structure stored in ExamSession.generated_questions:
+    {"question_type", "marks", "content", "grading_config"}
+Options / jumble labels are shuffled here so every candidate sees a
+different letter assignment.
+
+Every shuffle goes through a permutation (list of source indices). Passing
+perm=None draws a fresh random one; passing a stored perm replays the exact
+same question, which is how compact ExamSessions are rebuilt. The perm that
+was used is recorded on the question as q["perm"].
+"""
+import random
+from typing import Any, Dict, List, Optional
+
+
+def _permutation(n: int, perm: Optional[List[int]]) -> List[int]:
+    """Use the stored perm if it fits n items, otherwise draw a random one."""
+    if perm is not None and sorted(perm) == list(range(n)):
+        return list(perm)
+    return random.sample(range(n), n)
+
+
+def _base(section_type: str, marks: int) -> Dict[str, Any]:
+    return {
+        "question_type": section_type,
+        "marks": marks,
+        "content": {},
+        "grading_config": {}
+    }
+
+
+def _shuffle_options(original_options: Dict[str, str], original_correct: str, perm: Optional[List[int]]):
+    """Shuffle option texts across the same keys. Returns (new_options, new_correct, perm)."""
+    correct_text = original_options.get(original_correct, "")
+
+    # Shuffle: get all option texts, shuffle, reassign to A, B, C...
+    option_keys = sorted(original_options.keys())  # ["A", "B", "C"]
+    perm = _permutation(len(option_keys), perm)
+    option_texts = [original_options[option_keys[p]] for p in perm]
+
+    new_options = {}
+    new_correct = original_correct
+    for i, key in enumerate(option_keys):
+        new_options[key] = option_texts[i]
+        if option_texts[i] == correct_text:
+            new_correct = key
+    return new_options, new_correct, perm
+
+
+# 1. Video (both legacy and robot episode types)
+def transform_video(item: Dict[str, Any], section_type: str, marks: int, perm: Optional[List[int]] = None) -> Dict[str, Any]:
+    q_structure = _base(section_type, marks)
+    q_structure["content"] = {
+        "url": item.get("video_url"),
+        "title": item.get("title") or item.get("prompt", "Video description task")
+    }
+    q_structure["grading_config"] = {
+        "reference": item.get("reference_context") or item.get("correct_answer", ""),
+        "key_ideas": item.get("key_ideas") or list(item.get("key_elements", {}).values()) or [],
+        "alternative_answers": item.get("alternative_answers", []),
+        "required_prefix": item.get("required_prefix", []),
+        "acceptable_synonyms": item.get("acceptable_synonyms", {}),
+        "marks_distribution": item.get("marks_distribution", {})
+    }
+    return q_structure
+
+
+# 2. Image (AI-description)
+def transform_image(item: Dict[str, Any], section_type: str, marks: int, perm: Optional[List[int]] = None) -> Dict[str, Any]:
+    q_structure = _base(section_type, marks)
+    q_structure["content"] = {
+        "url": item.get("image_url") or item.get("video_url"),  # Fallback in case of wrong field
+        "title": item.get("title") or item.get("prompt", "Image description task")  # Fallback to prompt
+    }
+    q_structure["grading_config"] = {
+        "reference": item.get("reference_context") or item.get("correct_answer", ""),  # Fallback to correct_answer
+        "key_ideas": item.get("key_ideas") or list(item.get("key_elements", {}).values()) or [],
+        "alternative_answers": item.get("alternative_answers", []),
+        "acceptable_synonyms": item.get("acceptable_synonyms", {})
+    }
+    return q_structure
+
+
+# 2b. Image-Count (type a number, exact match grading)
+def transform_image_count(item: Dict[str, Any], section_type: str, marks: int, perm: Optional[List[int]] = None) -> Dict[str, Any]:
+    q_structure = _base(section_type, marks)
+    q_structure["content"] = {
+        "url": item.get("image_url"),
+        "title": item.get("title"),
+        "question": item.get("title"),
+    }
+    q_structure["grading_config"] = {
+        "correct_answer": item.get("correct_answer"),
+        "tolerance": item.get("tolerance", 0)
+    }
+    return q_structure
+
+
+# 2c. MCQ-Image (image shown + shuffled MCQ options)
+def transform_mcq_image(item: Dict[str, Any], section_type: str, marks: int, perm: Optional[List[int]] = None) -> Dict[str, Any]:
+    q_structure = _base(section_type, marks)
+
+    # Handle mcq-multi-image items that end up in this section
+    if item.get("type") == "mcq-multi-image":
+        # Shuffle options once for the whole question
+        original_options = item.get("options", {})
+        option_keys  = sorted(original_options.keys())
+        perm = _permutation(len(option_keys), perm)
+        option_texts = [original_options[option_keys[p]] for p in perm]
+        new_options = {k: option_texts[i] for i, k in enumerate(option_keys)}
+        text_to_key = {v: k for k, v in new_options.items()}
+
+        # Remap each sub-image's correct answer to shuffled positions
+        sub_images = []
+        for sub in item.get("sub_images", []):
+            orig_correct_text = original_options.get(sub["correct_answer"], "")
+            new_correct = text_to_key.get(orig_correct_text, sub["correct_answer"])
+            sub_images.append({
+                "url": sub["url"],
+                "correct_answer": new_correct,
+                "correct_answer_text": orig_correct_text
+            })
+
+        q_structure["question_type"] = "mcq-multi-image"
+        q_structure["marks"] = marks * len(sub_images)
+        q_structure["content"] = {
+            "guideline": item.get("guideline"),
+            "scenario" : item.get("scenario"),
+            "question" : item.get("title"),
+            "note"     : item.get("note"),
+            "options"  : new_options,
+            "sub_images": sub_images
+        }
+        q_structure["grading_config"] = {
+            "sub_images": sub_images,   # each has correct_answer
+            "marks_per_image": marks
+        }
+        q_structure["perm"] = perm
+        return q_structure
+
+    new_options, new_correct, perm = _shuffle_options(item.get("options", {}), item.get("correct_answer", ""), perm)
+    q_structure["content"] = {
+        "url"      : item.get("image_url"),
+        "guideline": item.get("guideline"),
+        "scenario" : item.get("scenario"),
+        "note"     : item.get("Note") or item.get("note"),
+        "question" : item.get("title"),
+        "options"  : new_options
+    }
+    q_structure["grading_config"] = {
+        "correct_answer": new_correct
+    }
+    q_structure["perm"] = perm
+    return q_structure
+
+
+# 3. Reading (Summary)
+def transform_reading(item: Dict[str, Any], section_type: str, marks: int, perm: Optional[List[int]] = None) -> Dict[str, Any]:
+    q_structure = _base(section_type, marks)
+    q_structure["content"] = {
+        "passage": item.get("passage"),
+        "title": item.get("title")
+    }
+    q_structure["grading_config"] = {
+        "reference": item.get("reference_summary"),
+        "key_ideas": item.get("key_ideas", [])
+    }
+    return q_structure
+
+
+# 4. Jumble — shuffle letter assignments so answer isn't always A B C D
+def transform_jumble(item: Dict[str, Any], section_type: str, marks: int, perm: Optional[List[int]] = None) -> Dict[str, Any]:
+    q_structure = _base(section_type, marks)
+    original_jumble = item.get("jumble", {})
+    original_answer = (item.get("answer") or item.get("correct_answer", "")).strip()
+
+    # Get the correct sentence order from original answer
+    answer_keys = original_answer.split()  # e.g. ["B", "A", "C", "D"]
+    # Build ordered sentence parts in correct reading order
+    ordered_parts = [original_jumble[k] for k in answer_keys if k in original_jumble]
+
+    # Create new random letter assignment
+    labels = list(original_jumble.keys())  # ["A", "B", "C", "D"]
+    perm = _permutation(len(labels), perm)
+    shuffled_labels = [labels[p] for p in perm]
+
+    # Map: ordered_parts[i] -> shuffled_labels[i]
+    # So the correct answer is shuffled_labels in order
+    new_jumble = {}
+    for i, part in enumerate(ordered_parts):
+        new_jumble[shuffled_labels[i]] = part
+    new_correct = " ".join(shuffled_labels)  # e.g. "C A D B"
+
+    parts_list = [f"{k}: {v}" for k, v in sorted(new_jumble.items())]
+    sentence_display = " | ".join(parts_list) if parts_list else ""
+
+    q_structure["content"] = {
+        "jumble": new_jumble,
+        "sentence": sentence_display
+    }
+    q_structure["grading_config"] = {
+        "correct_answer": new_correct
+    }
+    q_structure["perm"] = perm
+    return q_structure
+
+
+# 5. MCQ (Grammar / Reading / Context) — shuffle options
+def transform_mcq(item: Dict[str, Any], section_type: str, marks: int, perm: Optional[List[int]] = None) -> Dict[str, Any]:
+    q_structure = _base(section_type, marks)
+    new_options, new_correct, perm = _shuffle_options(item.get("options", {}), item.get("correct_answer", ""), perm)
+
+    if section_type == "mcq-reading":
+        q_structure["content"] = {
+            "passage": item.get("content"),
+            "question": item.get("question_text"),
+            "options": new_options
+        }
+    else:
+        q_structure["content"] = {
+            "question": item.get("content") or item.get("question_text"),
+            "options": new_options
+        }
+    q_structure["grading_config"] = {
+        "correct_answer": new_correct
+    }
+    q_structure["perm"] = perm
+    return q_structure
+
+
+# 6. Typing Speed (all variants)
+def transform_typing(item: Dict[str, Any], section_type: str, marks: int, perm: Optional[List[int]] = None) -> Dict[str, Any]:
+    q_structure = _base(section_type, marks)
+
+    # Determine grading mode from section type or difficulty field
+    if section_type == "typing-easy":
+        grading_mode = "speed"
+    elif section_type == "typing-advanced":
+        grading_mode = "accuracy"
+    else:
+        grading_mode = "both"  # legacy
+
+    q_structure["type"] = "typing"  # Frontend always renders as 'typing'
+    q_structure["content"] = {
+        "passage": item.get("passage"),
+        "word_count": item.get("word_count"),
+        "time_limit": item.get("time_limit_seconds", 60),
+        "grading_mode": grading_mode,
+    }
+    q_structure["grading_config"] = {
+        "original_passage": item.get("passage"),
+        "time_limit": item.get("time_limit_seconds", 60),
+        "grading_mode": grading_mode,
+        "benchmark_wpm": 30,
+        "benchmark_accuracy": 90
+    }
+    return q_structure
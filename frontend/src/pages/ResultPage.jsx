@@ -49,13 +49,44 @@ const ResultPage = () => {
     const [loading, setLoading] = useState(true);
     const { user } = useAuthStore();
 
+    const [grading, setGrading] = useState(false);
+
     useEffect(() => {
-        api.get(`/exam/results/${resultId}`)
-            .then(res => setResult(res.data))
-            .catch(err => console.error(err))
-            .finally(() => setLoading(false));
+        let cancelled = false;
+        let timer;
+
+        // Finished exams are graded in the background — poll until the report is ready
+        const load = async () => {
+            try {
+                const status = await api.get(`/exam/results/${resultId}/status`);
+                if (cancelled) return;
+                if (status.data.status === 'submitted') {
+                    setGrading(true);
+                    timer = setTimeout(load, 2000);
+                    return;
+                }
+                const res = await api.get(`/exam/results/${resultId}`);
+                if (!cancelled) setResult(res.data);
+            } catch (err) {
+                console.error(err);
+            }
+            if (!cancelled) {
+                setGrading(false);
+                setLoading(false);
+            }
+        };
+        load();
+
+        return () => { cancelled = true; clearTimeout(timer); };
     }, [resultId]);
 
+    if (grading) return (
+        <div className="min-h-screen bg-slate-50 flex flex-col items-center justify-center gap-4">
+            <div className="w-12 h-12 rounded-full border-4 border-blue-600 border-t-transparent animate-spin" />
+            <p className="text-slate-600 font-medium">Grading your answers…</p>
+        </div>
+    );
+
     if (loading) return <div className="min-h-screen bg-slate-50" />;
 
     const backLink = user?.role === 'admin' ? '/admin/results' : '/dashboard';
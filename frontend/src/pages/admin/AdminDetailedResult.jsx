@@ -728,7 +728,9 @@ const AdminDetailedResult = () => {
                                                     <div className="space-y-3">
                                                         <div className="flex items-center gap-3">
                                                             <RankBadge rank={rank || 'Bad'} />
-                                                            {fb.internal_score !== undefined && (
+                                                            {fb.local_graded ? (
+                                                                <span className="text-xs text-slate-400">Graded locally: similarity {fb.internal_score} {rank === 'Good' ? '≥' : '<'} threshold {fb.cascade_threshold}</span>
+                                                            ) : fb.internal_score !== undefined && (
                                                                 <span className="text-xs text-slate-400">Internal score: {fb.internal_score}/15 — Good≥12 · Medium 7-11 · Bad&lt;7</span>
                                                             )}
                                                         </div>